@@ -8,5 +8,6 @@ from .rsfileio_abstract import RSFileIOAbstract
 
 from .rsfile_streams import *
 from .rsfile_factories import *
-from .rsfile_registries import set_rsfile_options, get_rsfile_options
+from .rsfile_registries import set_rsfile_options, get_rsfile_options, AlignedBufferPool, PendingDescriptorPool
+from .rsfile_registries import get_lock_statistics, reset_lock_statistics, dump_lock_state, print_lock_state
 from .rsfile_utilities import *
@@ -45,6 +45,11 @@ def win32_filetime_to_python_timestamp(loworder, highorder):
     return float(win32_timestamp - 116444736000000000) / 10000000
 
 
+def win32_filetime_to_nanoseconds(loworder, highorder):
+    # same as above, without the precision loss of floats
+    return (double_dwords_to_pyint(loworder, highorder) - 116444736000000000) * 100
+
+
 def python_timestamp_to_win32_filetime(pytimestamp):
     win32_timestamp = int((10000000 * pytimestamp) + 116444736000000000)
 
@@ -4,6 +4,21 @@
 from os import O_WRONLY, O_RDONLY, O_RDWR, O_SYNC, O_CREAT, O_EXCL, O_APPEND
 
 from fcntl import F_GETFD, F_SETFD, FD_CLOEXEC
+from fcntl import F_GETFL, F_SETFL
 from fcntl import LOCK_EX, LOCK_SH, LOCK_UN, LOCK_NB
 
 F_FULLFSYNC = 51
+F_NOCACHE = 48  # Mac OS X only
+
+# ioctl() request to share file extents between files (linux)
+FICLONERANGE = 0x4020940D
+
+# fallocate() mode flags (linux)
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# inotify events of file descriptors getting closed, and inotify_init1() flags (linux)
+IN_CLOSE_WRITE = 0x08
+IN_CLOSE_NOWRITE = 0x10
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
@@ -4,20 +4,21 @@
 error = (OSError, IOError)
 # we expose the types of errors that this backend uses (fcntl uses IOError, unlike os module functions...)
 
-from ctypes import create_string_buffer  # R/W fixed-length buffer
-from array import array
-
 import os as _os
 from os import (
     open,
     close,  # not return value
+    dup,
     fstat,
+    stat,  # by path, without opening the file
     lseek,
     ftruncate,  # not return value
     write,  # arguments : (fd, string), returns number of bytes written
     fsync,
-    read,
-)  # directly returns a string
+    read,  # directly returns a string
+    pread,  # arguments : (fd, count, offset), doesn't move the file pointer
+    pwrite,  # arguments : (fd, string, offset), doesn't move the file pointer
+)
 
 # WARNING - On at least some systems, LOCK_EX can only be used if the file descriptor refers to a file opened for
 # writing (RSFile enforces it anyway)
@@ -25,32 +26,212 @@ from os import (
 
 from fcntl import lockf, fcntl  # used both to lock and unlock !
 
+from fcntl import flock  # whole-file locks, owned by the open file description
+
+import fcntl as _fcntl
+import struct as _struct
+
+from fcntl import ioctl
+
 
 from .raw_unix_defines import *  # constants
 
+if hasattr(_os, "O_DIRECT"):  # linux, freebsd...
+    from os import O_DIRECT
+
+if hasattr(_os, "O_CLOEXEC"):  # linux >= 2.6.23, and most modern unixes
+    from os import O_CLOEXEC
+
 if hasattr(_os, "fdatasync"):
     fdatasync = _os.fdatasync
     # else, we just dont't define datasync in the module !
 
 
+if hasattr(_fcntl, "F_OFD_SETLK"):  # linux >= 3.15
+
+    from fcntl import F_OFD_SETLK, F_OFD_SETLKW
+
+    def ofd_lockf(fd, cmd, len=0, start=0, whence=0):
+        # Same signature as lockf(), but these byte-range locks are owned by the open file description,
+        # not by the process, so they are only released when the LAST descriptor sharing it gets closed
+        if cmd == LOCK_UN:
+            lock_type = _fcntl.F_UNLCK
+        elif cmd & LOCK_SH:
+            lock_type = _fcntl.F_RDLCK
+        else:
+            lock_type = _fcntl.F_WRLCK
+        command = F_OFD_SETLK if (cmd & LOCK_NB or cmd == LOCK_UN) else F_OFD_SETLKW
+        # struct flock is (l_type, l_whence, l_start, l_len, l_pid), and l_pid must be 0 for these locks
+        fcntl(fd, command, _struct.pack("hhqqi", lock_type, whence, start, len, 0))
+
+
+# Layout of struct flock, needed to read back F_GETLK results
+if _os.uname()[0] == "Linux":
+    _FLOCK_FORMAT, _FLOCK_FIELDS = "hhqqi", ("l_type", "l_whence", "l_start", "l_len", "l_pid")
+elif _os.uname()[0] in ("Darwin", "FreeBSD", "OpenBSD", "NetBSD", "DragonFly"):
+    _FLOCK_FORMAT, _FLOCK_FIELDS = "qqihh", ("l_start", "l_len", "l_pid", "l_type", "l_whence")
+else:
+    _FLOCK_FORMAT = None
+
+if _FLOCK_FORMAT:
+
+    from fcntl import F_GETLK, F_RDLCK, F_WRLCK, F_UNLCK
+
+    if hasattr(_fcntl, "F_OFD_GETLK"):
+        from fcntl import F_OFD_GETLK
+
+    def getlk(fd, command, lock_type, len=0, start=0, whence=0):
+        # Returns (l_type, l_start, l_len, l_pid) for the first lock which would prevent taking this one,
+        # l_type being F_UNLCK if there is none ; command is F_GETLK or F_OFD_GETLK
+        fields = dict(l_type=lock_type, l_whence=whence, l_start=start, l_len=len, l_pid=0)
+        res = fcntl(fd, command, _struct.pack(_FLOCK_FORMAT, *[fields[name] for name in _FLOCK_FIELDS]))
+        fields = dict(zip(_FLOCK_FIELDS, _struct.unpack(_FLOCK_FORMAT, res)))
+        return (fields["l_type"], fields["l_start"], fields["l_len"], fields["l_pid"])
+
+
 def ltell(fd):
     return lseek(fd, 0, _os.SEEK_CUR)
 
 
-def readinto(fd, buffer, count):
-    # We mimic here the posix read() system call, which works with buffers.
+def buffer_address(buffer):
+    # Returns the memory address of a writable buffer, or None if it can't be known
+    import ctypes
+
+    try:
+        return ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+    except (TypeError, ValueError):  # read-only or empty buffer
+        return None
+
+
+if hasattr(_os, "readv"):
+
+    def readinto(fd, buffer):
+        # The kernel writes straight into the (writable, contiguous) buffer, without intermediate bytes object
+        return _os.readv(fd, [buffer])
 
-    data = _os.read(fd, count)
+else:
 
-    if isinstance(buffer, array):
-        try:
-            buffer[0 : len(data)] = array(b"b", data)
-        except TypeError:
-            buffer[0 : len(data)] = array("b", data)  # mess between py2k and py3k...
-    else:
+    def readinto(fd, buffer):
+        # We mimic here the posix read() system call, which works with buffers.
+        data = _os.read(fd, len(buffer))
         buffer[0 : len(data)] = data
+        return len(data)
+
+if hasattr(_os, "preadv"):
+
+    def preadinto(fd, buffer, offset):
+        return _os.preadv(fd, [buffer], offset)
+
+else:
+
+    def preadinto(fd, buffer, offset):
+        data = _os.pread(fd, len(buffer), offset)
+        buffer[0 : len(data)] = data
+        return len(data)
+
+
+# Maximum count of buffers accepted by a single vectored I/O call
+try:
+    IOV_MAX = _os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 16  # minimum value guaranteed by POSIX (_XOPEN_IOV_MAX)
+
+from os import readv, writev  # these work with lists of buffers
+
+if hasattr(_os, "preadv"):
+    from os import preadv, pwritev  # not available on all unix-like platforms
+
+if hasattr(_os, "posix_fadvise"):  # missing on OSX
+    from os import posix_fadvise
+
+    # advice name -> posix constant
+    FADVISE_PATTERNS = dict(
+        normal=_os.POSIX_FADV_NORMAL,
+        sequential=_os.POSIX_FADV_SEQUENTIAL,
+        random=_os.POSIX_FADV_RANDOM,
+        willneed=_os.POSIX_FADV_WILLNEED,
+        dontneed=_os.POSIX_FADV_DONTNEED,
+        noreuse=_os.POSIX_FADV_NOREUSE,
+    )
+
+if hasattr(_os, "posix_fallocate"):  # missing on OSX
+    from os import posix_fallocate  # arguments : (fd, offset, length), reserves disk blocks
+
+
+def _load_libc():
+    import ctypes
+    import ctypes.util
+
+    return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def _raise_ctypes_errno():
+    import ctypes
+
+    errcode = ctypes.get_errno()
+    raise OSError(errcode, _os.strerror(errcode))
+
+
+def _load_fallocate():
+    # linux-specific fallocate() isn't exposed by the os module, unlike posix_fallocate()
+    import ctypes
+
+    libc = _load_libc()
+    c_fallocate = libc.fallocate64 if hasattr(libc, "fallocate64") else libc.fallocate
+    c_fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    c_fallocate.restype = ctypes.c_int
+
+    def fallocate(fd, mode, offset, length):
+        if c_fallocate(fd, mode, offset, length) != 0:
+            _raise_ctypes_errno()
+
+    return fallocate
+
+
+def _load_inotify():
+    # inotify isn't exposed by the stdlib either
+    import ctypes
+
+    libc = _load_libc()
+    c_inotify_init1 = libc.inotify_init1
+    c_inotify_init1.argtypes = [ctypes.c_int]
+    c_inotify_add_watch = libc.inotify_add_watch
+    c_inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+    def inotify_init1(flags):
+        fd = c_inotify_init1(flags)
+        if fd < 0:
+            _raise_ctypes_errno()
+        return fd
+
+    def inotify_add_watch(fd, path, mask):
+        wd = c_inotify_add_watch(fd, _os.fsencode(path), mask)
+        if wd < 0:
+            _raise_ctypes_errno()
+        return wd
+
+    return inotify_init1, inotify_add_watch
+
+
+if _os.uname()[0] == "Linux":
+    try:
+        fallocate = _load_fallocate()  # arguments : (fd, mode, offset, length)
+    except (ImportError, OSError, AttributeError):
+        pass  # we just don't define fallocate in the module
+    try:
+        inotify_init1, inotify_add_watch = _load_inotify()  # arguments : (flags) and (fd, path, mask)
+    except (ImportError, OSError, AttributeError):
+        pass
+
+if hasattr(_os, "copy_file_range"):  # linux only
+    from os import copy_file_range  # arguments : (src_fd, dst_fd, count, offset_src, offset_dst)
 
-    return len(data)
+if hasattr(_os, "sendfile"):
+    from os import sendfile  # arguments : (out_fd, in_fd, offset, count), only file-to-file on linux
 
+if hasattr(_os, "SEEK_DATA"):
+    from os import SEEK_DATA, SEEK_HOLE  # sparse files navigation
 
 from os import unlink
@@ -8,6 +8,8 @@ SEEK_VALUES = (SEEK_SET, SEEK_CUR, SEEK_END)
 
 DEFAULT_BUFFER_SIZE = 8 * 1024  # in bytes
 
+DIRECT_IO_BUFFER_SIZE = 1024 * 1024  # in bytes, default buffer size of streams bypassing the OS cache
+
 # we backup these, just in case
 from io import open as original_io_open
 from _pyio import open as original_pyio_open
@@ -20,7 +22,16 @@ else:
 HAS_X_OPEN_FLAG = sys.version_info >= (3, 3)
 
 STDLIB_OPEN_FLAGS = set("xarw+bt" + ("U" if sys.version_info < (3, 11) else ""))  # Universal newline got removed in 3.11
-ADVANCED_OPEN_FLAGS = set("RAW+-CNSIEBT")  # + and - are only left for retrocompatibility
+ADVANCED_OPEN_FLAGS = set("RAW+-CNSIQDOEBT")  # + and - are only left for retrocompatibility
+
+# access pattern hints accepted by advise(), modeled after posix_fadvise() advices
+FILE_ACCESS_PATTERNS = ("normal", "sequential", "random", "willneed", "dontneed", "noreuse")
+
+# ways for lock_file() to wait for a contended lock, when it can't block forever
+LOCK_WAIT_STRATEGIES = ("spin", "backoff", "thread", "inotify")
+
+# upper bounds (in seconds) of the buckets of lock wait-time and hold-time histograms
+LOCK_LATENCY_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, float("inf"))
 
 # beware, using C-backed IO doesn't work ATM because of class layout conflicts
 import _pyio as io_module
@@ -34,18 +45,80 @@ class LockingException(IOError):
     """
     Exception raised when rsfile detects a locking problem, but backends
     might raise their own EnvironmentError subclasses, too so beware.
+
+    On timeouts, the *holder* attribute is the :class:`LockHolder` of the conflicting lock, if it could be found.
+
+    When a deadlock between threads of the process is detected (errno EDEADLK, see the "lock_deadlock_detection"
+    option), the *cycle* attribute lists the waits forming that deadlock, as dicts with entries *thread_name*,
+    *handle*, *unique_id*, *start* and *end* (the awaited range), and *blocker_thread_name* and *blocker_handle*
+    (the thread and handle holding, or waiting before us for, a conflicting range).
+    """
+
+    holder = None
+    cycle = None
+
+
+class SlowLockWarning(RuntimeWarning):
+    """
+    Warning emitted when a file lock is held longer than the "slow_lock_threshold" option allows.
     """
 
     pass
 
 
+class PendingDescriptorsWarning(RuntimeWarning):
+    """
+    Warning emitted when more file descriptors are kept pending (see :ref:`rsfile_locking_semantic`)
+    than the "max_pending_descriptors" option allows.
+    """
+
+    pass
+
+
+class LockHolder(object):
+    """
+    Lock preventing another one from being taken, as returned by query_lock().
+
+    *end* is None for locks extending to infinity, and *pid* is None when the owner process is unknown
+    (eg. for open file description locks). *handle* is only known for locks of the current process.
+    """
+
+    def __init__(self, shared, start, end, pid, handle=None):
+        self.shared = shared
+        self.start = start
+        self.end = end
+        self.pid = pid
+        self.handle = handle
+
+    def __repr__(self):
+        return "<LockHolder %s lock on bytes %s-%s, pid=%s handle=%s>" % (
+            "shared" if self.shared else "exclusive",
+            self.start,
+            "EOF" if self.end is None else self.end,
+            self.pid,
+            self.handle,
+        )
+
+
 class FileTimes(object):
-    def __init__(self, access_time, modification_time):
+    def __init__(self, access_time, modification_time, access_time_ns=None, modification_time_ns=None):
         self.access_time = access_time
         self.modification_time = modification_time
+        # integer nanoseconds, when the platform provides them, for exact change detection
+        self.access_time_ns = access_time_ns
+        self.modification_time_ns = modification_time_ns
 
     def __repr__(self):
         return "<FileTimes access_time=%s modification_time=%s>" % (self.access_time, self.modification_time)
 
     def __eq__(self, other):
-        return self.access_time == other.access_time and self.modification_time == other.modification_time
+        if self.access_time != other.access_time or self.modification_time != other.modification_time:
+            return False
+        # floats may not be precise enough to tell apart close times, so nanoseconds are compared too if known
+        for (mine, theirs) in (
+            (self.access_time_ns, other.access_time_ns),
+            (self.modification_time_ns, other.modification_time_ns),
+        ):
+            if mine is not None and theirs is not None and mine != theirs:
+                return False
+        return True
@@ -123,6 +123,10 @@ def rsopen(
 
     'I'       Stream is Inheritable by children processes (by default, it's not)
 
+    'Q'       File will be read seQuentially (access pattern hint)
+    'D'       File content is Dropped from the OS cache when closing the stream (access pattern hint)
+    'O'       Stream bypasses the OS cache (O_DIRECT)
+
     'E'       File is Erased on opening (ignored when "C" is set, new file will be empty anyway)
 
     'B'       Stream is in Binary mode
@@ -163,6 +167,26 @@ def rsopen(
     Note that sometimes child processes must be made aware of the file descriptors/handles
     that they own (this can be done through command-line arguments or other IPC means).
 
+    If "Q" (sequential) : the OS is told, right after opening, that the file will be scanned
+    from beginning to end, so that it may read ahead more aggressively.
+
+    If "D" (drop cache) : when the stream gets closed, the OS is told that the file content won't be needed
+    anymore, so that its pages may be evicted from the OS cache without pushing out the cache of other
+    processes ; this is useful for big one-shot scans or copies. Dirty pages not yet written to disk
+    might be kept in cache anyway.
+
+    If "O" (direct) : data transfers bypass the OS cache, on platforms supporting it (unix-like systems, not
+    windows), so that big write-once or read-once files don't evict the cached data of other processes.
+    Since O_DIRECT requires transfers aligned on filesystem blocks, unaligned parts of transfers (like the tail
+    of the file) are transferred as whole blocks through aligned buffers (see ``AlignedBufferPool``), and data
+    gets copied via these buffers when needed ; partially written blocks are thus read, modified and written back,
+    so concurrent writes to different bytes of a same block must be serialized by callers. Buffered streams
+    default to buffers of DIRECT_IO_BUFFER_SIZE bytes, rounded to whole blocks, and only write whole blocks until
+    they get flushed. Append-mode ("A") streams ignore this flag, since their unaligned tails couldn't be rewritten.
+
+    "Q" and "D" flags only emit hints (see :meth:`advise() <rsfile.rsiobase.RSIOBase.advise>`), which are
+    silently ignored on platforms not supporting them.
+
     "E" requires the stream to be writable ("W" or "A"), except if "C" is set (because then
     we're sure that the file will be empty on opening) ; note that this flag is ignored
     when wrapping an existing fileno/handle.
@@ -287,6 +311,11 @@ def rsopen(
                 # NOW that we've potentially locked the file, we NOW may truncate
                 raw.truncate(0)
 
+            if extended_kwargs["sequential"]:
+                raw.advise("sequential")
+            if extended_kwargs["drop_cache"]:
+                raw._advice_on_close = "dontneed"
+
         if buffering is None:
             buffering = -1
 
@@ -294,13 +323,15 @@ def rsopen(
         if buffering == 1 or buffering < 0 and raw.isatty():
             buffering = -1
             line_buffering = True
+        if buffering < 0 and raw._direct_alignment:
+            buffering = defs.DIRECT_IO_BUFFER_SIZE
         if buffering < 0:
             buffering = defs.DEFAULT_BUFFER_SIZE
             # do not trigger the libc compatibility layer on windows,
             # since anyway it seems to have no st_blksize...
             if raw._fileno:
                 try:
-                    bs = os.fstat(raw._fileno).st_blksize
+                    bs = (raw._open_stats or os.fstat(raw._fileno)).st_blksize
                 except (os.error, AttributeError):
                     pass
                 else:
@@ -308,6 +339,8 @@ def rsopen(
                         buffering = bs
 
         assert buffering >= 0, "abnormal buffering size %r encountered" % buffering
+        if buffering and raw._direct_alignment:
+            buffering = -(-buffering // raw._direct_alignment) * raw._direct_alignment  # whole blocks only
         if buffering == 0:
             if extended_kwargs["binary"]:
                 if thread_safe:
@@ -401,12 +434,13 @@ def parse_standard_args(name, mode, fileno, handle, closefd):
         must_not_create=must_not_create,
         synchronized=False,
         inheritable=False,  # was changed in python stdlib, no more inheritability by default!
+        direct=False,
         fileno=fileno,
         handle=handle,
         closefd=closefd,
     )
 
-    extended_kwargs = dict(truncate=truncate, binary=binary, text=text)
+    extended_kwargs = dict(truncate=truncate, binary=binary, text=text, sequential=False, drop_cache=False)
 
     return (raw_kwargs, extended_kwargs)
 
@@ -427,8 +461,11 @@ def parse_advanced_args(path, mode, fileno, handle, closefd):
 
     synchronized = "S" in mode
     inheritable = "I" in mode
+    direct = "O" in mode
 
     truncate = "E" in mode  # for "Erase"
+    sequential = "Q" in mode
+    drop_cache = "D" in mode
     binary = "B" in modes
     text = "T" in modes
 
@@ -444,11 +481,14 @@ def parse_advanced_args(path, mode, fileno, handle, closefd):
         must_not_create=must_not_create,
         synchronized=synchronized,
         inheritable=inheritable,
+        direct=direct,
         fileno=fileno,
         handle=handle,
         closefd=closefd,
     )
 
-    extended_kwargs = dict(truncate=truncate, binary=binary, text=text)
+    extended_kwargs = dict(
+        truncate=truncate, binary=binary, text=text, sequential=sequential, drop_cache=drop_cache
+    )
 
     return (raw_kwargs, extended_kwargs)
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 
-import os, threading
+import bisect, errno, mmap, os, sys, threading, time, traceback, warnings, weakref
+from contextlib import contextmanager
+
+from . import rsfile_definitions as defs
 
 # ######### DEFAULT PARAMETERS ######## #
 
@@ -10,6 +13,14 @@ _default_rsfile_options = {
     # of service)
     "enforced_locking_timeout_value": None,
     "default_spinlock_delay": 0.1,  # how many seconds the program must sleep between attempts at locking a file
+    "unix_locking_backend": "auto",  # kernel lock flavour used by unix streams: auto, ofd, flock or posix
+    "lock_wait_strategy": "spin",  # how lock_file() waits for contended locks: spin, backoff, thread or inotify
+    "lock_writer_preference": False,  # if True, in-process exclusive lock waiters are served before shared ones
+    "lock_statistics": False,  # if True, lock wait/hold times and conflicts are recorded per file
+    "slow_lock_threshold": None,  # if set, locks held longer than this (in seconds) trigger a SlowLockWarning
+    "max_pending_descriptors": None,  # if set, keeping more descriptors pending triggers a PendingDescriptorsWarning
+    "stat_caching": False,  # if True, streams reuse their last stat snapshot in size() and times()
+    "lock_deadlock_detection": False,  # if True, threads waiting for each other's locks get an EDEADLK error
     # "max_input_load_bytes": None  # Problem - hard to implement, we'd need to hack into every readall() and read()
     # method from io...
     # makes readall() and other greedy operations fail when the data gotten exceeds this size (prevents memory overflow)
@@ -37,6 +48,50 @@ def set_rsfile_options(**options):
       attempts
       at locking a file, when using :meth:`rsfile.lock_file()` with a non-zero timeout argument. Modify this
       value with care, as some libraries might expect a sufficient reactivity for file locking operations.
+    - *unix_locking_backend* ("auto", "ofd", "flock" or "posix", defaults to "auto"): the kind of kernel locks used
+      by streams opened afterwards, on unix-like systems. "posix" locks (lockf) are owned by the process, so
+      closing *any* descriptor of a file releases them all, which forces rsfile to keep closed descriptors
+      pending until the file has no more locks. "ofd" locks (open file description locks, Linux only) don't
+      have this problem, so closes are immediate; but, like "flock" locks, they are shared with child processes
+      inheriting the stream. "flock" only supports whole-file locks, and doesn't interact with posix
+      or ofd locks taken by other programs. "auto" selects "ofd" where available, else "posix".
+      Streams using different backends must not lock the same file concurrently.
+    - *lock_wait_strategy* ("spin", "backoff", "thread" or "inotify", defaults to "spin"): the way streams opened
+      afterwards wait for a contended lock, when :meth:`rsfile.lock_file()` can't block forever (i.e when a timeout
+      is given, or enforced). "spin" sleeps *default_spinlock_delay* between attempts. The other strategies wait
+      for in-process locks to be released, and retry kernel locks after exponentially growing delays (with random
+      jitter, capped by *default_spinlock_delay*). Besides, "thread" blocks on the kernel lock in a helper thread
+      until the deadline, via a file description of its own (with the "ofd" locking backend only, others behave
+      like "backoff"), and "inotify" wakes up as soon as another descriptor of the file gets closed (Linux
+      only). It can be changed per stream, via the *lock_wait_strategy* attribute of its raw stream.
+    - *lock_writer_preference* (boolean, defaults to False): threads waiting for locks of the same file are served
+      in FIFO order, and a new lock request never overtakes conflicting waiters. If this option is True,
+      waiters of exclusive locks are served before waiters of shared locks, regardless of their arrival order.
+      Beware, since waiting shared locks can't overtake a waiting exclusive lock, a thread taking several shared
+      locks on the same area (via different streams) may deadlock with a writer.
+    - *lock_statistics* (boolean, defaults to False): if True, lock_file() and unlock_file() record, per file, the
+      histograms of lock wait times and hold times, as well as attempts, timeouts, and conflicts with in-process or
+      kernel-level locks. See :func:`rsfile.get_lock_statistics`.
+    - *slow_lock_threshold* (None or positive float, defaults to None): if set, releasing a lock held for longer
+      than this many seconds emits a :class:`rsfile.SlowLockWarning`, containing the stack trace of the code
+      which acquired that lock, and locks still held beyond that delay are listed by
+      :func:`rsfile.get_lock_statistics`. Stack traces get captured on each lock acquisition, so this has a cost.
+    - *max_pending_descriptors* (None or positive integer, defaults to None): with "posix" locks, descriptors closed
+      while their file still has locks are kept open in the :data:`rsfile.PendingDescriptorPool`, and reused by
+      later opening of that same file. If set, this is a soft limit for that pool: beyond it, descriptors of files
+      without locks are closed, and if that's not enough, a :class:`rsfile.PendingDescriptorsWarning` is emitted
+      (closing the others would silently release the process' locks on their files).
+    - *stat_caching* (boolean, defaults to False): the default value of the *stat_caching* attribute of raw streams
+      opened afterwards. If True, their size() and times() reuse the last snapshot returned by their stat() method,
+      which is only refreshed after writes, truncations and lock acquisitions made through that same stream.
+      Changes made by other streams or processes thus remain unnoticed, until a stat(refresh=True) call.
+    - *lock_deadlock_detection* (boolean, defaults to False): if True, the intra-process lock registry maintains a
+      graph of which threads wait for which others (the owners of conflicting locks, and conflicting waiters queued
+      before them), and a lock request which would close a cycle in that graph immediately fails with a
+      :class:`rsfile.LockingException` (errno EDEADLK), whose *cycle* attribute describes the deadlock. Threads
+      polling the registry (with the "spin" strategy, when a timeout or an enforced timeout is set) count as waiters
+      between their attempts. This relies on locks being released by the threads which acquired them. Deadlocks
+      involving other processes, or waits outside of the registry (eg. on kernel locks), remain undetected.
     """
 
     new_options = set(options.keys())
@@ -65,27 +120,395 @@ def get_rsfile_options():
 ############################################
 
 
-class IntraProcessLockRegistryClass(object):
+def get_lock_statistics():
+    """
+    Returns a dictionary mapping file unique ids to their lock statistics (see the *lock_statistics*
+    option), as dictionaries with these entries:
+
+    - *acquisitions*, *timeouts*: numbers of successful and timed-out lock_file() calls
+    - *attempts*: number of locking attempts, i.e acquisitions plus retries after conflicts
+    - *registry_conflicts*, *kernel_conflicts*: numbers of attempts which were blocked by locks from the current
+      process, or by kernel-level locks from other processes (or from other non-rsfile code)
+    - *slow_locks*: number of locks held longer than the *slow_lock_threshold* option
+    - *wait_times*, *hold_times*: histograms, as lists of (upper bound in seconds, count) pairs
+    - *long_held_locks*: locks currently held for longer than the *slow_lock_threshold* option (which are
+      otherwise only reported once released), as dicts with entries *handle*, *start*, *end*, *held_time*
+      and *stack* (the stack trace of their acquisition) ; files having such locks are listed even if the
+      *lock_statistics* option is disabled
+    """
+    return LockStatistics.get_statistics()
+
+
+def dump_lock_state():
+    """
+    Returns a snapshot of the intra-process lock registry, as a list of dictionaries (one per file
+    having locks, waiters or pending resources) with these entries:
+
+    - *unique_id*: the (device, inode) pair, or equivalent, identifying the file
+    - *locks*: list of held byte ranges, as dicts with entries *handle* (owning descriptor), *shared*,
+      *start*, *end* (None meaning "up to infinity"), *thread_name* and *thread_id* (thread which acquired it)
+    - *waiters*: number of threads waiting for a range of that file
+    - *pending_fds*: file descriptors kept open until all locks are released (see :ref:`rsfile_locking_semantic`)
+    - *pending_mappings*: number of memory mappings similarly waiting to be closed
+    """
+    return IntraProcessLockRegistry.dump_state()
+
+
+def print_lock_state(stream=None):
+    """
+    Writes a human-readable version of :func:`dump_lock_state` to *stream* (default: sys.stderr).
+
+    Since the registry only lives inside the current process, this is typically bound to a signal, eg.
+    ``signal.signal(signal.SIGUSR1, lambda *args: rsfile.print_lock_state())``, to inspect a stuck program.
+    """
+    stream = stream or sys.stderr
+    state = dump_lock_state()
+    stream.write("RSFile lock registry of process %s: %d file(s)\n" % (os.getpid(), len(state)))
+    for record in state:
+        stream.write(
+            "%s: %d waiter(s), pending fds %s, %d pending mapping(s)\n"
+            % (record["unique_id"], record["waiters"], record["pending_fds"], record["pending_mappings"])
+        )
+        for lock in record["locks"]:
+            stream.write(
+                "    bytes %s-%s %s by handle %r (thread %s/%s)\n"
+                % (
+                    lock["start"],
+                    "EOF" if lock["end"] is None else lock["end"],
+                    "shared" if lock["shared"] else "exclusive",
+                    lock["handle"],
+                    lock["thread_name"],
+                    lock["thread_id"],
+                )
+            )
+    stream.flush()
+
+
+def reset_lock_statistics():
+    """
+    Forgets all lock statistics recorded until now.
+    """
+    LockStatistics.reset()
+
+
+class LockStatisticsClass(object):
+    """
+    Optional instrumentation of file locks, enabled by the "lock_statistics" and "slow_lock_threshold" options.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self._statistics = {}  # unique_id -> dict of counters and histograms
+        # (unique_id, handle) -> dict (start, end) -> (acquisition time, acquisition stack or None)
+        self._held_locks = {}
+
+    @staticmethod
+    def is_enabled():
+        return _default_rsfile_options["lock_statistics"] or _default_rsfile_options["slow_lock_threshold"] is not None
+
+    @staticmethod
+    def _new_record():
+        return dict(
+            acquisitions=0,
+            timeouts=0,
+            attempts=0,
+            registry_conflicts=0,
+            kernel_conflicts=0,
+            slow_locks=0,
+            wait_times=[0] * len(defs.LOCK_LATENCY_BUCKETS),
+            hold_times=[0] * len(defs.LOCK_LATENCY_BUCKETS),
+        )
+
+    def _get_record(self, unique_id):
+        # unprotected method - beware
+        record = self._statistics.get(unique_id)
+        if record is None:
+            record = self._statistics[unique_id] = self._new_record()
+        return record
+
+    @staticmethod
+    def _add_to_histogram(histogram, duration):
+        histogram[bisect.bisect_left(defs.LOCK_LATENCY_BUCKETS, duration)] += 1
+
+    def record_wait(
+        self, unique_id, handle, start, end, wait_time, attempts, registry_conflicts, kernel_conflicts, acquired
+    ):
+        """
+        Records the outcome of a lock_file() call.
+        """
+        stack = None
+        if acquired and _default_rsfile_options["slow_lock_threshold"] is not None:
+            stack = traceback.format_stack()[:-2]  # we skip instrumentation frames
+        with self.mutex:
+            if _default_rsfile_options["lock_statistics"]:
+                record = self._get_record(unique_id)
+                record["acquisitions" if acquired else "timeouts"] += 1
+                record["attempts"] += attempts
+                record["registry_conflicts"] += registry_conflicts
+                record["kernel_conflicts"] += kernel_conflicts
+                self._add_to_histogram(record["wait_times"], wait_time)
+            if acquired:
+                self._held_locks.setdefault((unique_id, handle), {})[(start, end)] = (time.time(), stack)
+
+    def record_release(self, unique_id, handle, start, end):
+        """
+        Records the release of the locks taken by that handle in the given area (a partial unlock
+        ends the hold time of a whole lock), and warns about those held for too long.
+        """
+        if not self._held_locks:
+            return  # quick path, when instrumentation is disabled
+        slow_locks = []
+        with self.mutex:
+            threshold = _default_rsfile_options["slow_lock_threshold"]
+            held_areas = self._held_locks.get((unique_id, handle), {})
+            for (lock_start, lock_end) in list(held_areas):
+                if (end is not None and lock_start >= end) or (lock_end is not None and lock_end <= start):
+                    continue  # locks taken while instrumentation was disabled are simply unknown
+                (acquisition_time, stack) = held_areas.pop((lock_start, lock_end))
+                hold_time = time.time() - acquisition_time
+                is_slow = threshold is not None and hold_time > threshold
+                if _default_rsfile_options["lock_statistics"]:
+                    record = self._get_record(unique_id)
+                    self._add_to_histogram(record["hold_times"], hold_time)
+                    record["slow_locks"] += is_slow
+                if is_slow:
+                    slow_locks.append((lock_start, lock_end, hold_time, stack))
+            if not held_areas:
+                self._held_locks.pop((unique_id, handle), None)
+
+        for (lock_start, lock_end, hold_time, stack) in slow_locks:
+            warnings.warn(
+                defs.SlowLockWarning(
+                    "Lock on bytes %s-%s of file %s was held for %.3f s, it was acquired at:\n%s"
+                    % (lock_start, "EOF" if lock_end is None else lock_end, unique_id, hold_time, "".join(stack or ()))
+                ),
+                stacklevel=3,
+            )
+
+    def _get_long_held_locks(self):
+        # unprotected method - beware
+        # slow locks are only reported on release, so those never released must be looked for
+        threshold = _default_rsfile_options["slow_lock_threshold"]
+        long_held_locks = {}
+        if threshold is None:
+            return long_held_locks
+        now = time.time()
+        for ((unique_id, handle), held_areas) in self._held_locks.items():
+            for ((start, end), (acquisition_time, stack)) in held_areas.items():
+                if now - acquisition_time > threshold:
+                    long_held_locks.setdefault(unique_id, []).append(
+                        dict(
+                            handle=handle,
+                            start=start,
+                            end=end,
+                            held_time=now - acquisition_time,
+                            stack="".join(stack or ()),
+                        )
+                    )
+        return long_held_locks
+
+    def get_statistics(self):
+        with self.mutex:
+            long_held_locks = self._get_long_held_locks()
+            statistics = {}
+            for unique_id in set(self._statistics) | set(long_held_locks):
+                record = (self._statistics.get(unique_id) or self._new_record()).copy()
+                for key in ("wait_times", "hold_times"):
+                    record[key] = list(zip(defs.LOCK_LATENCY_BUCKETS, record[key]))
+                record["long_held_locks"] = sorted(long_held_locks.get(unique_id, ()), key=lambda lock: lock["start"])
+                statistics[unique_id] = record
+            return statistics
+
+    def reset(self):
+        with self.mutex:
+            self._statistics = {}  # hold times of currently held locks will still be recorded
+
+
+# single global instance
+LockStatistics = LockStatisticsClass()
+
+
+class LockedRangeIndex(object):
+    """
+    Locked ranges (handle, shared, start, end) of a single file, where end=None means 'infinity'.
+
+    Finite ranges are kept sorted by start offset, so overlap lookups only scan those starting less than
+    one "longest finite range" before the searched area, plus the (rare) infinite ranges.
+    With lots of small records locked, lookups and removals are thus logarithmic.
+    """
+
     def __init__(self):
+        self._starts = []  # sorted start offsets of finite ranges
+        self._ranges = []  # finite ranges, in the same order as _starts
+        self._infinite_ranges = []
+        self._length_counts = {}  # length -> number of finite ranges having it
+        self._max_length = 0
+        self._handle_areas = {}  # handle -> set of (start, end) pairs, for quick removals by handle
+
+    def __len__(self):
+        return len(self._ranges) + len(self._infinite_ranges)
+
+    def __iter__(self):
+        return iter(self._ranges + self._infinite_ranges)
+
+    def overlapping(self, start, end):
+        """
+        Returns the list of ranges overlapping the area [start, end).
+        """
+        lo = bisect.bisect_right(self._starts, start - self._max_length)
+        hi = len(self._starts) if end is None else bisect.bisect_left(self._starts, end)
+        found = [record for record in self._ranges[lo:hi] if record[3] > start]
+        found.extend(record for record in self._infinite_ranges if end is None or record[2] < end)
+        return found
+
+    def add(self, record):
+        (handle, shared, start, end) = record
+        if end is None:
+            self._infinite_ranges.append(record)
+        else:
+            index = bisect.bisect_right(self._starts, start)
+            self._starts.insert(index, start)
+            self._ranges.insert(index, record)
+            length = end - start
+            self._length_counts[length] = self._length_counts.get(length, 0) + 1
+            self._max_length = max(self._max_length, length)
+        self._handle_areas.setdefault(handle, set()).add((start, end))
+
+    def _find(self, handle, start, end):
+        # returns the list containing the range, and its position in this list
+        if end is None:
+            ranges, index = self._infinite_ranges, 0
+        else:
+            ranges, index = self._ranges, bisect.bisect_left(self._starts, start)
+        while index < len(ranges):
+            record = ranges[index]
+            if end is not None and record[2] != start:
+                break
+            if record[0] == handle and record[2] == start and record[3] == end:
+                return ranges, index
+            index += 1
+        return None, None
+
+    def remove(self, handle, start, end):
+        """
+        Removes and returns the range exactly matching these arguments, or returns None.
+        """
+        ranges, index = self._find(handle, start, end)
+        if ranges is None:
+            return None
+        record = ranges.pop(index)
+        if end is not None:
+            del self._starts[index]
+            length = end - start
+            self._length_counts[length] -= 1
+            if not self._length_counts[length]:
+                del self._length_counts[length]
+                if length == self._max_length:
+                    self._max_length = max(self._length_counts) if self._length_counts else 0
+        areas = self._handle_areas[handle]
+        areas.discard((start, end))
+        if not areas:
+            del self._handle_areas[handle]
+        return record
+
+    def remove_handle(self, handle):
+        """
+        Removes and returns all the ranges of this handle.
+        """
+        areas = sorted(self._handle_areas.get(handle, ()), key=lambda area: (area[1] is None, area))
+        return [self.remove(handle, start, end) for (start, end) in areas]
+
+    def replace_handle(self, handle, new_handle, start, end):
+        """
+        Gives the range exactly matching these arguments to new_handle, returns False if it wasn't found.
+        """
+        record = self.remove(handle, start, end)
+        if record is None:
+            return False
+        self.add((new_handle,) + record[1:])
+        return True
+
+
+LOCK_REGISTRY_STRIPES = 64  # number of mutexes shared by the files of the registry
+
+
+class _LockWaiter(object):
+    """
+    Thread waiting, in the registry, for a locked range to become available, or for its
+    shared lock to be upgraded to an exclusive one.
+    """
+
+    __slots__ = ("handle", "shared", "start", "end", "condition", "upgrade", "coalesce", "thread", "granted")
+
+    def __init__(self, handle, shared, start, end, condition, upgrade=False, coalesce=True):
+        self.handle = handle
+        self.shared = shared
+        self.start = start
+        self.end = end
+        self.condition = condition
+        self.upgrade = upgrade
+        self.coalesce = coalesce
+        self.thread = threading.current_thread()
+        self.granted = False  # set when a releaser has registered the lock on our behalf
+
+
+class IntraProcessLockRegistryClass(object):
+    def __init__(self, stripes=LOCK_REGISTRY_STRIPES, coalesce_ranges=(os.name != "nt")):
 
         self._original_pid = os.getpid()
 
+        # if True, adjacent ranges of a same handle and mode are merged, and ranges can be partially unlocked,
+        # like kernels do with fcntl() locks ; windows and flock(), on the contrary, only unlock exactly what
+        # was locked - this is the default value of the "coalesce" argument of public methods, which
+        # streams set according to their locking backend
+        self.coalesce_ranges = coalesce_ranges
+
         # keys : file unique_id
-        # values : event + (list of locked ranges [handle, shared, start, end] where end=None
-        # means 'infinity') + attached data
+        # values : FIFO list of waiters + (index of locked ranges [handle, shared, start, end] where end=None
+        # means 'infinity') + attached data + dict (handle, start, end) -> thread which acquired that range
         self._lock_registry = {}
 
-        self.mutex = threading.RLock()
+        # unrelated files mostly use different mutexes, so they don't contend with each other
+        self._stripes = [threading.RLock() for i in range(stripes)]
+
+        # for deadlock detection - waiting thread -> (unique_id, waiter, list of wait-for edges) ; this mutex
+        # is always taken AFTER the stripe mutex of the file concerned
+        self._wait_for_graph = {}
+        self._wait_graph_mutex = threading.Lock()
+
+        # we've lost all locks in the forking, so the registry must be flushed in child processes
+        self._needs_fork_checks = hasattr(os, "fork") and not hasattr(os, "register_at_fork")
+        if hasattr(os, "register_at_fork"):
+            registry_ref = weakref.ref(self)
+
+            def reset_after_fork():
+                registry = registry_ref()
+                if registry is not None:
+                    registry._reset()
+
+            os.register_at_fork(after_in_child=reset_after_fork)
+
+    def mutex_for(self, unique_id):
+        """
+        Returns the (reentrant) mutex protecting the registry entry of that unique_id.
+        """
+        return self._stripes[hash(unique_id) % len(self._stripes)]
+
+    def _reset(self):
+        self._lock_registry = {}
+        # a mutex might have been held by another thread when forking
+        self._stripes = [threading.RLock() for i in range(len(self._stripes))]
+        self._wait_for_graph = {}
+        self._wait_graph_mutex = threading.Lock()
+        self._original_pid = os.getpid()
 
     def _check_forking(self):
         # unprotected method - beware
 
-        # reset is required only when the current thread has just forked !
-        # we've then lost all locks in the forking, so just flush the registry
+        # reset is required only when the current thread has just forked, on pythons without fork hooks
 
-        if os.getpid() != self._original_pid:
-            self._lock_registry = {}
-            self._original_pid = os.getpid()
+        if self._needs_fork_checks and os.getpid() != self._original_pid:
+            self._reset()
 
     def _ensure_entry_exists(self, unique_id, create=False):
         """
@@ -97,14 +520,149 @@ class IntraProcessLockRegistryClass(object):
         else:
             if create:
                 self._lock_registry[unique_id] = [
-                    threading.Condition(self.mutex),
                     [],
+                    LockedRangeIndex(),
                     [],
-                    0,
-                ]  # [condition, locks, data, number of threads waiting]
+                    {},
+                ]  # [waiters, locks, data, owners]
             return False
 
-    def _try_locking_range(self, unique_id, handle, new_length, new_start, new_shared):
+    def _is_range_blocked(self, unique_id, handle, new_shared, new_start, new_end, waiters_ahead, strict=True):
+        # unprotected method - beware
+        for (other_handle, shared, start, end) in self._lock_registry[unique_id][1].overlapping(new_start, new_end):
+
+            if other_handle != handle and shared == new_shared == True:
+                continue  # there won't be problems with shared locks from different file handles
+
+            if other_handle == handle and strict:
+                # we don't merge lock areas
+                raise RuntimeError("Same area of file locked twice by the same file descriptor")
+            else:
+                return True
+
+        for waiter in waiters_ahead:  # we don't overtake conflicting waiters
+            if (
+                not (waiter.shared and new_shared)
+                and (new_end is None or waiter.start < new_end)
+                and (waiter.end is None or waiter.end > new_start)
+            ):
+                return True
+
+        return False
+
+    def _add_range(self, unique_id, handle, shared, start, end, thread, coalesce):
+        # unprotected method - beware
+        (locks, owners) = (self._lock_registry[unique_id][1], self._lock_registry[unique_id][3])
+        if coalesce:
+            if start > 0:
+                for record in locks.overlapping(start - 1, start):
+                    if record[0] == handle and record[1] == shared and record[3] == start:
+                        locks.remove(handle, record[2], record[3])
+                        thread = owners.pop((handle, record[2], record[3]), thread)  # the oldest owner wins
+                        start = record[2]
+            if end is not None:
+                for record in locks.overlapping(end, end + 1):
+                    if record[0] == handle and record[1] == shared and record[2] == end:
+                        locks.remove(handle, record[2], record[3])
+                        owners.pop((handle, record[2], record[3]), None)
+                        end = record[3]
+        locks.add((handle, shared, start, end))
+        owners[(handle, start, end)] = thread
+
+    def _split_at(self, unique_id, handle, offset, coalesce):
+        # unprotected method - beware
+        # the range of that handle which straddles offset, if any, gets cut in two
+        (locks, owners) = (self._lock_registry[unique_id][1], self._lock_registry[unique_id][3])
+        for (other_handle, shared, start, end) in locks.overlapping(offset, offset + 1):
+            if other_handle == handle and start < offset:
+                if not coalesce:
+                    raise RuntimeError("Locked file areas can't be split with this locking backend")
+                locks.remove(handle, start, end)
+                thread = owners.pop((handle, start, end), None)
+                for (piece_start, piece_end) in ((start, offset), (offset, end)):
+                    locks.add((handle, shared, piece_start, piece_end))
+                    owners[(handle, piece_start, piece_end)] = thread
+
+    def _get_covering_ranges(self, unique_id, handle, start, end):
+        # unprotected method - beware
+        # returns the sorted ranges of that handle overlapping [start, end), if they cover this whole area
+        records = sorted(
+            (record for record in self._lock_registry[unique_id][1].overlapping(start, end) if record[0] == handle),
+            key=lambda record: record[2],
+        )
+        if not records or records[0][2] > start:
+            return None
+        for (previous, record) in zip(records, records[1:]):
+            if previous[3] != record[2]:
+                return None
+        if records[-1][3] is not None and (end is None or records[-1][3] < end):
+            return None
+        return records
+
+    def _set_mode(self, unique_id, handle, start, end, shared, coalesce):
+        # unprotected method - beware
+        # the ranges of that handle must cover the whole area
+        self._split_at(unique_id, handle, start, coalesce)
+        if end is not None:
+            self._split_at(unique_id, handle, end, coalesce)
+        (locks, owners) = (self._lock_registry[unique_id][1], self._lock_registry[unique_id][3])
+        thread = None
+        for record in self._get_covering_ranges(unique_id, handle, start, end):
+            locks.remove(handle, record[2], record[3])
+            owner = owners.pop((handle, record[2], record[3]), None)
+            thread = thread or owner
+        self._add_range(unique_id, handle, shared, start, end, thread, coalesce)
+
+    def _is_upgrade_blocked(self, unique_id, handle, start, end):
+        # unprotected method - beware
+        # upgrades don't queue behind other waiters, since these may be waiting for our own shared lock
+        for record in self._lock_registry[unique_id][1].overlapping(start, end):
+            if record[0] != handle:
+                return True
+        return False
+
+    def _grant_waiting_locks(self, unique_id):
+        # unprotected method - beware
+        # We only wake up the waiters whose ranges are now available, in FIFO order
+        waiters = self._lock_registry[unique_id][0]
+        if not waiters:
+            if self._wait_for_graph:
+                self._update_wait_for_graph(unique_id)  # threads retrying non-blocking locks may be concerned
+            return
+
+        if _default_rsfile_options["lock_writer_preference"]:
+            candidates = [w for w in waiters if not w.shared] + [w for w in waiters if w.shared]
+        else:
+            candidates = list(waiters)
+
+        still_waiting = []
+        for waiter in candidates:
+            if waiter.upgrade:
+                blocked = self._is_upgrade_blocked(unique_id, waiter.handle, waiter.start, waiter.end)
+            else:
+                blocked = self._is_range_blocked(
+                    unique_id, waiter.handle, waiter.shared, waiter.start, waiter.end, still_waiting, strict=False
+                )
+            if blocked:
+                still_waiting.append(waiter)
+            elif waiter.upgrade:
+                self._set_mode(unique_id, waiter.handle, waiter.start, waiter.end, False, waiter.coalesce)
+                waiter.granted = True
+                waiter.condition.notify()
+            else:
+                self._add_range(
+                    unique_id, waiter.handle, waiter.shared, waiter.start, waiter.end, waiter.thread, waiter.coalesce
+                )
+                waiter.granted = True
+                waiter.condition.notify()
+
+        if len(still_waiting) != len(waiters):
+            waiters[:] = [waiter for waiter in waiters if not waiter.granted]
+
+        if self._wait_for_graph:
+            self._update_wait_for_graph(unique_id)
+
+    def _try_locking_range(self, unique_id, handle, new_length, new_start, new_shared, coalesce):
         # unprotected method - beware
         assert unique_id, unique_id
         assert handle is not None, handle
@@ -116,111 +674,342 @@ class IntraProcessLockRegistryClass(object):
 
         if self._ensure_entry_exists(unique_id, create=True):
 
-            for (other_handle, shared, start, end) in self._lock_registry[unique_id][1]:
-
-                if other_handle != handle and shared == new_shared == True:
-                    continue  # there won't be problems with shared locks from different file handles
-
-                max_start = max(start, new_start)
-
-                min_end = end
-                if min_end is None or (new_end is not None and new_end < min_end):
-                    min_end = new_end
-
-                if min_end is None or max_start < min_end:  # areas are overlapping
-                    if other_handle == handle:
-                        # we don't merge lock areas
-                        raise RuntimeError("Same area of file locked twice by the same file descriptor")
-                    else:
-                        return False
+            waiters = self._lock_registry[unique_id][0]
+            if self._is_range_blocked(unique_id, handle, new_shared, new_start, new_end, waiters):
+                return False
 
         # print (">Thread %s handle %s takes lock with %s" % (threading.current_thread().name, handle, (new_shared,
         # new_start, new_end)))
         # we register as owner of this lock inside this process
-        self._lock_registry[unique_id][1].append((handle, new_shared, new_start, new_end))
+        self._add_range(unique_id, handle, new_shared, new_start, new_end, threading.current_thread(), coalesce)
         return True  # no badly overlapping range was found
 
-    def _try_unlocking_range(self, unique_id, handle, new_length, new_start):
+    def _try_unlocking_range(self, unique_id, handle, new_length, new_start, coalesce):
         """
-        Returns True if there are not locks left for that unique_id
+        Releases all the bytes of that area owned by the handle, and returns the list of released
+        (start, end) areas, contiguous ones being merged if ranges are coalesced.
         """
         assert unique_id, unique_id
         assert handle is not None, handle
 
         # unprotected method - beware
         if not self._ensure_entry_exists(unique_id, create=False):
-            return True
+            return []
 
         new_end = (new_start + new_length) if new_length else None  # None -> infinity
 
         # print ("<Thread %s handle %s wants to remove lock with %s" % \
         # (threading.current_thread().name, handle, (new_start, new_end)))
 
-        locks = self._lock_registry[unique_id][1]
-        for index, (other_handle, shared, start, end) in enumerate(locks):
-            if other_handle == handle and start == new_start and end == new_end:
-                del locks[index]
-                # print ("THREAD %s NOTIFYING %s" % ( threading.current_thread().name, unique_id))
-                self._lock_registry[unique_id][0].notify_all()  # we awake potential waiters - ALL of them
-                if not locks:
-                    return True
-                else:
-                    return False
+        self._split_at(unique_id, handle, new_start, coalesce)
+        if new_end is not None:
+            self._split_at(unique_id, handle, new_end, coalesce)
+
+        (locks, owners) = (self._lock_registry[unique_id][1], self._lock_registry[unique_id][3])
+        released = []
+        for (other_handle, shared, start, end) in sorted(
+            locks.overlapping(new_start, new_end), key=lambda record: record[2]
+        ):
+            if other_handle != handle:
+                continue
+            locks.remove(handle, start, end)
+            owners.pop((handle, start, end), None)
+            if released and coalesce and released[-1][1] == start:
+                released[-1] = (released[-1][0], end)
+            else:
+                released.append((start, end))
 
-        # no matching lock was found
-        raise RuntimeError("Trying to unlock a file area not owned by this handle")
+        if not released:
+            # no matching lock was found
+            raise RuntimeError("Trying to unlock a file area not owned by this handle")
 
-    def register_file_lock(self, unique_id, handle, length, offset, blocking, shared, timeout):
+        # print ("THREAD %s NOTIFYING %s" % ( threading.current_thread().name, unique_id))
+        self._grant_waiting_locks(unique_id)  # we awake the waiters which can now proceed
+        return released
+
+    def register_file_lock(
+        self, unique_id, handle, length, offset, blocking, shared, timeout, coalesce=None, retrying=False
+    ):
         assert unique_id, unique_id
         assert handle is not None, handle
-        with self.mutex:
+        coalesce = self.coalesce_ranges if coalesce is None else coalesce
+        with self.mutex_for(unique_id):
 
             self._check_forking()
 
-            # we handle both blocking and non-blocking locks there
-            res = False
-            while not res:
-                res = self._try_locking_range(unique_id, handle, length, offset, shared)
-                if res or not blocking:
-                    break
+            # we handle both blocking and non-blocking locks there, timeout being the max time to block
+            res = self._try_locking_range(unique_id, handle, length, offset, shared, coalesce)
+
+            if retrying and not blocking and _default_rsfile_options["lock_deadlock_detection"]:
+                # the caller polls the registry until it gets that lock, so between two attempts it's
+                # a waiter too, which must appear in the wait-for graph until forget_lock_retries() is called
+                if res:
+                    self.forget_lock_retries()
                 else:
-                    # print ("THREAD %s WAITING REGISTRY %s" % (threading.current_thread().name, unique_id))
-                    self._lock_registry[unique_id][3] += 1
-                    self._lock_registry[unique_id][0].wait(timeout)  # we wait on the condition until locks get removed
-                    self._lock_registry[unique_id][3] -= 1
-                    # print ("THREAD %s LEAVING REGISTRY %s" % (threading.current_thread().name, unique_id))
+                    end = (offset + length) if length else None  # None -> infinity
+                    waiter = _LockWaiter(handle, shared, offset, end, None, coalesce=coalesce)
+                    self._check_for_deadlock(unique_id, waiter, queued=False)
+
+            if res or not blocking:
+                return res
 
-            # print (">Thread %s handle %s RETURNING %s from register_file_lock" % (threading.current_thread().name,
-            # handle, res))
-            return res
+            # print ("THREAD %s WAITING REGISTRY %s" % (threading.current_thread().name, unique_id))
+            end = (offset + length) if length else None  # None -> infinity
+            condition = threading.Condition(self.mutex_for(unique_id))
+            waiter = _LockWaiter(handle, shared, offset, end, condition, coalesce=coalesce)
+            return self._wait_in_queue(unique_id, waiter, timeout)
 
-    def unregister_file_lock(self, unique_id, handle, length, offset):
+    def _get_wait_for_edges(self, unique_id, waiter):
+        # unprotected method - beware
+        (waiters, locks, data, owners) = self._lock_registry[unique_id]
+        edges = []
+
+        def add_edge(blocker_thread, blocker_handle):
+            edges.append(
+                dict(
+                    thread_name=waiter.thread.name,
+                    handle=waiter.handle,
+                    unique_id=unique_id,
+                    start=waiter.start,
+                    end=waiter.end,
+                    blocker_thread=blocker_thread,
+                    blocker_thread_name=blocker_thread.name if blocker_thread else None,
+                    blocker_handle=blocker_handle,
+                )
+            )
+
+        for (handle, shared, start, end) in locks.overlapping(waiter.start, waiter.end):
+            conflicting = (handle != waiter.handle) if waiter.upgrade else not (shared and waiter.shared)
+            if conflicting:
+                add_edge(owners.get((handle, start, end)), handle)
+
+        if not waiter.upgrade:  # upgrades don't queue behind other waiters
+            for other in waiters:
+                if other is waiter:
+                    break
+                if (
+                    not (other.shared and waiter.shared)
+                    and (waiter.end is None or other.start < waiter.end)
+                    and (other.end is None or other.end > waiter.start)
+                ):
+                    add_edge(other.thread, other.handle)
+        return edges
+
+    def _update_wait_for_graph(self, unique_id):
+        # unprotected method - beware
+        # edges of the waiters of that file change only when its locks or waiters do, under its stripe mutex
+        with self._wait_graph_mutex:
+            for (thread, (other_unique_id, waiter, edges)) in list(self._wait_for_graph.items()):
+                if other_unique_id == unique_id:
+                    if waiter.granted:
+                        del self._wait_for_graph[thread]
+                    else:
+                        self._wait_for_graph[thread] = (unique_id, waiter, self._get_wait_for_edges(unique_id, waiter))
+
+    def _find_wait_cycle(self, thread):
+        # unprotected method - beware, graph mutex must be held
+        # returns the list of edges leading from that thread back to itself, or None
+        visited = set()
+        stack = [(thread, [])]
+        while stack:
+            (current, path) = stack.pop()
+            for edge in self._wait_for_graph[current][2]:
+                blocker = edge["blocker_thread"]
+                if blocker is thread:
+                    return path + [edge]
+                if blocker in self._wait_for_graph and blocker not in visited:
+                    visited.add(blocker)
+                    stack.append((blocker, path + [edge]))
+        return None
+
+    def _check_for_deadlock(self, unique_id, waiter, queued=True):
+        # unprotected method - beware
+        # waiters which are not queued are threads retrying non-blocking locks, they hold back nobody
+        edges = self._get_wait_for_edges(unique_id, waiter)
+        with self._wait_graph_mutex:
+            self._wait_for_graph[waiter.thread] = (unique_id, waiter, edges)
+            cycle = self._find_wait_cycle(waiter.thread)
+            if cycle is None:
+                return
+            del self._wait_for_graph[waiter.thread]
+
+        if queued:
+            self._lock_registry[unique_id][0].remove(waiter)
+            self._grant_waiting_locks(unique_id)  # we might have been holding back other waiters
+
+        cycle = [dict((key, value) for (key, value) in edge.items() if key != "blocker_thread") for edge in cycle]
+        details = "; ".join(
+            "thread %s (handle %r) waits for bytes %s-%s of %s, held or awaited by thread %s (handle %r)"
+            % (
+                edge["thread_name"],
+                edge["handle"],
+                edge["start"],
+                edge["end"],
+                edge["unique_id"],
+                edge["blocker_thread_name"],
+                edge["blocker_handle"],
+            )
+            for edge in cycle
+        )
+        exception = defs.LockingException(errno.EDEADLK, "Deadlock between threads detected: " + details)
+        exception.cycle = cycle
+        raise exception
+
+    def _wait_in_queue(self, unique_id, waiter, timeout):
+        # unprotected method - beware
+        waiters = self._lock_registry[unique_id][0]
+        waiters.append(waiter)
+
+        if _default_rsfile_options["lock_deadlock_detection"]:
+            self._check_for_deadlock(unique_id, waiter)
+
+        deadline = None if timeout is None else (time.time() + timeout)
+        while not waiter.granted:
+            remaining = None if deadline is None else (deadline - time.time())
+            if remaining is not None and remaining <= 0:
+                break
+            waiter.condition.wait(remaining)  # releasers register the lock for us before notifying
+
+        if not waiter.granted:
+            waiters.remove(waiter)
+            self._grant_waiting_locks(unique_id)  # we might have been holding back other waiters
+
+        if self._wait_for_graph:
+            with self._wait_graph_mutex:
+                if self._wait_for_graph.get(waiter.thread, (None, None))[1] is waiter:
+                    del self._wait_for_graph[waiter.thread]
+
+        # print (">Thread %s handle %s RETURNING %s from register_file_lock" % (threading.current_thread().name,
+        # waiter.handle, waiter.granted))
+        return waiter.granted
+
+    def forget_lock_retries(self):
+        """
+        Removes the current thread from the wait-for graph, where its last failed attempt at
+        register_file_lock(retrying=True) left it, eg. once it gives up waiting for that lock.
+        """
+        if self._wait_for_graph:
+            with self._wait_graph_mutex:
+                self._wait_for_graph.pop(threading.current_thread(), None)
+
+    def convert_file_lock(self, unique_id, handle, length, offset, shared, blocking, timeout, coalesce=None):
+        """
+        Switches a range locked by that handle between shared and exclusive modes, and returns True
+        iff it's done (downgrades always succeed).
+
+        Upgrades wait, if blocking, for other handles to release overlapping ranges, with priority
+        over other waiters ; timeout is the max time to block.
+
+        Without coalescing, the area must be exactly a range previously locked.
+        """
         assert unique_id, unique_id
         assert handle is not None, handle
-        with self.mutex:
+        coalesce = self.coalesce_ranges if coalesce is None else coalesce
+        with self.mutex_for(unique_id):
             self._check_forking()
 
-            return self._try_unlocking_range(unique_id, handle, length, offset)
+            end = (offset + length) if length else None  # None -> infinity
+            records = None
+            if self._ensure_entry_exists(unique_id, create=False):
+                records = self._get_covering_ranges(unique_id, handle, offset, end)
+            if not records or (not coalesce and (len(records) > 1 or records[0][2:] != (offset, end))):
+                raise RuntimeError("Trying to relock a file area not owned by this handle")
+
+            if all(record[1] == shared for record in records):
+                return True  # nothing to do
+
+            if shared:
+                self._set_mode(unique_id, handle, offset, end, True, coalesce)
+                self._grant_waiting_locks(unique_id)  # other shared lockers may now proceed
+                return True
+
+            if not self._is_upgrade_blocked(unique_id, handle, offset, end):
+                self._set_mode(unique_id, handle, offset, end, False, coalesce)
+                return True
+            if not blocking:
+                return False
+
+            for waiter in self._lock_registry[unique_id][0]:
+                if (
+                    waiter.upgrade
+                    and (end is None or waiter.start < end)
+                    and (waiter.end is None or waiter.end > offset)
+                ):
+                    # each of us waits for the other to release its shared lock
+                    raise defs.LockingException(
+                        errno.EDEADLK, "Another handle is already upgrading an overlapping shared lock"
+                    )
+
+            condition = threading.Condition(self.mutex_for(unique_id))
+            waiter = _LockWaiter(handle, False, offset, end, condition, upgrade=True, coalesce=coalesce)
+            return self._wait_in_queue(unique_id, waiter, timeout)
+
+    def unregister_file_lock(self, unique_id, handle, length, offset, coalesce=None):
+        """
+        Returns True if there are no locks left for that unique_id.
+        """
+        assert unique_id, unique_id
+        assert handle is not None, handle
+        coalesce = self.coalesce_ranges if coalesce is None else coalesce
+        with self.mutex_for(unique_id):
+            self._check_forking()
+
+            self._try_unlocking_range(unique_id, handle, length, offset, coalesce)
+            return not (unique_id in self._lock_registry and self._lock_registry[unique_id][1])
+
+    def release_file_range(self, unique_id, handle, length, offset, coalesce=None):
+        """
+        Unregisters all the locked bytes of that handle in the given area (which may only partially cover
+        some locked ranges, if these are coalesced), and returns the list of released (start, end) areas.
+        """
+        assert unique_id, unique_id
+        assert handle is not None, handle
+        coalesce = self.coalesce_ranges if coalesce is None else coalesce
+        with self.mutex_for(unique_id):
+            self._check_forking()
+
+            return self._try_unlocking_range(unique_id, handle, length, offset, coalesce)
+
+    def transfer_file_lock(self, unique_id, handle, new_handle, length, offset, coalesce=None):
+        """
+        Gives the ownership of a locked range to another handle (eg. a background waiter).
+        """
+        assert unique_id, unique_id
+        assert handle is not None and new_handle is not None, (handle, new_handle)
+        coalesce = self.coalesce_ranges if coalesce is None else coalesce
+        with self.mutex_for(unique_id):
+            self._check_forking()
+
+            new_end = (offset + length) if length else None  # None -> infinity
+            if self._ensure_entry_exists(unique_id):
+                # the area might have been merged with its neighbours
+                self._split_at(unique_id, handle, offset, coalesce)
+                if new_end is not None:
+                    self._split_at(unique_id, handle, new_end, coalesce)
+            if not (
+                self._ensure_entry_exists(unique_id)
+                and self._lock_registry[unique_id][1].replace_handle(handle, new_handle, offset, new_end)
+            ):
+                raise RuntimeError("Trying to transfer a file area not owned by this handle")
+            owners = self._lock_registry[unique_id][3]
+            owners[(new_handle, offset, new_end)] = owners.pop((handle, offset, new_end), None)
 
     def remove_file_locks(self, unique_id, handle):
         assert unique_id, unique_id
         assert handle is not None, handle
-        with self.mutex:
+        with self.mutex_for(unique_id):
 
             self._check_forking()
 
             if not self._ensure_entry_exists(unique_id, create=False):
                 return []
 
-            removed_locks = []
-            remaining_locks = []
-            for record in self._lock_registry[unique_id][1]:
-                if record[0] == handle:
-                    removed_locks.append(record)
-                else:
-                    remaining_locks.append(record)
-
-            self._lock_registry[unique_id][1] = remaining_locks
+            removed_locks = self._lock_registry[unique_id][1].remove_handle(handle)
+            owners = self._lock_registry[unique_id][3]
+            for (_handle, shared, start, end) in removed_locks:
+                owners.pop((handle, start, end), None)
+            if removed_locks:
+                self._grant_waiting_locks(unique_id)  # we awake the waiters which can now proceed
 
             return removed_locks
 
@@ -229,17 +1018,17 @@ class IntraProcessLockRegistryClass(object):
         Returns True iff an entry existed and could be deleted.
         """
         assert unique_id, unique_id
-        with self.mutex:
+        with self.mutex_for(unique_id):
 
             self._check_forking()
 
             if not self._ensure_entry_exists(unique_id, create=False):
                 return False
             elif (
-                self._lock_registry[unique_id][1]
+                self._lock_registry[unique_id][0]
+                or self._lock_registry[unique_id][1]
                 or self._lock_registry[unique_id][2]
-                or self._lock_registry[unique_id][3]
-            ):  # locks, data, or waiting threads
+            ):  # waiting threads, locks, or data
                 return False
             else:
                 del self._lock_registry[unique_id]
@@ -248,7 +1037,7 @@ class IntraProcessLockRegistryClass(object):
     def add_unique_id_data(self, unique_id, data):
         assert unique_id, unique_id
         assert data, data
-        with self.mutex:
+        with self.mutex_for(unique_id):
             self._check_forking()
 
             self._ensure_entry_exists(unique_id, create=True)
@@ -256,7 +1045,7 @@ class IntraProcessLockRegistryClass(object):
 
     def remove_unique_id_data(self, unique_id):
         assert unique_id, unique_id
-        with self.mutex:
+        with self.mutex_for(unique_id):
 
             self._check_forking()
 
@@ -272,7 +1061,7 @@ class IntraProcessLockRegistryClass(object):
 
     def unique_id_has_locks(self, unique_id):
         assert unique_id, unique_id
-        with self.mutex:
+        with self.mutex_for(unique_id):
 
             self._check_forking()
 
@@ -281,6 +1070,203 @@ class IntraProcessLockRegistryClass(object):
             else:
                 return False
 
+    def find_blocking_lock(self, unique_id, handle, length, offset, shared, other_handles_only=False):
+        """
+        Returns the (handle, shared, start, end) record of a lock of this process which would prevent
+        that handle from locking the given range, or None.
+        """
+        assert unique_id, unique_id
+        with self.mutex_for(unique_id):
+            self._check_forking()
+
+            if not self._ensure_entry_exists(unique_id, create=False):
+                return None
+            end = (offset + length) if length else None  # None -> infinity
+            for record in self._lock_registry[unique_id][1].overlapping(offset, end):
+                if record[0] == handle:
+                    if not other_handles_only:
+                        return record  # same-handle overlaps are forbidden anyway
+                elif not (record[1] and shared):
+                    return record
+            return None
+
+    def dump_state(self):
+        """
+        Returns a snapshot of the registry, as a list of dicts (see :func:`dump_lock_state`).
+        """
+        state = []
+        for unique_id in list(self._lock_registry):  # each entry is then copied under its own mutex
+            with self.mutex_for(unique_id):
+                self._check_forking()
+
+                if unique_id not in self._lock_registry:
+                    continue  # deleted meanwhile
+                (waiters, locks, data, owners) = self._lock_registry[unique_id]
+
+                held_locks = []
+                for (handle, shared, start, end) in sorted(locks, key=lambda record: record[2]):
+                    thread = owners.get((handle, start, end))
+                    held_locks.append(
+                        dict(
+                            handle=handle,
+                            shared=shared,
+                            start=start,
+                            end=end,
+                            thread_name=thread.name if thread else None,
+                            thread_id=thread.ident if thread else None,
+                        )
+                    )
+
+                state.append(
+                    dict(
+                        unique_id=unique_id,
+                        locks=held_locks,
+                        waiters=len(waiters),
+                        pending_fds=PendingDescriptorPool.get_descriptors(unique_id),
+                        pending_mappings=len(data),
+                    )
+                )
+        return state
+
 
 # single global instance
 IntraProcessLockRegistry = IntraProcessLockRegistryClass()
+
+
+class AlignedBufferPoolClass(object):
+    """
+    Pool of reusable page-aligned buffers (backed by anonymous memory mappings),
+    as required for I/O bypassing the OS cache (see the "O" open mode).
+
+    Buffers are memoryviews, which must be given back, unsliced, to release().
+    """
+
+    def __init__(self, max_free_buffers=8):
+        self.max_free_buffers = max_free_buffers  # per buffer size
+        self._free_buffers = {}  # size -> list of memoryviews
+        self.mutex = threading.Lock()
+
+    def acquire(self, size):
+        assert size > 0, size
+        size = -(-size // mmap.PAGESIZE) * mmap.PAGESIZE  # rounded up to whole pages
+        with self.mutex:
+            free_buffers = self._free_buffers.get(size)
+            if free_buffers:
+                return free_buffers.pop()
+        return memoryview(mmap.mmap(-1, size))
+
+    def release(self, buffer):
+        with self.mutex:
+            free_buffers = self._free_buffers.setdefault(len(buffer), [])
+            if len(free_buffers) < self.max_free_buffers:
+                free_buffers.append(buffer)  # else the memory mapping gets garbage collected
+
+    @contextmanager
+    def borrowed(self, size):
+        buffer = self.acquire(size)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+
+# single global instance
+AlignedBufferPool = AlignedBufferPoolClass()
+
+
+class PendingDescriptorPoolClass(object):
+    """
+    Pool of file descriptors which were closed by unix streams, but must be kept open while their file
+    still has "posix" locks (see :ref:`rsfile_locking_semantic`).
+
+    When the same file gets opened again with the same flags, one of these descriptors is reused
+    instead of opening a new one, so that long-running programs which repeatedly open and close locked
+    files don't pile up descriptors.
+    """
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self._descriptors = {}  # unique_id -> list of (fd, open flags or None if not reusable)
+        self._count = 0
+        self._statistics = dict(parked=0, reused=0, closed=0, peak=0)
+
+        if hasattr(os, "register_at_fork"):
+            pool_ref = weakref.ref(self)
+
+            def reset_after_fork():
+                pool = pool_ref()
+                if pool is not None:
+                    pool._reset()
+
+            os.register_at_fork(after_in_child=reset_after_fork)
+
+    def _reset(self):
+        # like in the lock registry, descriptors inherited by children are just forgotten
+        self.mutex = threading.Lock()
+        self._descriptors = {}
+        self._count = 0
+
+    def park(self, unique_id, fd, flags=None):
+        assert unique_id, unique_id
+        with self.mutex:
+            self._descriptors.setdefault(unique_id, []).append((fd, flags))
+            self._count += 1
+            self._statistics["parked"] += 1
+            self._statistics["peak"] = max(self._statistics["peak"], self._count)
+
+    def reuse(self, unique_id, flags):
+        """
+        Returns a pending descriptor of that file which was opened with these flags, or None.
+        """
+        with self.mutex:
+            descriptors = self._descriptors.get(unique_id)
+            if descriptors:
+                for (index, (fd, fd_flags)) in enumerate(descriptors):
+                    if fd_flags == flags:
+                        del descriptors[index]
+                        if not descriptors:
+                            del self._descriptors[unique_id]
+                        self._count -= 1
+                        self._statistics["reused"] += 1
+                        return fd
+            return None
+
+    def release(self, unique_id):
+        """
+        Removes and returns all the pending descriptors of that file, which the caller must close.
+        """
+        with self.mutex:
+            descriptors = self._descriptors.pop(unique_id, [])
+            self._count -= len(descriptors)
+            self._statistics["closed"] += len(descriptors)
+            return [fd for (fd, flags) in descriptors]
+
+    def get_descriptors(self, unique_id):
+        with self.mutex:
+            return [fd for (fd, flags) in self._descriptors.get(unique_id, [])]
+
+    def get_unique_ids(self):
+        with self.mutex:
+            return list(self._descriptors)
+
+    def has_descriptors(self):
+        return self._count > 0  # no need for the mutex here
+
+    def exceeds_limit(self):
+        limit = _default_rsfile_options["max_pending_descriptors"]
+        return limit is not None and self._count > limit
+
+    def get_statistics(self):
+        """
+        Returns a dict with the *current* number of pending descriptors, the *limit* set by the
+        "max_pending_descriptors" option, and the counts of descriptors *parked*, *reused* and *closed*
+        since the start of the process, as well as the *peak* number of pending descriptors.
+        """
+        with self.mutex:
+            statistics = dict(self._statistics)
+            statistics.update(current=self._count, limit=_default_rsfile_options["max_pending_descriptors"])
+            return statistics
+
+
+# single global instance
+PendingDescriptorPool = PendingDescriptorPoolClass()
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
 
+import errno
 import functools
 import multiprocessing
 import os
 import threading
+from contextlib import nullcontext
 
 from . import rsfile_definitions as defs
 
@@ -30,6 +32,21 @@ def __rsfile_stream_repr__(self):
     else:
         return "<%s name=%r>" % (clsname, name)
 
+def _skip_processed_bytes(buffers, count):
+    """
+    Returns the list of byte memoryviews which remain to be processed, once *count* bytes
+    of the *buffers* sequence have been read or written by a vectored I/O call.
+    """
+    remaining = []
+    for buffer in buffers:
+        if count >= len(buffer):
+            count -= len(buffer)
+        else:
+            remaining.append(memoryview(buffer)[count:])
+            count = 0
+    return remaining
+
+
 class _buffer_forwarder_mixin(object):
     def _reset_buffers(self):
         self.seek(0, os.SEEK_CUR)  # we flush i/o buffers, didn't work on py26
@@ -44,6 +61,10 @@ class _buffer_forwarder_mixin(object):
         self.flush()
         return self.raw.size()
 
+    def stat(self, refresh=False):
+        self.flush()
+        return self.raw.stat(refresh)
+
     def sync(self, *args, **kwargs):
         self.flush()
         return self.raw.sync(*args, **kwargs)
@@ -56,6 +77,96 @@ class _buffer_forwarder_mixin(object):
         self._reset_buffers()
         return self.raw.unlock_file(*args, **kwargs)
 
+    def query_lock(self, *args, **kwargs):
+        self._reset_buffers()  # so that relative offsets are right
+        return self.raw.query_lock(*args, **kwargs)
+
+    def relock(self, *args, **kwargs):
+        self._reset_buffers()
+        return self.raw.relock(*args, **kwargs)
+
+    def map_region(self, *args, **kwargs):
+        self._reset_buffers()  # the mapping might be modified, like for file locking
+        return self.raw.map_region(*args, **kwargs)
+
+    def advise(self, *args, **kwargs):
+        self.flush()  # so that "dontneed" advice applies to our pending data too
+        return self.raw.advise(*args, **kwargs)
+
+    def preallocate(self, *args, **kwargs):
+        self.flush()
+        return self.raw.preallocate(*args, **kwargs)
+
+    def copy_to(self, other_stream, offset=0, length=None, dst_offset=None, locking=True):
+        self.flush()  # pending writes must be copied too, read-ahead data stays valid
+        return self.raw.copy_to(other_stream, offset=offset, length=length, dst_offset=dst_offset, locking=locking)
+
+    def punch_hole(self, *args, **kwargs):
+        self._reset_buffers()  # pending writes go first, and read-ahead data might get zeroed
+        return self.raw.punch_hole(*args, **kwargs)
+
+    def read_at(self, offset, n):
+        self.flush()  # pending writes must be visible, read-ahead data stays valid
+        chunk = self.raw.read_at(offset, n)  # also checks arguments and stream state
+        chunks = [chunk]
+        while chunk and len(chunk) < n:  # we loop until EOF, like read()
+            offset += len(chunk)
+            n -= len(chunk)
+            chunk = self.raw.read_at(offset, n)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def readinto_at(self, offset, buffer):
+        self.flush()  # pending writes must be visible, read-ahead data stays valid
+        buffer = memoryview(buffer).cast("B")
+        count = total = self.raw.readinto_at(offset, buffer)  # also checks arguments and stream state
+        while count and total < len(buffer):  # we loop until EOF, like readinto()
+            count = self.raw.readinto_at(offset + total, buffer[total:])
+            total += count
+        return total
+
+    def write_at(self, offset, buffer):
+        self._reset_buffers()  # we keep writes ordered, and drop read-ahead data which might become stale
+        buffer = memoryview(buffer).cast("B")
+        count = total = self.raw.write_at(offset, buffer) or 0  # also checks arguments and stream state
+        while count and total < len(buffer):  # without progress (eg. non-blocking stream), we return the partial count
+            count = self.raw.write_at(offset + total, buffer[total:]) or 0
+            total += count
+        return total
+
+    def readv(self, buffers):
+        total = 0
+        for buffer in buffers:
+            count = self.readinto(buffer)
+            if count is None:
+                return total or None  # non-blocking stream without data
+            total += count
+            if count < memoryview(buffer).nbytes:
+                break  # EOF or no more data available
+        return total
+
+    def readv_at(self, offset, buffers):
+        self.flush()  # pending writes must be visible, read-ahead data stays valid
+        buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+        count = total = self.raw.readv_at(offset, buffers)  # also checks arguments and stream state
+        buffers = _skip_processed_bytes(buffers, count)
+        while count and buffers:  # we loop until EOF, like readinto()
+            count = self.raw.readv_at(offset + total, buffers)
+            total += count
+            buffers = _skip_processed_bytes(buffers, count)
+        return total
+
+    def writev_at(self, offset, buffers):
+        self._reset_buffers()  # we keep writes ordered, and drop read-ahead data which might become stale
+        buffers = [RSFileIO._get_source_buffer(buffer) for buffer in buffers]
+        count = total = self.raw.writev_at(offset, buffers) or 0  # also checks arguments and stream state
+        buffers = _skip_processed_bytes(buffers, total)
+        while count and buffers:  # without progress (eg. non-blocking stream), we return the partial count
+            count = self.raw.writev_at(offset + total, buffers) or 0
+            total += count
+            buffers = _skip_processed_bytes(buffers, count)
+        return total
+
     def ___USELESS__close(self):
         if not self.closed:
             try:
@@ -88,6 +199,10 @@ class _text_forwarder_mixin(object):
         self.flush()  # security
         return self.buffer.size()
 
+    def stat(self, refresh=False):
+        self.flush()
+        return self.buffer.stat(refresh)
+
     def sync(self, *args, **kwargs):
         self.flush()  # security
         return self.buffer.sync(*args, **kwargs)
@@ -100,10 +215,56 @@ class _text_forwarder_mixin(object):
         self._reset_buffers()
         return self.buffer.unlock_file(*args, **kwargs)
 
+    def query_lock(self, *args, **kwargs):
+        self._reset_buffers()
+        return self.buffer.query_lock(*args, **kwargs)
+
+    def relock(self, *args, **kwargs):
+        self._reset_buffers()
+        return self.buffer.relock(*args, **kwargs)
+
+    def map_region(self, *args, **kwargs):
+        self._reset_buffers()
+        return self.buffer.map_region(*args, **kwargs)
+
+    def advise(self, *args, **kwargs):
+        self.flush()
+        return self.buffer.advise(*args, **kwargs)
+
+    def preallocate(self, *args, **kwargs):
+        self.flush()
+        return self.buffer.preallocate(*args, **kwargs)
+
+    def punch_hole(self, *args, **kwargs):
+        self._reset_buffers()
+        return self.buffer.punch_hole(*args, **kwargs)
+
+    def copy_to(self, other_stream, offset=0, length=None, dst_offset=None, locking=True):
+        self._checkClosed()
+        raise defs.BadValueTypeError("Text stream can't do positional or vectored I/O")
+
     def readinto(self, buffer):  # to please test suite...
         self._checkClosed()
         raise defs.BadValueTypeError("Text stream can't be read into buffer")
 
+    def read_at(self, offset, n):
+        self._checkClosed()
+        raise defs.BadValueTypeError("Text stream can't do positional or vectored I/O")
+
+    readinto_at = write_at = read_at
+
+    def readv(self, buffers):
+        self._checkClosed()
+        raise defs.BadValueTypeError("Text stream can't do positional or vectored I/O")
+
+    writev = readv
+
+    def readv_at(self, offset, buffers):
+        self._checkClosed()
+        raise defs.BadValueTypeError("Text stream can't do positional or vectored I/O")
+
+    writev_at = readv_at
+
     __repr__ = __rsfile_stream_repr__
 
     def __getattr__(self, name):
@@ -134,13 +295,97 @@ class RSBufferedWriter(_buffer_forwarder_mixin, defs.io_module.BufferedWriter):
     def writable(self):  # drop when py3.5 not supported anymore
         return self.raw.writable()
 
+    def write(self, b):
+        alignment = getattr(self.raw, "_direct_alignment", 0)
+        if not alignment:
+            return super(RSBufferedWriter, self).write(b)  # io module might be monkey-patched
+
+        # With O_DIRECT, only whole blocks are written until the next flush(), so that the
+        # raw stream never has to go through the OS cache for unaligned transfers
+        if isinstance(b, str):
+            raise TypeError("can't write str to binary stream")
+        with self._write_lock:
+            if self.closed:
+                raise ValueError("write to closed file")
+            before = len(self._write_buf)
+            self._write_buf.extend(b)
+            written = len(self._write_buf) - before
+            if len(self._write_buf) >= self.buffer_size:
+                self._flush_whole_blocks_unlocked(alignment)
+            return written
+
+    def _flush_whole_blocks_unlocked(self, alignment):
+        # the first block might be partial, if the file position is not aligned
+        head_length = -self.raw.tell() % alignment
+        count = head_length + (len(self._write_buf) - head_length) // alignment * alignment
+        while count:
+            with memoryview(self._write_buf) as view, view[:count] as chunk:
+                written = self.raw.write(chunk)
+            if written is None:
+                raise BlockingIOError(errno.EAGAIN, "write could not complete without blocking", 0)
+            if not written:
+                break  # no progress, the remaining data stays buffered
+            del self._write_buf[:written]  # at once, so that a failing write() never duplicates data
+            count -= written
+
+    def writev(self, buffers):
+        """
+        Buffers small records, else submits pending data and the new buffers together, as one
+        vectored write, without copying them into the write buffer.
+        """
+        if getattr(self.raw, "_direct_alignment", 0):
+            return sum(self.write(buffer) for buffer in buffers)  # vectored writes can't ensure alignment
+
+        buffers = [RSFileIO._get_source_buffer(buffer) for buffer in buffers]
+        total = sum(len(buffer) for buffer in buffers)
+        with self._write_lock:
+            if self.closed:
+                raise ValueError("write to closed file")
+            if len(self._write_buf) + total <= self.buffer_size:
+                for buffer in buffers:
+                    self._write_buf.extend(buffer)
+            else:
+                self._flush_vector_unlocked(buffers)
+        return total
+
+    def _flush_vector_unlocked(self, buffers):
+        pending_data = self._write_buf
+        self._write_buf = bytearray()  # the old buffer can't be resized while memoryviews on it exist
+        if pending_data:
+            buffers = [pending_data] + buffers
+        try:
+            while buffers:
+                count = self.raw.writev(buffers)
+                if not count:
+                    break  # non-blocking stream, or no progress made
+                buffers = _skip_processed_bytes(buffers, count)
+        finally:
+            for buffer in buffers:  # unwritten data is kept for the next flush, like write() does
+                self._write_buf.extend(buffer)
+
 
 # class RSBufferedRandom(defs.io_module.BufferedRandom, _buffer_forwarder_mixin):  # future C extension version
 #    pass
 
 # awkward structure to have all methods/inheritance-relations OK even when monkey patching
 class RSBufferedRandom(defs.io_module.BufferedRandom, RSBufferedWriter, RSBufferedReader):
-    pass
+    def write(self, b):
+        if not getattr(self.raw, "_direct_alignment", 0):
+            return super(RSBufferedRandom, self).write(b)
+        if self._read_buf:
+            # Undo readahead, like BufferedRandom.write()
+            with self._read_lock:
+                self.raw.seek(self._read_pos - len(self._read_buf), 1)
+                self._reset_read_buf()
+        return RSBufferedWriter.write(self, b)
+
+    def writev(self, buffers):
+        if self._read_buf:
+            # Undo readahead, like write()
+            with self._read_lock:
+                self.raw.seek(self._read_pos - len(self._read_buf), 1)
+                self._reset_read_buf()
+        return RSBufferedWriter.writev(self, buffers)
 
 
 class RSTextIOWrapper(_text_forwarder_mixin, defs.io_module.TextIOWrapper):
@@ -175,15 +420,30 @@ class RSThreadSafeWrapper(object):
 
         attr = getattr(self.wrapped_stream, name)  # might raise AttributeError
 
-        if not name.startswith("_") and callable(attr):
+        if isinstance(self.wrapped_stream, RSFileIO) and name in self.wrapped_stream._NATIVE_POSITIONAL_METHODS:
+            # native positional I/O neither uses nor modifies the file pointer, so it needs no mutex
+            setattr(self, name, attr)  # direct access to the bound method of raw stream
+
+        elif not name.startswith("_") and callable(attr):
             # print ("<<<<<<< WRAPPING METHOD", name)
             def _method_proxy(*args, **kwargs):
                 return self._secure_call(name, *args, **kwargs)
             # IMPORTANT : cache the thread-safe caller in object, so that we bypass this __getattr__ next time
             setattr(self, name, _method_proxy)
+            attr = _method_proxy  # even the first call must be protected
 
         return attr
 
+    def copy_to(self, other_stream, *args, **kwargs):
+        # the target stream gets flushed, and its file pointer might be used, so its mutex is held too ; both are
+        # taken in a canonical order, so that concurrent copies in opposite directions can't deadlock
+        mutexes = [self.mutex]
+        if isinstance(other_stream, RSThreadSafeWrapper) and other_stream.mutex is not self.mutex:
+            mutexes.append(other_stream.mutex)
+        mutexes.sort(key=id)
+        with mutexes[0], (mutexes[1] if len(mutexes) > 1 else nullcontext()):
+            return self.wrapped_stream.copy_to(other_stream, *args, **kwargs)
+
     def __iter__(self):
         return iter(self.wrapped_stream)
 
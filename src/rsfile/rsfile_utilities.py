@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 
+import time
+from contextlib import contextmanager
+
 from .rsfile_definitions import *  # constants, base types and exceptions
 from .rsfile_factories import *
 
@@ -94,12 +97,17 @@ def read_from_file(
 
     Don't use on huge files, of course.
 
+    Since the whole file is read at once, binary reads are unbuffered by default (the file size is then used to
+    load the content with a single big read), and the file is only locked in shared mode.
+
     This function may raise *EnvironmentError* exceptions.
     """
 
-    mode = "R+"
+    mode = "RN"  # read-only stream, which thus takes a shared lock
     if binary:
         mode += "B"
+        if buffering is None:
+            buffering = 0  # no need for intermediate buffer
 
     with rsopen(
         filename,
@@ -113,20 +121,7 @@ def read_from_file(
         thread_safe=False,
     ) as myfile:
 
-        data_blocks = []
-        while True:
-            temp = myfile.read()  # if unbuffered, might return very little data, so we have to "loop while"
-            if not temp:
-                break
-
-            data_blocks.append(temp)
-
-        if binary:
-            joiner = b""
-        else:
-            joiner = ""
-
-        full_data = joiner.join(data_blocks)
+        full_data = myfile.read()  # reads until EOF, whatever the buffering
         return full_data
 
 
@@ -220,3 +215,105 @@ def append_to_file(
         myfile.flush()
         if sync:
             myfile.sync()
+
+
+def copy_file(src, dst, sync=False, must_create=False, must_not_create=False, locking=True, timeout=None):
+    """
+    Copies the content of the file ``src`` to the file ``dst``, and returns the number of bytes copied.
+
+    The source is locked in shared mode, and the destination in exclusive mode, during the whole copy
+    (see :meth:`copy_to() <rsfile.rsiobase.RSIOBase.copy_to>` for the copy strategies used).
+    The destination is truncated beforehand, and its permissions are not modified.
+
+    Other arguments are similar to those of :func:`rsfile.rsopen`.
+
+    This function may raise *EnvironmentError* exceptions, and raises *BadValueTypeError* if ``src``
+    and ``dst`` are the same file.
+    """
+
+    mode = "WEB"  # we erase the file, no need for "S", final sync() will suffice
+    if must_not_create:
+        mode += "N"
+    if must_create:
+        mode += "C"
+
+    with rsopen(src, mode="RNB", buffering=0, locking=locking, timeout=timeout, thread_safe=False) as source:
+
+        # opening dst would truncate the source (or wait forever for its lock)
+        try:
+            same_file = os.path.samefile(src, dst)
+        except EnvironmentError:
+            same_file = False  # dst doesn't exist yet
+        if same_file:
+            raise BadValueTypeError("Source and destination of a copy must be different files")
+
+        with rsopen(dst, mode=mode, buffering=0, locking=locking, timeout=timeout, thread_safe=False) as target:
+
+            count = source.copy_to(target, locking=False)  # whole files are already locked, if requested
+            if sync:
+                target.sync()
+            return count
+
+
+def _release_many(acquired):
+    # releases in reverse order, and reports the first failure once all unlockings were attempted
+    error = None
+    for (stream, offset, length) in reversed(acquired):
+        try:
+            stream.unlock_file(length=length, offset=offset)
+        except EnvironmentError as e:
+            error = error or e
+    del acquired[:]
+    if error is not None:
+        raise error
+
+
+@contextmanager
+def _many_locks_remover(acquired):
+    # we do nothing on __enter__()
+    try:
+        yield
+    finally:
+        _release_many(acquired)
+
+
+def lock_many(requests, timeout=None):
+    """
+    Locks several byte ranges, possibly of different files, as a whole: either they all get locked, or the ranges
+    already acquired are released before the exception (eg. :class:`rsfile.LockingException`) propagates.
+
+    ``requests`` is an iterable of ``(stream, offset, length, shared)`` tuples, with the same meaning as
+    the arguments of :meth:`lock_file() <rsfile.rsiobase.RSIOBase.lock_file>`, ``offset`` being absolute.
+    ``timeout`` applies to the acquisition of the whole batch.
+
+    Ranges are always acquired in the same canonical order (by file unique_id, then by offset), so that
+    concurrent lock_many() calls can't deadlock each other, whatever the order of their requests - as long
+    as all the code locking several ranges at once goes through this function.
+
+    Returns a context manager which releases all these locks on exit, eg.
+    ``with rsfile.lock_many([(f, 0, 100, False), (g, 500, 10, True)], timeout=5): ...``.
+    """
+    if timeout is not None and (not isinstance(timeout, (int, float)) or timeout < 0):
+        raise BadValueTypeError("timeout must be None or positive float.")
+
+    keyed_requests = []
+    for (stream, offset, length, shared) in requests:
+        sort_key = (stream.unique_id(), offset or 0, length is None, length or 0)
+        keyed_requests.append((sort_key, (stream, offset, length, shared)))
+    keyed_requests.sort(key=lambda item: item[0])  # stable, so ties keep the order of the caller
+
+    deadline = None if timeout is None else time.time() + timeout
+    acquired = []
+    try:
+        for (sort_key, (stream, offset, length, shared)) in keyed_requests:
+            remaining_time = None if deadline is None else max(0, deadline - time.time())
+            stream.lock_file(timeout=remaining_time, length=length, offset=offset, whence=SEEK_SET, shared=shared)
+            acquired.append((stream, offset, length))
+    except BaseException:
+        try:
+            _release_many(acquired)
+        except EnvironmentError:
+            pass  # the acquisition failure is what matters here
+        raise
+
+    return _many_locks_remover(acquired)
@@ -2,23 +2,73 @@
 
 
 import errno
+import mmap
 import os
+import random
 import stat
 import sys
 import time
-from array import array
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 
 from . import rsfile_definitions as defs
-from .rsfile_registries import IntraProcessLockRegistry, _default_rsfile_options
+from .rsfile_registries import IntraProcessLockRegistry, LockStatistics, _default_rsfile_options
 
 USE_MEMORYVIEW_CAST = hasattr(memoryview, "cast")
 
+COPY_BUFFER_SIZE = 1024 * 1024  # chunk size when copying files without kernel help
+
+LOCK_BACKOFF_INITIAL_DELAY = 0.001  # first retry delay in seconds, for non-spinning lock wait strategies
+
 # Does io.IOBase finalizer log the exception if the close() method fails?
 # The exception is ignored silently by default in release build.
 _IOBASE_EMITS_UNRAISABLE = (sys.version_info >= (3, 13)) or (hasattr(sys, "gettotalrefcount") or sys.flags.dev_mode)
 
 
+class MappedRegion(object):
+    """
+    Memory mapping of a locked region of file, as returned by :meth:`RSFileIOAbstract.map_region`.
+
+    Its ``view`` attribute is a memoryview covering exactly the requested region,
+    and is returned when entering a *with* block. On close(), or when leaving that block, the view is
+    released, the mapping is removed, and the region gets unlocked.
+    """
+
+    def __init__(self, stream, mapping, delta, offset, length, locked):
+        self._stream = stream
+        self._mapping = mapping  # might begin before the region, for alignment reasons
+        self._locked = locked
+        self.offset = offset
+        self.length = length
+        self.view = memoryview(mapping)[delta : delta + length]
+        self.closed = False
+
+    def __repr__(self):
+        return "<%s offset=%d length=%d closed=%s>" % (self.__class__.__name__, self.offset, self.length, self.closed)
+
+    def flush(self):
+        """Pushes modifications of a writable mapping to the file (i.e kernel cache)."""
+        if self.closed:
+            raise ValueError("I/O operation on closed memory mapping")
+        self._mapping.flush()
+
+    def close(self):
+        """Releases the view (which must not be used anymore), the mapping, and the lock of the region."""
+        if self.closed:
+            return
+        # if any of these raises, the region remains locked and open, so that close() can be retried
+        self.view.release()  # raises BufferError if some exports of this view still exist
+        self._stream._inner_unmap_region(self._mapping)
+        self.closed = True
+        if self._locked and not self._stream.closed:  # closing the stream has already released its locks
+            self._stream.unlock_file(length=self.length, offset=self.offset)
+
+    def __enter__(self):
+        return self.view
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class RSFileIOAbstract(defs.io_module.RawIOBase):
     """
     This class is an improved version of the raw stream :class:`io.FileIO`, relying on native OS primitives,
@@ -67,6 +117,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
     See RSOpen() docs for the semantic of other parameters.
     """
 
+    # positional methods whose backend implementation doesn't rely on the file pointer (i.e isn't emulated)
+    _NATIVE_POSITIONAL_METHODS = ()
+
     def __init__(
         self,
         path=None,  # it seems pywin32 already uses unicode versions of these functions, so it's cool  :-)
@@ -80,11 +133,14 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         must_not_create=False,  # only used on file opening
         synchronized=False,
         inheritable=False,
+        direct=False,
         permissions=0o777,
     ):
 
         self.enforced_locking_timeout_value = _default_rsfile_options["enforced_locking_timeout_value"]
         self.default_spinlock_delay = _default_rsfile_options["default_spinlock_delay"]
+        self.lock_wait_strategy = _default_rsfile_options["lock_wait_strategy"]
+        self.stat_caching = _default_rsfile_options["stat_caching"]
 
         # Preliminary normalization
         if append:
@@ -115,7 +171,11 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         self._unique_id = None  # unique identifier of the file, eg. (device, inode) pair
         self._fileno = None  # C style file descriptor, might be created only on request
         self._handle = None  # native platform handle other than fileno - if existing
+        self._open_stats = None  # stat snapshot taken by backends when opening - only immutable fields are reliable
         self._closefd = closefd  # set BEFORE creating streams
+        self._may_hold_locks = False  # lock-less streams don't need the lock registry on closing
+        self._coalesce_locked_ranges = True  # False if backends can only unlock exactly what they locked
+        self._stat_cache = None  # last snapshot returned by stat(), if stat_caching is enabled
 
         # variables to determine future write/read operations
         self._readable = read
@@ -126,6 +186,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
 
         self._synchronized = synchronized
         self._inheritable = inheritable
+        self._direct_alignment = 0  # set by backends if O_DIRECT alignment constraints apply to transfers
+
+        self._advice_on_close = None  # access pattern hint to emit when closing the stream
 
         name = None  # 'name' : descriptor exposed just for retrocompatibility !!!
         if path is not None:
@@ -168,7 +231,7 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
             seekable = True
             if isinstance(self._fileno, int):
                 # we bypass Rsfile for file descriptors that are pipes, devices, directories, symlinks etc.
-                st_mode = os.fstat(self._fileno).st_mode  # might raise
+                st_mode = (self._open_stats or os.fstat(self._fileno)).st_mode  # might raise
                 if stat.S_ISDIR(st_mode):
                     assert fileno or handle, (fileno, handle)  # it must NOT be a newly created file object, else bug
                     self._closefd = False  # disown file descriptor
@@ -179,6 +242,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
                 pass  # if we only have a handle, we're on windows, so no such pipe
             self._seekable = seekable
 
+            if self.stat_caching:
+                self._stat_cache = self._open_stats
+
             # These two keys, set by _inner_create_streams(), are used to
             # identify the file and handle in the intraprocess lock registry
             assert self._lock_registry_inode is not None, self._lock_registry_inode
@@ -187,7 +253,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         except OverflowError as e:
             raise defs.BadValueTypeError(e)  # probably a too big filedescriptor number
 
-        if append:
+        if append and self._origin == "path" and self._open_stats is not None and not self._open_stats.st_size:
+            pass  # a new descriptor on an empty file is already positioned at its end
+        elif append:
             try:
                 self.seek(0, os.SEEK_END)  # required by unit tests, might raise if non-seekable file...
             except OSError as exc:
@@ -212,16 +280,27 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
                 defs.io_module.RawIOBase.close(self)  # we first mark the stream as closed... it flushes, also.
             finally:
 
-                with IntraProcessLockRegistry.mutex:
-
-                    # We are careful, in case object initialization failed
-                    if hasattr(self, "_lock_registry_inode") and hasattr(self, "_lock_registry_descriptor"):
+                if getattr(self, "_advice_on_close", None) and getattr(self, "_seekable", False):
+                    try:
+                        self._inner_advise(self._advice_on_close, 0, None)
+                    except EnvironmentError:
+                        pass  # it's only a hint
+
+                # We are careful, in case object initialization failed
+                unique_id = getattr(self, "_lock_registry_inode", None)
+                may_hold_locks = getattr(self, "_may_hold_locks", True)
+                with IntraProcessLockRegistry.mutex_for(unique_id) if (unique_id and may_hold_locks) else nullcontext():
+
+                    if may_hold_locks and hasattr(self, "_lock_registry_inode") and hasattr(
+                        self, "_lock_registry_descriptor"
+                    ):
                         for (handle, shared, start, end) in IntraProcessLockRegistry.remove_file_locks(
                             self._lock_registry_inode, self._lock_registry_descriptor
                         ):
                             # print (">>>>>>>> ", (handle, shared, start, end))
                             length = None if end is None else (end - start)
                             self._inner_file_unlock(length, start)
+                            LockStatistics.record_release(self._lock_registry_inode, handle, start, end)
 
                     # Mark the raw stream as closed, even if some operations failed
                     self._inner_close_streams()  # Might raise OverflowError
@@ -247,6 +326,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
     def isatty(self):
         """On OSX the fileio.c implementation fails to recognized /dev/tty as a terminal,
         when using custom rsfile classes, so let's use this '_pyio.py' implementation instead"""
+        if self._open_stats is not None and stat.S_ISREG(self._open_stats.st_mode):
+            self._checkClosed()
+            return False  # spares an ioctl() when opening regular files
         return os.isatty(self.fileno())
 
     def seekable(self):
@@ -330,12 +412,30 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
 
     def times(self):
         self._checkClosed()
+        if self.stat_caching:
+            stats = self.stat()
+            return defs.FileTimes(
+                access_time=stats.st_atime,
+                modification_time=stats.st_mtime,
+                access_time_ns=stats.st_atime_ns,
+                modification_time_ns=stats.st_mtime_ns,
+            )
         return self._inner_times()
 
     def size(self):  # non standard method
         self._checkClosed()
+        if self.stat_caching:
+            return self.stat().st_size
         return self._inner_size()
 
+    def stat(self, refresh=False):
+        self._checkClosed()
+        stats = self._stat_cache
+        if stats is None or refresh or not self.stat_caching:
+            stats = self._inner_stat()
+            self._stat_cache = stats if self.stat_caching else None
+        return stats
+
     def tell(self):
         self._checkClosed()
         res = self._inner_tell()
@@ -351,20 +451,72 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
 
         return res
 
+    @staticmethod
+    def _get_source_buffer(buffer):
+        # Returns a bytes-like object whose len() is a number of bytes, without copying data if possible
+
+        if isinstance(buffer, str):
+            raise defs.BadValueTypeError("can't write unicode to binary stream")
+
+        if not isinstance(buffer, (bytes, bytearray)):
+            buffer = memoryview(buffer)  # raises TypeError if no buffer interface
+            if not buffer.contiguous:
+                buffer = memoryview(buffer.tobytes())  # backends require a single contiguous memory area
+            if USE_MEMORYVIEW_CAST:
+                buffer = buffer.cast("B")  # so that len() returns a number of bytes, whatever the item size
+        return buffer
+
+    @staticmethod
+    def _get_target_buffer(buffer, method_name):
+        # Returns a writable memoryview of bytes, sharing the memory of the buffer
+
+        buffer = memoryview(buffer)
+        if buffer.readonly:
+            raise defs.BadValueTypeError("%s() argument must be a writable bytes-like object" % method_name)
+        if USE_MEMORYVIEW_CAST:
+            buffer = buffer.cast("B")
+        return buffer
+
     def readall(self):
         """Reads until EOF, using multiple read() calls.
 
         No limit is set on the amount of data read, so you might
         fill up your RAM with this method.
+
+        For regular files, the remaining file size is used to read the whole
+        content with a single big read() call (plus one to detect EOF), so that
+        no final concatenation of data chunks is required. Short reads are followed
+        by requests for the rest of the expected content, and chunks grow geometrically
+        when the file size is unknown or exceeded.
         """
+        self._checkClosed()
+        self._checkReadable()
+
+        bufsize = defs.DEFAULT_BUFFER_SIZE
+        expected = 0
+        if self._seekable:
+            # an extra byte is requested, so that growth of the file gets noticed
+            remaining = self._inner_size() - self._inner_tell()
+            if remaining >= 0:
+                expected = remaining + 1
+                bufsize = max(bufsize, expected)
+
         chunks = []
+        total = 0
         while True:
-            data = self.read(defs.DEFAULT_BUFFER_SIZE)
+            data = self._inner_read(bufsize)
             if not data:
                 break
             chunks.append(data)
+            total += len(data)
+            if expected - total > 1:
+                bufsize = expected - total  # short read, eg. for huge requests or with direct I/O
+            elif total < expected:
+                bufsize = defs.DEFAULT_BUFFER_SIZE  # we're most probably at EOF
+            else:
+                bufsize = max(defs.DEFAULT_BUFFER_SIZE, total)  # the file has grown, or its size is unknown
         if chunks:
-            return b"".join(chunks)
+            return b"".join(chunks)  # no copy occurs if there is a single chunk
         else:
             # b'' or None
             return data
@@ -388,29 +540,20 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
     def readinto(self, buffer):
         """Reads up to len(b) bytes into b.
 
-        Inefficient in RSFile, as several data copies can be required
-        to obtain the result - use read() instead.
+        Data is read directly into the provided buffer (bytearray, array.array, memoryview...)
+        when the backend supports it, without intermediate copies.
 
-        Returns the number of bytes read (0 for EOF or if len(buffer) == 0).
+        Returns the number of bytes read (0 for EOF or if len(buffer) == 0),
+        or None if the object is set not to block and has no data ready to be read.
         """
         self._checkClosed()
         self._checkReadable()
 
-        if USE_MEMORYVIEW_CAST:
-            buffer = memoryview(buffer).cast("B")
-
-        mybytes = self._inner_read(len(buffer))
-        byteslen = len(mybytes)
-        assert mybytes is None or isinstance(mybytes, bytes), type(mybytes)
+        buffer = self._get_target_buffer(buffer, "readinto")
 
-        if isinstance(buffer, array):
-            typecode = b"b" if (sys.version_info[:2] < (3, 0)) else "b"  # typecode weirdness...
-            buffer[0:byteslen] = array(typecode, mybytes)
-        else:
-            # for bytearray, memoryview...
-            buffer[0:byteslen] = mybytes
-
-        return byteslen
+        res = self._inner_readinto(buffer)
+        assert res is None or 0 <= res <= len(buffer), (res, len(buffer))
+        return res
 
     def write(self, buffer):
         """Writes the given data to the IO stream.
@@ -418,27 +561,16 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         Returns the number of bytes written, which may be less than len(b), or None if
         write couldn't be done on a non-blocking device.
 
-        Accepted buffer types are bytes, bytearray, array.array, and memoryview (the last two being inefficient to
-        write).
+        Accepted buffer types are bytes, bytearray, array.array, memoryview, and any other object
+        supporting the buffer protocol; contiguous buffers are handed to the backend without being copied.
         """
 
-        # TODO: improve low level routines to accept buffers and arrays as data, so that we don't have to
-        # convert/copy stuffs around...
-
         self._checkClosed()
         self._checkWritable()
 
-        if isinstance(buffer, str):
-            raise defs.BadValueTypeError("can't write unicode to binary stream")
-
-        if isinstance(buffer, memoryview):
-            buffer = buffer.tobytes()
-        elif isinstance(buffer, array):
-            try:
-                buffer = buffer.tobytes()  # New API
-            except AttributeError:
-                buffer = buffer.tostring()
+        buffer = self._get_source_buffer(buffer)
 
+        self._stat_cache = None
         res = self._inner_write(buffer)
         # assert res == len(buffer), str(res, len(buffer)) # NOOO - we might have less than that actually if disk full !
 
@@ -453,6 +585,231 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
 
         return res  # might be None (nonblocking IO)
 
+    def _check_positional_args(self, offset, n=None):
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise defs.BadValueTypeError("offset must be a positive integer.")
+        if n is not None and (not isinstance(n, int) or isinstance(n, bool) or n < 0):
+            raise defs.BadValueTypeError("number of bytes must be a positive integer.")
+
+    def read_at(self, offset, n):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkReadable()
+        self._check_positional_args(offset, n)
+
+        mybytes = self._inner_read_at(offset, n)
+        assert isinstance(mybytes, bytes), type(mybytes)
+        return mybytes
+
+    def readinto_at(self, offset, buffer):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkReadable()
+        self._check_positional_args(offset)
+
+        buffer = self._get_target_buffer(buffer, "readinto_at")
+
+        res = self._inner_readinto_at(offset, buffer)
+        assert 0 <= res <= len(buffer), (res, len(buffer))
+        return res
+
+    def write_at(self, offset, buffer):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkWritable()
+        self._check_positional_args(offset)
+
+        if self._append:
+            # O_APPEND would silently redirect positional writes to the end of file, on linux
+            raise IOError(errno.EINVAL, "Positional writes are not supported on append-mode streams")
+
+        buffer = self._get_source_buffer(buffer)
+
+        self._stat_cache = None
+        res = self._inner_write_at(offset, buffer)
+        if res < 0 or res > len(buffer):
+            raise RuntimeError("Madness - %d bytes written instead of max %d" % (res, len(buffer)))
+        return res
+
+    def readv(self, buffers):
+        """
+        See RSOpen() doc.
+        """
+        self._checkClosed()
+        self._checkReadable()
+
+        buffers = [self._get_target_buffer(buffer, "readv") for buffer in buffers]
+
+        res = self._inner_readv(buffers)
+        assert res is None or 0 <= res <= sum(len(buffer) for buffer in buffers), res
+        return res  # might be None (nonblocking IO)
+
+    def writev(self, buffers):
+        """
+        See RSOpen() doc.
+        """
+        self._checkClosed()
+        self._checkWritable()
+
+        buffers = [self._get_source_buffer(buffer) for buffer in buffers]
+
+        self._stat_cache = None
+        res = self._inner_writev(buffers)
+        if res is not None and (res < 0 or res > sum(len(buffer) for buffer in buffers)):
+            raise RuntimeError("Madness - %d bytes written instead of max %d" % (res, sum(map(len, buffers))))
+        return res  # might be None (nonblocking IO)
+
+    def readv_at(self, offset, buffers):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkReadable()
+        self._check_positional_args(offset)
+
+        buffers = [self._get_target_buffer(buffer, "readv_at") for buffer in buffers]
+
+        res = self._inner_readv_at(offset, buffers)
+        assert 0 <= res <= sum(len(buffer) for buffer in buffers), res
+        return res
+
+    def writev_at(self, offset, buffers):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkWritable()
+        self._check_positional_args(offset)
+
+        if self._append:
+            # O_APPEND would silently redirect positional writes to the end of file, on linux
+            raise IOError(errno.EINVAL, "Positional writes are not supported on append-mode streams")
+
+        buffers = [self._get_source_buffer(buffer) for buffer in buffers]
+
+        self._stat_cache = None
+        res = self._inner_writev_at(offset, buffers)
+        if res < 0 or res > sum(len(buffer) for buffer in buffers):
+            raise RuntimeError("Madness - %d bytes written instead of max %d" % (res, sum(map(len, buffers))))
+        return res
+
+    @staticmethod
+    def _get_raw_target_stream(stream):
+        # buffered, text and thread-safe rsfile streams are unwrapped, and their buffers get reset
+        while not isinstance(stream, RSFileIOAbstract):
+            if hasattr(stream, "wrapped_stream"):
+                stream = stream.wrapped_stream
+            elif hasattr(stream, "_reset_buffers"):
+                stream._reset_buffers()
+                stream = stream.buffer if hasattr(stream, "buffer") else stream.raw
+            else:
+                raise defs.BadValueTypeError("Target stream must be an rsfile stream, not %r" % type(stream))
+        return stream
+
+    def copy_to(self, other_stream, offset=0, length=None, dst_offset=None, locking=True):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkReadable()
+        self._check_positional_args(offset, length)
+        if dst_offset is None:
+            dst_offset = offset
+        self._check_positional_args(dst_offset)
+
+        target = self._get_raw_target_stream(other_stream)
+        target._checkSeekable()
+        target._checkWritable()
+        if target._append:
+            raise IOError(errno.EINVAL, "Can't copy data to a specific position of a stream in append mode")
+
+        available = max(0, self._inner_size() - offset)
+        length = available if length is None else min(length, available)
+        if not length:
+            return 0
+
+        if target.unique_id() == self.unique_id() and (offset < dst_offset + length and dst_offset < offset + length):
+            raise defs.BadValueTypeError("Can't copy a file region onto an overlapping region of the same file.")
+
+        if locking:
+            from .rsfile_utilities import lock_many  # circular import otherwise
+
+            locks = lock_many([(self, offset, length, True), (target, dst_offset, length, False)])
+        else:
+            locks = nullcontext()
+
+        with locks:
+            length = min(length, max(0, self._inner_size() - offset))  # the source might have shrunk meanwhile
+            if length:
+                target._stat_cache = None
+                self._inner_copy_to(target, offset, length, dst_offset)
+        return length
+
+    def map_region(
+        self, offset, length, shared=None, access=None, timeout=None, locking=True, populate=False, advice=None
+    ):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._check_positional_args(offset, length)
+
+        if not length:
+            raise defs.BadValueTypeError("length must be a strictly positive integer.")
+
+        if shared is not None and shared not in (True, False):
+            raise defs.BadValueTypeError("shared must be None or True/False.")
+
+        if shared is None:
+            shared = not self._writable  # same as lock_file()
+
+        if access is None:
+            access = mmap.ACCESS_READ if shared else mmap.ACCESS_WRITE
+        elif access not in (mmap.ACCESS_READ, mmap.ACCESS_WRITE, mmap.ACCESS_COPY):
+            raise defs.BadValueTypeError("access must be None or one of mmap.ACCESS_READ/WRITE/COPY")
+
+        if shared and access == mmap.ACCESS_WRITE:
+            raise defs.BadValueTypeError("Can't map a region for writing while only holding a shared lock on it.")
+
+        if locking:
+            self.lock_file(timeout=timeout, length=length, offset=offset, shared=shared)  # checks stream permissions
+
+        try:
+            # the mapping offset must be a multiple of the allocation granularity
+            delta = offset % mmap.ALLOCATIONGRANULARITY
+            mapping = self._inner_map_region(offset - delta, length + delta, access, populate)
+            try:
+                if advice is not None and hasattr(mapping, "madvise"):  # hints only exist on recent unix pythons
+                    mapping.madvise(advice)
+                return MappedRegion(self, mapping, delta=delta, offset=offset, length=length, locked=locking)
+            except:
+                self._inner_unmap_region(mapping)
+                raise
+        except:
+            if locking:
+                self.unlock_file(length=length, offset=offset)
+            raise
+
+    def advise(self, pattern, offset=0, length=None):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._check_positional_args(offset, length)
+
+        if pattern not in defs.FILE_ACCESS_PATTERNS:
+            raise defs.BadValueTypeError(
+                "Unknown access pattern %r, must be one of %s" % (pattern, defs.FILE_ACCESS_PATTERNS)
+            )
+
+        self._inner_advise(pattern, offset, length or None)
+
     def truncate(self, size=None, zero_fill=True):
         """
         See RSOpen() doc.
@@ -468,32 +825,60 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
                 errno.EINVAL, "Invalid argument : truncation size must be None or positive integer, not '%s'" % size
             )
 
-        current_size = self.size()
+        self._stat_cache = None
+        current_size = self._inner_size()
         if size == current_size:
-            pass  # nothing to be done
+            return current_size  # nothing to be done
         elif size < current_size:
             self._inner_reduce(size)
         else:
             assert size > current_size, (size, current_size)
             self._inner_extend(size, zero_fill)
 
-            current_size = self.size()
+            current_size = self._inner_size()
             if current_size != size:  # no native operation worked for it. so we fill with zeros by ourselves
 
                 assert current_size < size
                 old_pos = self._inner_tell()
                 self._inner_seek(current_size, os.SEEK_SET)
-                bytes_to_write = size - current_size
-                (q, r) = divmod(bytes_to_write, defs.DEFAULT_BUFFER_SIZE)
-
-                for _ in range(q):
-                    padding = b"\0" * defs.DEFAULT_BUFFER_SIZE
-                    self._inner_write(padding)
-                count = self._inner_write(b"\0" * r)
-                assert count == r, (count, r)  # no blocking writes for files, theoretically...
+                self._write_zeros(size - current_size)
                 self._inner_seek(old_pos)  # important
+        return self._inner_size()
+
+    def _write_zeros(self, bytes_to_write):
+        # the same padding buffer is reused for all chunks
+        padding = memoryview(b"\0" * min(bytes_to_write, defs.DEFAULT_BUFFER_SIZE))
+        while bytes_to_write:
+            count = self._inner_write(padding[: min(bytes_to_write, len(padding))])
+            assert count, count  # no blocking writes for files, theoretically...
+            bytes_to_write -= count
+
+    def preallocate(self, offset, length):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkWritable()
+        self._check_positional_args(offset, length)
+
+        self._stat_cache = None
+        if length:
+            self._inner_preallocate(offset, length)
         return self.size()
 
+    def punch_hole(self, offset, length):
+        """
+        See RSOpen() doc.
+        """
+        self._checkSeekable()  # handles PIPES, already checks if closed
+        self._checkWritable()
+        self._check_positional_args(offset, length)
+
+        length = min(length, max(0, self._inner_size() - offset))  # file size is never modified
+        self._stat_cache = None
+        if length:
+            self._inner_punch_hole(offset, length)
+
     def flush(self):
         """
         See RSOpen() doc.
@@ -538,103 +923,163 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         if timeout is not None and (not isinstance(timeout, (int, float)) or timeout < 0):
             raise defs.BadValueTypeError("timeout must be None or positive float.")
 
-        if length is not None and (not isinstance(length, int) or length < 0):
-            raise defs.BadValueTypeError("length must be None or positive integer.")
-
-        if offset is not None and not isinstance(offset, int):
-            raise defs.BadValueTypeError("offset must be None or an integer.")
-
-        if whence not in defs.SEEK_VALUES:
-            raise defs.BadValueTypeError("whence must be a valid SEEK_* value")
-
-        if shared is not None and shared not in (True, False):
-            raise defs.BadValueTypeError("shared must be None or True/False.")
-
-        if shared is None:
-            if self._writable:
-                shared = False
-            else:
-                shared = True
+        (abs_offset, shared) = self._check_lock_arguments(length, offset, whence, shared)
 
         if (shared and not self._readable) or (not shared and not self._writable):
             raise IOError("Can't obtain exclusive lock on non-writable stream, or shared lock on non-readable stream.")
 
-        abs_offset = self._convert_relative_offset_to_absolute(offset, whence)
+        if self.lock_wait_strategy not in defs.LOCK_WAIT_STRATEGIES:
+            raise defs.BadValueTypeError("lock_wait_strategy must be one of %s" % (defs.LOCK_WAIT_STRATEGIES,))
+
         blocking = timeout is None  # here, it means "forever waiting for the lock"
         # we enforce spin-locking if a global timeout exists
         low_level_blocking = blocking if (self.enforced_locking_timeout_value is None) else False
 
+        # other strategies wait for in-process unlockings, instead of polling the registry
+        spinning = self.lock_wait_strategy == "spin"
+
         start_time = time.time()
+        attempts = [0]
+        conflicts = [0, 0]  # blocked by locks of the current process, and by kernel-level locks
+        release_watcher = []  # created by the first "inotify" wait, and shared by all the retries
+
+        def record_statistics(acquired):
+            if LockStatistics.is_enabled():
+                LockStatistics.record_wait(
+                    self._lock_registry_inode,
+                    self._lock_registry_descriptor,
+                    abs_offset,
+                    (abs_offset + length) if length else None,
+                    time.time() - start_time,
+                    attempts[0] + 1,
+                    conflicts[0],
+                    conflicts[1],
+                    acquired,
+                )
+
+        def get_remaining_time():
+            """
+            Returns the time left before the timeout (or the enforced timeout) expires, None if unlimited.
+            """
+            max_delay = self.enforced_locking_timeout_value if blocking else timeout
+            if max_delay is None:
+                return None
+            return max(0, max_delay - (time.time() - start_time))
 
-        def check_timeout(env_error):
+        def check_timeout(env_error, expired=False, kernel_conflict=False):
             """
-            If timeout has expired, raises the exception given as parameter.
-            Else, sleeps for a short period.
+            If timeout has expired, raises the exception given as parameter, with details on the conflicting lock.
+            Else, waits for a short period.
             """
             delay = time.time() - start_time
             if not blocking:  # we have a timeout set
 
-                if delay >= timeout:  # else, we try again until success or timeout
+                if expired or delay >= timeout:  # else, we try again until success or timeout
+                    record_statistics(acquired=False)
                     (error_code, title) = env_error.args
+                    holder = self._find_lock_holder(length, abs_offset, shared, kernel_conflict)
+                    if holder is not None:
+                        title = "%s (conflicting with %r)" % (title, holder)
                     filename = getattr(self, "name", "Unknown File")  # to be improved
-                    raise defs.LockingException(error_code, title, filename)
+                    exception = defs.LockingException(error_code, title, filename)
+                    exception.holder = holder
+                    raise exception
 
             elif (self.enforced_locking_timeout_value is not None) and (
-                delay >= self.enforced_locking_timeout_value
+                expired or delay >= self.enforced_locking_timeout_value
             ):  # for blocking attempts only
+                record_statistics(acquired=False)
+                holder = self._find_lock_holder(length, abs_offset, shared, kernel_conflict)
+                details = "" if holder is None else (", conflicting with %r" % holder)
                 raise RuntimeError(
-                    "Locking delay exceeded global 'enforced_locking_timeout_value' option (%d s)."
-                    % self.enforced_locking_timeout_value
+                    "Locking delay exceeded global 'enforced_locking_timeout_value' option (%d s)%s."
+                    % (self.enforced_locking_timeout_value, details)
                 )
 
-            time.sleep(self.default_spinlock_delay)
+            self._wait_before_lock_retry(attempts[0], get_remaining_time(), release_watcher)
+            attempts[0] += 1
 
         success = False
 
-        while not success:
-
-            # STEP ONE : acquiring ownership on the lock inside current process
-            res = IntraProcessLockRegistry.register_file_lock(
-                self._lock_registry_inode,
-                self._lock_registry_descriptor,
-                length,
-                abs_offset,
-                low_level_blocking,
-                shared,
-                self.enforced_locking_timeout_value,
-            )
+        self._may_hold_locks = True
 
-            if not res:
-                check_timeout(IOError(errno.EPERM, "Current process has already locked this byte range"))
-                continue
+        # spinning threads poll the registry, which must know they're waiting, for deadlock detection
+        retrying = spinning and not low_level_blocking
 
-            try:
+        try:
 
-                while not success:
+            while not success:
+
+                # STEP ONE : acquiring ownership on the lock inside current process
+                res = IntraProcessLockRegistry.register_file_lock(
+                    self._lock_registry_inode,
+                    self._lock_registry_descriptor,
+                    length,
+                    abs_offset,
+                    low_level_blocking or not spinning,
+                    shared,
+                    None if (low_level_blocking or spinning) else get_remaining_time(),
+                    coalesce=self._coalesce_locked_ranges,
+                    retrying=retrying,
+                )
 
-                    # STEP TWO : acquiring the lock for real, at kernel level
+                if not res:
+                    conflicts[0] += 1
                     try:
-
-                        # import multiprocessing
-                        # print ("---------->", multiprocessing.current_process().name, " LOCKED ", (length,
-                        # abs_offset))
-
-                        self._inner_file_lock(
-                            length=length, abs_offset=abs_offset, blocking=low_level_blocking, shared=shared
+                        check_timeout(IOError(errno.EPERM, "Current process has already locked this byte range"))
+                    except BaseException:
+                        if retrying:
+                            IntraProcessLockRegistry.forget_lock_retries()  # we give up waiting for the registry
+                        raise
+                    continue
+
+                try:
+
+                    while not success:
+
+                        # STEP TWO : acquiring the lock for real, at kernel level
+                        try:
+
+                            # import multiprocessing
+                            # print ("---------->", multiprocessing.current_process().name, " LOCKED ", (length,
+                            # abs_offset))
+
+                            self._inner_file_lock(
+                                length=length, abs_offset=abs_offset, blocking=low_level_blocking, shared=shared
+                            )
+
+                            success = True  # we leave the two loops
+
+                        except EnvironmentError as e:
+                            conflicts[1] += 1
+                            if self.lock_wait_strategy == "thread" and not low_level_blocking:
+                                res = self._inner_file_lock_in_thread(length, abs_offset, shared, get_remaining_time())
+                                if res:
+                                    success = True
+                                    continue
+                                elif res is False:
+                                    check_timeout(e, expired=True, kernel_conflict=True)
+                                # else, no time left, lock taken by another, or no helper thread support,
+                                # so we fall back to "backoff"
+                            check_timeout(e, kernel_conflict=True)
+
+                finally:
+                    if not success:
+                        res = IntraProcessLockRegistry.unregister_file_lock(
+                            self._lock_registry_inode,
+                            self._lock_registry_descriptor,
+                            length,
+                            abs_offset,
+                            coalesce=self._coalesce_locked_ranges,
                         )
+                        assert res in (True, False)  # there may or may not be locks left after that, we dunno
 
-                        success = True  # we leave the two loops
-
-                    except EnvironmentError as e:
-                        check_timeout(e)
-
-            finally:
-                if not success:
-                    res = IntraProcessLockRegistry.unregister_file_lock(
-                        self._lock_registry_inode, self._lock_registry_descriptor, length, abs_offset
-                    )
-                    assert res in (True, False)  # there may or may not be locks left after that, we dunno
+        finally:
+            if release_watcher:
+                self._inner_close_release_watcher(release_watcher[0])
 
+        record_statistics(acquired=True)
+        self._stat_cache = None  # others may have modified the file until now
         return self._lock_remover(length, abs_offset, os.SEEK_SET)
 
     def unlock_file(self, length=None, offset=0, whence=os.SEEK_SET):
@@ -655,14 +1100,187 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         # abs_offset, os.SEEK_SET))
         abs_offset = self._convert_relative_offset_to_absolute(offset, whence)
 
-        with IntraProcessLockRegistry.mutex:  # IMPORTANT - keep the registry lock during the whole operation
-            IntraProcessLockRegistry.unregister_file_lock(
-                self._lock_registry_inode, self._lock_registry_descriptor, length, abs_offset
+        # IMPORTANT - keep the registry lock during the whole operation
+        with IntraProcessLockRegistry.mutex_for(self._lock_registry_inode):
+            released_areas = IntraProcessLockRegistry.release_file_range(
+                self._lock_registry_inode,
+                self._lock_registry_descriptor,
+                length,
+                abs_offset,
+                coalesce=self._coalesce_locked_ranges,
             )
-            self._inner_file_unlock(length, abs_offset)
+            for (start, end) in released_areas:  # contiguous areas are released in a single call
+                self._inner_file_unlock(None if end is None else (end - start), start)
+        LockStatistics.record_release(
+            self._lock_registry_inode,
+            self._lock_registry_descriptor,
+            abs_offset,
+            (abs_offset + length) if length else None,
+        )
+
+    def query_lock(self, length=None, offset=None, whence=os.SEEK_SET, shared=None):
+
+        self._checkSeekable()  # pipes and such can't be locked... already checks if closed
+
+        (abs_offset, shared) = self._check_lock_arguments(length, offset, whence, shared)
+
+        record = IntraProcessLockRegistry.find_blocking_lock(
+            self._lock_registry_inode, self._lock_registry_descriptor, length, abs_offset, shared
+        )
+        if record is not None:
+            (handle, record_shared, start, end) = record
+            return defs.LockHolder(record_shared, start, end, os.getpid(), handle)
+
+        return self._inner_query_lock(length, abs_offset, shared)
+
+    def relock(self, shared, length=None, offset=None, whence=os.SEEK_SET, timeout=None):
+
+        self._checkSeekable()  # pipes and such can't be locked... already checks if closed
+
+        if timeout is not None and (not isinstance(timeout, (int, float)) or timeout < 0):
+            raise defs.BadValueTypeError("timeout must be None or positive float.")
+
+        if shared not in (True, False):
+            raise defs.BadValueTypeError("shared must be True or False.")
+
+        (abs_offset, shared) = self._check_lock_arguments(length, offset, whence, shared)
+
+        if (shared and not self._readable) or (not shared and not self._writable):
+            raise IOError("Can't obtain exclusive lock on non-writable stream, or shared lock on non-readable stream.")
+
+        if shared:
+            # Downgrades never block ; woken up waiters only get the registry mutex once the kernel lock is shared
+            with IntraProcessLockRegistry.mutex_for(self._lock_registry_inode):
+                res = IntraProcessLockRegistry.convert_file_lock(
+                    self._lock_registry_inode,
+                    self._lock_registry_descriptor,
+                    length,
+                    abs_offset,
+                    True,
+                    False,
+                    None,
+                    coalesce=self._coalesce_locked_ranges,
+                )
+                assert res
+                self._inner_file_relock(length, abs_offset, False, True)
+            return
+
+        blocking = timeout is None
+        max_delay = self.enforced_locking_timeout_value if blocking else timeout
+        low_level_blocking = blocking and self.enforced_locking_timeout_value is None
+        start_time = time.time()
+
+        def get_remaining_time():
+            return None if max_delay is None else max(0, max_delay - (time.time() - start_time))
+
+        def raise_timeout(kernel_conflict):
+            holder = self._find_lock_holder(length, abs_offset, shared, kernel_conflict, other_handles_only=True)
+            details = "" if holder is None else (" (conflicting with %r)" % holder)
+            if not blocking:
+                filename = getattr(self, "name", "Unknown File")
+                exception = defs.LockingException(errno.EAGAIN, "Couldn't upgrade lock in time" + details, filename)
+                exception.holder = holder
+                raise exception
+            raise RuntimeError(
+                "Locking delay exceeded global 'enforced_locking_timeout_value' option (%d s)%s."
+                % (self.enforced_locking_timeout_value, details)
+            )
+
+        # STEP ONE : upgrading the lock inside current process, in priority over other waiters
+        if not IntraProcessLockRegistry.convert_file_lock(
+            self._lock_registry_inode,
+            self._lock_registry_descriptor,
+            length,
+            abs_offset,
+            False,
+            max_delay != 0,
+            get_remaining_time(),
+            coalesce=self._coalesce_locked_ranges,
+        ):
+            raise_timeout(kernel_conflict=False)
+
+        # STEP TWO : upgrading the kernel lock, without releasing it meanwhile
+        success = False
+        release_watcher = []
+        try:
+            attempts = 0
+            while not success:
+                try:
+                    self._inner_file_relock(length, abs_offset, low_level_blocking, False)
+                    success = True
+                    self._stat_cache = None
+                except EnvironmentError:
+                    if low_level_blocking:
+                        raise  # eg. deadlock detected by the kernel
+                    remaining_time = get_remaining_time()
+                    if not remaining_time:
+                        raise_timeout(kernel_conflict=True)
+                    self._wait_before_lock_retry(attempts, remaining_time, release_watcher)
+                    attempts += 1
+        finally:
+            if release_watcher:
+                self._inner_close_release_watcher(release_watcher[0])
+            if not success:  # we remain a mere reader
+                IntraProcessLockRegistry.convert_file_lock(
+                    self._lock_registry_inode,
+                    self._lock_registry_descriptor,
+                    length,
+                    abs_offset,
+                    True,
+                    False,
+                    None,
+                    coalesce=self._coalesce_locked_ranges,
+                )
 
     # # Private methods - no check is made on their argument or the file object state ! # #
 
+    def _check_lock_arguments(self, length, offset, whence, shared):
+        """
+        Validates the range and sharing arguments of locking methods, and returns (abs_offset, shared).
+        """
+        if length is not None and (not isinstance(length, int) or length < 0):
+            raise defs.BadValueTypeError("length must be None or positive integer.")
+
+        if offset is not None and not isinstance(offset, int):
+            raise defs.BadValueTypeError("offset must be None or an integer.")
+
+        if whence not in defs.SEEK_VALUES:
+            raise defs.BadValueTypeError("whence must be a valid SEEK_* value")
+
+        if shared is not None and shared not in (True, False):
+            raise defs.BadValueTypeError("shared must be None or True/False.")
+
+        if shared is None:
+            if self._writable:
+                shared = False
+            else:
+                shared = True
+
+        return (self._convert_relative_offset_to_absolute(offset, whence), shared)
+
+    def _find_lock_holder(self, length, abs_offset, shared, kernel_conflict, other_handles_only=False):
+        # Best effort lookup of the lock which made a locking attempt fail, for error messages
+        try:
+            if not kernel_conflict:  # else, our own handle is already registered for that range
+                record = IntraProcessLockRegistry.find_blocking_lock(
+                    self._lock_registry_inode,
+                    self._lock_registry_descriptor,
+                    length,
+                    abs_offset,
+                    shared,
+                    other_handles_only=other_handles_only,
+                )
+                if record is not None:
+                    (handle, record_shared, start, end) = record
+                    return defs.LockHolder(record_shared, start, end, os.getpid(), handle)
+            holder = self._inner_query_lock(length, abs_offset, shared)
+            if holder is None and kernel_conflict:
+                # the kernel refused the lock, but we don't know who holds it
+                holder = defs.LockHolder(None, abs_offset, (abs_offset + length) if length else None, None)
+            return holder
+        except EnvironmentError:
+            return None
+
     def _inner_create_streams(
         self,
         path,
@@ -673,6 +1291,7 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
         must_not_create,
         synchronized,
         inheritable,
+        direct,
         fileno,
         handle,
         closefd,
@@ -704,6 +1323,9 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
     def _inner_times(self):
         self._unsupported("times")
 
+    def _inner_stat(self):
+        self._unsupported("stat")
+
     def _inner_size(self):
         self._unsupported("size")
 
@@ -716,15 +1338,203 @@ class RSFileIOAbstract(defs.io_module.RawIOBase):
     def _inner_read(self, n):
         self._unsupported("read")
 
+    def _inner_readinto(self, buffer):
+        # Fallback for backends without native readinto, buffer is a writable memoryview of bytes
+        mybytes = self._inner_read(len(buffer))
+        if mybytes is None:
+            return None
+        byteslen = len(mybytes)
+        buffer[0:byteslen] = mybytes
+        return byteslen
+
     def _inner_write(self, buffer):
         self._unsupported("write")
 
+    def _inner_read_at(self, offset, n):
+        # Fallback emulation, NOT atomic regarding other users of the file pointer
+        old_pos = self._inner_tell()
+        try:
+            self._inner_seek(offset, os.SEEK_SET)
+            return self._inner_read(n)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_readinto_at(self, offset, buffer):
+        # Fallback emulation, NOT atomic regarding other users of the file pointer
+        old_pos = self._inner_tell()
+        try:
+            self._inner_seek(offset, os.SEEK_SET)
+            return self._inner_readinto(buffer)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_write_at(self, offset, buffer):
+        # Fallback emulation, NOT atomic regarding other users of the file pointer
+        old_pos = self._inner_tell()
+        try:
+            self._inner_seek(offset, os.SEEK_SET)
+            return self._inner_write(buffer)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_readv(self, buffers):
+        # Fallback for backends without native scatter reads
+        total = 0
+        for buffer in buffers:
+            count = self._inner_readinto(buffer)
+            if count is None:
+                return total or None
+            total += count
+            if count < len(buffer):
+                break  # EOF or no more data available
+        return total
+
+    def _inner_writev(self, buffers):
+        # Fallback for backends without native gather writes : a single write, but with data copy
+        return self._inner_write(b"".join(buffers))
+
+    def _inner_readv_at(self, offset, buffers):
+        # Fallback emulation, NOT atomic regarding other users of the file pointer
+        old_pos = self._inner_tell()
+        try:
+            self._inner_seek(offset, os.SEEK_SET)
+            return self._inner_readv(buffers)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_writev_at(self, offset, buffers):
+        # Fallback emulation, NOT atomic regarding other users of the file pointer
+        old_pos = self._inner_tell()
+        try:
+            self._inner_seek(offset, os.SEEK_SET)
+            return self._inner_writev(buffers)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_copy_to(self, target, offset, length, dst_offset):
+        # holes of sparse files are not copied, but punched in the target (or let at its end)
+        for (segment_offset, segment_length, is_data) in self._inner_list_segments(offset, length):
+            segment_dst_offset = dst_offset + (segment_offset - offset)
+            if is_data:
+                self._inner_copy_segment(target, segment_offset, segment_length, segment_dst_offset)
+            else:
+                target.punch_hole(segment_dst_offset, segment_length)  # ignores what is beyond the end of file
+
+        if target._inner_size() < dst_offset + length:
+            target.truncate(dst_offset + length)  # trailing hole
+
+    def _inner_list_segments(self, offset, length):
+        # returns (offset, length, is_data) tuples, no sparse files support by default
+        return [(offset, length, True)]
+
+    def _inner_copy_segment(self, target, offset, length, dst_offset):
+        # the same buffer is reused for all chunks
+        view = memoryview(bytearray(min(length, COPY_BUFFER_SIZE)))
+        while length:
+            count = self._inner_readinto_at(offset, view[: min(length, len(view))])
+            if not count:
+                break  # the file was shrunk in the meantime
+            written = 0
+            while written < count:
+                written += target._inner_write_at(dst_offset + written, view[written:count])
+            offset += count
+            dst_offset += count
+            length -= count
+
+    def _inner_preallocate(self, offset, length):
+        # no way to reserve disk space here, we can at least ensure the file size
+        if offset + length > self._inner_size():
+            self.truncate(offset + length, zero_fill=True)
+
+    def _inner_punch_hole(self, offset, length):
+        # no way to deallocate disk space here, so we at least ensure that the region reads as zeros
+        if self._append:
+            raise IOError(errno.EINVAL, "Can't overwrite a file region with zeros in append mode")
+        old_pos = self._inner_tell()
+        self._inner_seek(offset, os.SEEK_SET)
+        try:
+            self._write_zeros(length)
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+
+    def _inner_advise(self, pattern, offset, length):
+        pass  # access pattern hints are optional, so we silently ignore them by default
+
+    def _inner_map_region(self, aligned_offset, map_length, access, populate):
+        mapping = mmap.mmap(self.fileno(), map_length, access=access, offset=aligned_offset)
+        if populate and hasattr(mapping, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            mapping.madvise(mmap.MADV_WILLNEED)  # best we can do to prefault pages
+        return mapping
+
+    def _inner_unmap_region(self, mapping):
+        mapping.close()
+
+    def _inner_query_lock(self, length, abs_offset, shared):
+        # no way to query kernel locks here, and probing them by locking would disturb other processes
+        # (windows locks are mandatory), so only the locks of the current process are known
+        return None
+
     def _inner_file_lock(self, length, abs_offset, blocking, shared):
         self._unsupported("file_lock")
 
     def _inner_file_unlock(self, length, abs_offset):
         self._unsupported("file_unlock")
 
+    def _inner_file_relock(self, length, abs_offset, blocking, shared):
+        # no in-place lock conversion here, so we have to release the old lock first (which isn't atomic)
+        self._inner_file_unlock(length, abs_offset)
+        try:
+            self._inner_file_lock(length, abs_offset, blocking, shared)
+        except EnvironmentError:
+            self._inner_file_lock(length, abs_offset, False, not shared)  # we try to get back our previous lock
+            raise
+
+    def _inner_file_lock_in_thread(self, length, abs_offset, shared, timeout):
+        """
+        Waits for the kernel lock from a helper thread, until timeout expires.
+
+        Returns True if the lock was obtained, and False if the timeout expired (the helper thread may be
+        left waiting in the background, but it never gets a lock shared with this stream). Returns None if
+        there is no time left for such a wait, if the lock got taken by somebody else meanwhile, or if this
+        backend (or locking backend) doesn't support it.
+        """
+        return None
+
+    def _inner_open_release_watcher(self):
+        """
+        Returns a watcher of the closings of the file by other descriptors, for _inner_wait_for_file_release(),
+        or None if this backend can't watch them. It's reused by all the retries of a locking operation,
+        and then given to _inner_close_release_watcher().
+        """
+        return None
+
+    def _inner_wait_for_file_release(self, watcher, timeout):
+        time.sleep(timeout)  # backends may wake up earlier, when other descriptors release the file
+
+    def _inner_close_release_watcher(self, watcher):
+        pass
+
+    def _wait_before_lock_retry(self, attempt, remaining_time, release_watcher):
+        """
+        Sleeps before the next attempt at getting a kernel lock ; *release_watcher* is a list, in which the
+        "inotify" strategy lazily creates the watcher that its caller must close with _inner_close_release_watcher().
+        """
+        if self.lock_wait_strategy == "spin":
+            time.sleep(self.default_spinlock_delay)
+            return
+
+        delay = min(self.default_spinlock_delay, LOCK_BACKOFF_INITIAL_DELAY * 2 ** min(attempt, 32))
+        delay *= random.uniform(0.5, 1.0)  # jitter prevents competing waiters from retrying in lockstep
+        if remaining_time is not None:
+            delay = min(delay, remaining_time)
+
+        if self.lock_wait_strategy == "inotify":
+            if not release_watcher:
+                release_watcher.append(self._inner_open_release_watcher())
+            self._inner_wait_for_file_release(release_watcher[0], delay)
+        else:
+            time.sleep(delay)
+
 
 assert RSFileIOAbstract.__del__ is defs.io_module.IOBase.__del__  # Ensure the default implementation is used
 defs.io_module.RawIOBase.register(RSFileIOAbstract)
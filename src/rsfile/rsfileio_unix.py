@@ -8,19 +8,70 @@ Reimplementation of raw streams for unix-like OS, with advanced abilities.
 import errno
 import functools
 import locale
+import mmap
 import os
+import select
 import stat
+import struct
 import sys
+import threading
+import warnings
 
 from . import rsfile_definitions as defs
 from . import rsfileio_abstract
 from .rsbackend import unix_stdlib as unix
-from .rsfile_registries import IntraProcessLockRegistry
+from .rsfile_registries import IntraProcessLockRegistry, AlignedBufferPool, PendingDescriptorPool
+from .rsfile_registries import _default_rsfile_options
 
 UNIX_MSG_ENCODING = locale.getpreferredencoding()
 
+# Errors meaning that a kernel-side copy method isn't available for these files, so that another one must be tried
+COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOTSOCK)
+
+# Since python3.13, mmap objects may avoid keeping a duplicate of the file descriptor
+MMAP_HAS_TRACKFD = sys.version_info >= (3, 13)
+
+UNIX_LOCKING_BACKENDS = ("auto", "ofd", "flock", "posix")
+
+
+def _resolve_locking_backend(backend):
+    if backend not in UNIX_LOCKING_BACKENDS:
+        raise defs.BadValueTypeError("unix_locking_backend option must be one of %s" % (UNIX_LOCKING_BACKENDS,))
+    if backend == "auto":
+        backend = "ofd" if hasattr(unix, "ofd_lockf") else "posix"
+    elif backend == "ofd" and not hasattr(unix, "ofd_lockf"):
+        raise IOError(errno.ENOSYS, "Open file description locks are not available on this platform")
+    return backend
+
+
+def _check_pending_descriptors():
+    """
+    Enforces the soft limit of the "max_pending_descriptors" option, by closing the pending descriptors
+    of files which have no locks left, and warning if that's not sufficient.
+    """
+    if not PendingDescriptorPool.exceeds_limit():
+        return
+    for unique_id in PendingDescriptorPool.get_unique_ids():
+        with IntraProcessLockRegistry.mutex_for(unique_id):
+            if not IntraProcessLockRegistry.unique_id_has_locks(unique_id):
+                for fd in PendingDescriptorPool.release(unique_id):
+                    unix.close(fd)
+    if PendingDescriptorPool.exceeds_limit():
+        statistics = PendingDescriptorPool.get_statistics()
+        warnings.warn(
+            "%d file descriptors are kept pending by posix locks, beyond the limit of %d"
+            % (statistics["current"], statistics["limit"]),
+            defs.PendingDescriptorsWarning,
+            stacklevel=4,
+        )
+
 
 class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
+
+    _NATIVE_POSITIONAL_METHODS = ("read_at", "readinto_at", "write_at") + (
+        ("readv_at", "writev_at") if hasattr(unix, "preadv") else ()
+    )
+
     # Warning - this is to be used as a static method ! #
     def _unix_error_converter(f):  # @NoSelf
         @functools.wraps(f)
@@ -49,13 +100,14 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         Returns True iff this unique_id has no more locks left and data left, i/e really closing descriptors is OK.
         """
 
-        with IntraProcessLockRegistry.mutex:
+        with IntraProcessLockRegistry.mutex_for(self._lock_registry_inode):
             res = IntraProcessLockRegistry.unique_id_has_locks(self._lock_registry_inode)
             if not res:  # no more locks left for that unique_id
-                data_list = IntraProcessLockRegistry.remove_unique_id_data(self._lock_registry_inode)
-                for fd in data_list:  # we close all pending file descriptors (which were left opened to prevent
-                    # fcntl() lock autoremoving)
+                # we close all pending file descriptors (which were left opened to prevent fcntl() lock autoremoving)
+                for fd in PendingDescriptorPool.release(self._lock_registry_inode):
                     unix.close(fd)
+                for mapping in IntraProcessLockRegistry.remove_unique_id_data(self._lock_registry_inode):
+                    mapping.close()  # memory mapping holding a duplicate of the file descriptor
 
             return not res
 
@@ -71,6 +123,7 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         must_not_create,
         synchronized,
         inheritable,
+        direct,
         fileno,
         handle,
         permissions,
@@ -79,6 +132,10 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         # Note : opening broken links works if we're in "w" mode, and raises error in "r" mode,
         # like for normal unexisting files.
 
+        self._locking_backend = _resolve_locking_backend(_default_rsfile_options["unix_locking_backend"])
+        self._coalesce_locked_ranges = self._locking_backend != "flock"  # flock() can't release part of a lock
+        self._open_flags = None  # only known for files opened by path
+
         if handle is not None:
             assert fileno is None
             self._fileno = self._handle = handle
@@ -102,16 +159,23 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
             if synchronized:
                 flags |= unix.O_SYNC
 
+            # O_APPEND redirects all writes to the end of file, where unaligned tails couldn't be rewritten
+            direct = direct and not append and hasattr(unix, "O_DIRECT")
+
             if read and write:
                 flags |= unix.O_RDWR
             elif write:
-                flags |= unix.O_WRONLY
+                # partially written blocks of O_DIRECT files are read, modified and written back
+                flags |= unix.O_RDWR if direct else unix.O_WRONLY
             else:
                 flags |= unix.O_RDONLY
 
             if append:
                 flags |= unix.O_APPEND
 
+            if direct:
+                flags |= unix.O_DIRECT  # might be refused by some filesystems, like tmpfs
+
             if must_not_create:
                 pass  # it's the default case for open() function
             elif must_create:
@@ -119,38 +183,104 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
             else:
                 flags |= unix.O_CREAT  # by default - we create the file iff it doesn't exists
 
-            # print("Creating unix stream with context", locals())
-            self._fileno = self._handle = unix.open(strname, flags, permissions)
-
-            # on unix we must prevent the opening of directories, but not named fifos or other special files
-            stats = unix.fstat(self._fileno).st_mode
-            if stat.S_ISDIR(stats):
-                raise IOError(errno.EISDIR, "RSFile can't open directories", self.name)
-
-            # we don't use O_CLOEXEC flag (available since Linux 2.6.23) for compatibility and safety
-            if hasattr(os, "set_inheritable"):
-                os.set_inheritable(self._fileno, inheritable)  # for safety we call it in any case
-            else:
-                # before PEP0446, newly created file descriptors were inheritable by default
-                if not inheritable:
-                    old_flags = unix.fcntl(self._fileno, unix.F_GETFD, 0)
-                    if not (old_flags & unix.FD_CLOEXEC):
-                        unix.fcntl(self._fileno, unix.F_SETFD, old_flags | unix.FD_CLOEXEC)
+            # descriptors of a same file and flags are interchangeable, once their position is reset
+            self._open_flags = flags & ~(unix.O_CREAT | unix.O_EXCL)
+
+            # close-on-exec is set atomically, so that concurrently forked children never inherit the descriptor
+            if not inheritable and hasattr(unix, "O_CLOEXEC"):
+                flags |= unix.O_CLOEXEC
+
+            self._fileno = None
+            if not must_create and self._locking_backend == "posix" and PendingDescriptorPool.has_descriptors():
+                self._fileno = self._reuse_pending_descriptor(strname)
+            reused = self._fileno is not None
+
+            if not reused:
+                # print("Creating unix stream with context", locals())
+                try:
+                    self._fileno = unix.open(strname, flags, permissions)
+                except EnvironmentError as e:
+                    if not (direct and write and not read and e.errno == errno.EACCES):
+                        raise
+                    flags = (flags & ~unix.O_RDWR) | unix.O_WRONLY  # then only whole blocks can be rewritten
+                    self._open_flags = (self._open_flags & ~unix.O_RDWR) | unix.O_WRONLY
+                    self._fileno = unix.open(strname, flags, permissions)
+
+                # on unix we must prevent the opening of directories, but not named fifos or other special files
+                self._open_stats = unix.fstat(self._fileno)
+                if stat.S_ISDIR(self._open_stats.st_mode):
+                    raise IOError(errno.EISDIR, "RSFile can't open directories", self.name)
+
+            self._handle = self._fileno
+
+            if reused or not (flags & getattr(unix, "O_CLOEXEC", 0)):
+                if hasattr(os, "set_inheritable"):
+                    os.set_inheritable(self._fileno, inheritable)  # for safety we call it in any case
+                else:
+                    # before PEP0446, newly created file descriptors were inheritable by default
+                    if not inheritable:
+                        old_flags = unix.fcntl(self._fileno, unix.F_GETFD, 0)
+                        if not (old_flags & unix.FD_CLOEXEC):
+                            unix.fcntl(self._fileno, unix.F_SETFD, old_flags | unix.FD_CLOEXEC)
+
+            if direct and not hasattr(unix, "O_DIRECT") and sys.platform == "darwin":
+                unix.fcntl(self._fileno, unix.F_NOCACHE, 1)  # no alignment constraints there
+
+        # WHATEVER the origin of the stream, a single stat snapshot serves all the checks of the opening
+        if self._open_stats is None:
+            self._open_stats = unix.fstat(self._fileno)
+        if self._unique_id is None:
+            self._unique_id = self._unique_id_from_stats(self._open_stats)
+
+        # WHATEVER the origin of the stream, we detect alignment constraints
+        if hasattr(unix, "O_DIRECT"):
+            status_flags = self._open_flags if self._open_flags is not None else unix.fcntl(self._fileno, unix.F_GETFL)
+            if status_flags & unix.O_DIRECT:
+                # the preferred I/O size may exceed the logical block size (eg. 4 MiB on Lustre), we cap it
+                self._direct_alignment = min(max(self._open_stats.st_blksize, 512), mmap.PAGESIZE)
+                self._direct_appending = bool(status_flags & unix.O_APPEND)
+                # unaligned edges of positional writes are read-modify-written, so they can't skip mutexes
+                self._NATIVE_POSITIONAL_METHODS = tuple(
+                    name for name in self._NATIVE_POSITIONAL_METHODS if not name.startswith("write")
+                )
 
         # WHATEVER the origin of the stream, we initialize these fields:
         self._lock_registry_inode = self.unique_id()  # enforces caching of unique_id
         self._lock_registry_descriptor = self._fileno
 
+    def _reuse_pending_descriptor(self, strname):
+        try:
+            stats = unix.stat(strname)
+        except unix.error:
+            return None  # open() will report the problem, if any
+        unique_id = (stats.st_dev, stats.st_ino)
+
+        fd = PendingDescriptorPool.reuse(unique_id, self._open_flags)
+        if fd is not None:
+            unix.lseek(fd, 0, os.SEEK_SET)
+            self._open_stats = stats  # same file, so it spares an fstat()
+            self._unique_id = unique_id
+        return fd
+
     @_unix_error_converter
     def _inner_close_streams(self):
         if getattr(self, "_closefd", False):
-            if hasattr(self, "_lock_registry_inode") and hasattr(self, "_lock_registry_descriptor"):
-                with IntraProcessLockRegistry.mutex:
+            if getattr(self, "_locking_backend", "posix") != "posix":
+                # no Unlock-All-On-Single-Close semantic with these locks, so no need for pending descriptors
+                if self._fileno is not None:
+                    unix.close(self._fileno)
+                if hasattr(self, "_lock_registry_inode") and getattr(self, "_may_hold_locks", True):
+                    IntraProcessLockRegistry.try_deleting_unique_id_entry(self._lock_registry_inode)
+            elif hasattr(self, "_lock_registry_inode") and hasattr(self, "_lock_registry_descriptor"):
+                with IntraProcessLockRegistry.mutex_for(self._lock_registry_inode):
                     # safety mechanisms for fcntl() and its Unlock-All-On-Single-Close semantic
-                    IntraProcessLockRegistry.add_unique_id_data(self._lock_registry_inode, self._lock_registry_descriptor)
+                    PendingDescriptorPool.park(
+                        self._lock_registry_inode, self._lock_registry_descriptor, getattr(self, "_open_flags", None)
+                    )
                     self._purge_pending_related_file_descriptors()
                     # we assume that there are chances for this to be the only handle pointing this precise file
                     IntraProcessLockRegistry.try_deleting_unique_id_entry(self._lock_registry_inode)
+                _check_pending_descriptors()  # outside of the mutex, since other files get purged
 
     @_unix_error_converter
     def _inner_reduce(self, size):
@@ -162,8 +292,115 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         assert size >= 0, size
         assert zero_fill in (True, False), zero_fill
         # posix truncation is ALWAYS "zerofill" actually...
+        if not zero_fill:
+            # the quickest extension would be a sparse one, but then a later write might fail with ENOSPC
+            current_size = self._inner_size()
+            if self._try_allocating_disk_space(current_size, size - current_size):
+                return
         unix.ftruncate(self._fileno, size)
 
+    def _try_allocating_disk_space(self, offset, length):
+        """Returns False if the filesystem doesn't support preallocation."""
+        if not hasattr(unix, "posix_fallocate"):
+            return False
+        try:
+            unix.posix_fallocate(self._fileno, offset, length)  # also extends file size if needed
+        except unix.error as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                return False
+            raise
+        return True
+
+    @_unix_error_converter
+    def _inner_copy_to(self, target, offset, length, dst_offset):
+        # on filesystems supporting reflinks (btrfs, xfs...), no data needs to be copied at all
+        try:
+            arg = struct.pack("qQQQ", self._fileno, offset, length, dst_offset)
+            unix.ioctl(target._fileno, unix.FICLONERANGE, arg)
+            return
+        except unix.error as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+        super(RSFileIO, self)._inner_copy_to(target, offset, length, dst_offset)
+
+    @_unix_error_converter
+    def _inner_list_segments(self, offset, length):
+        if not hasattr(unix, "SEEK_DATA"):
+            return [(offset, length, True)]
+
+        end = offset + length
+        segments = []
+        old_pos = self._inner_tell()
+        try:
+            while offset < end:
+                try:
+                    data_start = min(unix.lseek(self._fileno, offset, unix.SEEK_DATA), end)
+                except unix.error as e:
+                    if e.errno == errno.ENXIO:
+                        data_start = end  # only a hole remains
+                    elif e.errno == errno.EINVAL and not segments:
+                        segments.append((offset, length, True))  # SEEK_DATA not supported by filesystem
+                        break
+                    else:
+                        raise
+                if data_start > offset:
+                    segments.append((offset, data_start - offset, False))
+                if data_start >= end:
+                    break
+                data_end = min(unix.lseek(self._fileno, data_start, unix.SEEK_HOLE), end)
+                segments.append((data_start, data_end - data_start, True))
+                offset = data_end
+        finally:
+            self._inner_seek(old_pos, os.SEEK_SET)
+        return segments
+
+    def _copy_file_range_chunk(self, target, offset, length, dst_offset):
+        return unix.copy_file_range(self._fileno, target._fileno, length, offset, dst_offset)
+
+    def _sendfile_chunk(self, target, offset, length, dst_offset):
+        # sendfile() writes at the current position of the target stream
+        old_pos = target._inner_tell()
+        try:
+            target._inner_seek(dst_offset, os.SEEK_SET)
+            return unix.sendfile(target._fileno, self._fileno, offset, length)
+        finally:
+            target._inner_seek(old_pos, os.SEEK_SET)
+
+    @_unix_error_converter
+    def _inner_copy_segment(self, target, offset, length, dst_offset):
+        copied = 0
+        copy_methods = (("copy_file_range", self._copy_file_range_chunk), ("sendfile", self._sendfile_chunk))
+        for (name, copy_chunk) in copy_methods:
+            if not hasattr(unix, name):
+                continue
+            try:
+                while copied < length:
+                    count = copy_chunk(target, offset + copied, length - copied, dst_offset + copied)
+                    if not count:
+                        return  # the file was shrunk in the meantime
+                    copied += count
+                return
+            except unix.error as e:
+                if e.errno not in COPY_FALLBACK_ERRNOS:
+                    raise
+        super(RSFileIO, self)._inner_copy_segment(target, offset + copied, length - copied, dst_offset + copied)
+
+    @_unix_error_converter
+    def _inner_preallocate(self, offset, length):
+        if not self._try_allocating_disk_space(offset, length):
+            super(RSFileIO, self)._inner_preallocate(offset, length)
+
+    @_unix_error_converter
+    def _inner_punch_hole(self, offset, length):
+        if hasattr(unix, "fallocate"):
+            try:
+                unix.fallocate(self._fileno, unix.FALLOC_FL_PUNCH_HOLE | unix.FALLOC_FL_KEEP_SIZE, offset, length)
+                return
+            except unix.error as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS):
+                    raise
+        super(RSFileIO, self)._inner_punch_hole(offset, length)
+
     @_unix_error_converter
     def _inner_sync(self, metadata, full_flush):
 
@@ -207,7 +444,10 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         Unless otherwise specified, the structure members st_mode, st_ino, st_dev, st_unique_id, st_gid, st_atime,
         st_ctime, and st_mtime shall have meaningful values for all file types defined in IEEE Std 1003.1-2001.
         """
-        stats = unix.fstat(self._fileno)
+        return self._unique_id_from_stats(unix.fstat(self._fileno))
+
+    @staticmethod
+    def _unique_id_from_stats(stats):
         _unique_id = (stats.st_dev, stats.st_ino)
         if not all(x is not None for x in _unique_id):
             raise IOError(errno.ENOSYS, "No unique dev/inode identifiers available: %s" %
@@ -225,7 +465,16 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         updated if a file is opened with the O_NOATIME; see open(2).
         """
         stats = unix.fstat(self._fileno)
-        return defs.FileTimes(access_time=stats.st_atime, modification_time=stats.st_mtime)
+        return defs.FileTimes(
+            access_time=stats.st_atime,
+            modification_time=stats.st_mtime,
+            access_time_ns=stats.st_atime_ns,
+            modification_time_ns=stats.st_mtime_ns,
+        )
+
+    @_unix_error_converter
+    def _inner_stat(self):
+        return unix.fstat(self._fileno)
 
     @_unix_error_converter
     def _inner_size(self):
@@ -242,9 +491,97 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         """
         return unix.lseek(self._fileno, offset, whence)
 
+    def _is_aligned_buffer(self, buffer):
+        address = unix.buffer_address(buffer)
+        return address is not None and not address % self._direct_alignment
+
+    def _direct_transfer(self, buffer, transfer_chunk, offset=None):
+        # like for normal regular files, the whole buffer is transferred, except at end of file or on errors
+        # (positional transfers get the file offset of each chunk as second argument)
+        total = 0
+        while total < len(buffer):
+            if offset is None:
+                (count, expected) = transfer_chunk(buffer[total:])
+            else:
+                (count, expected) = transfer_chunk(buffer[total:], offset + total)
+            total += count
+            if count < expected:
+                break
+        return total
+
+    def _direct_readinto_chunk(self, buffer):
+        # sequential transfers are positional ones at the current file position, since toggling O_DIRECT
+        # would alter the status flags of the whole open file description, shared with dup'd descriptors
+        position = unix.ltell(self._fileno)
+        (count, expected) = self._direct_preadinto_chunk(buffer, position)
+        unix.lseek(self._fileno, position + count, os.SEEK_SET)
+        return (count, expected)
+
+    def _direct_write_chunk(self, buffer):
+        if self._direct_appending:
+            # O_APPEND makes the kernel ignore pwrite() offsets, so only whole blocks can be appended
+            position = unix.fstat(self._fileno).st_size
+            direct_length = len(buffer) - len(buffer) % self._direct_alignment
+            if position % self._direct_alignment or not direct_length:
+                raise IOError(errno.EINVAL, "Unaligned appends are not supported on O_DIRECT descriptors")
+            buffer = buffer[:direct_length]
+        else:
+            position = unix.ltell(self._fileno)
+        (count, expected) = self._direct_pwrite_chunk(buffer, position)
+        unix.lseek(self._fileno, position + count, os.SEEK_SET)
+        return (count, expected)
+
+    def _direct_preadinto_chunk(self, buffer, offset):
+        # unaligned areas are transferred as whole blocks, via a bounce buffer
+        alignment = self._direct_alignment
+        misalignment = offset % alignment
+        direct_length = len(buffer) - len(buffer) % alignment
+        if not misalignment and direct_length and self._is_aligned_buffer(buffer):
+            return (unix.preadinto(self._fileno, buffer[:direct_length], offset), direct_length)
+        with AlignedBufferPool.borrowed(defs.DIRECT_IO_BUFFER_SIZE) as bounce_buffer:
+            block_length = min(-(-(misalignment + len(buffer)) // alignment) * alignment, len(bounce_buffer))
+            count = unix.preadinto(self._fileno, bounce_buffer[:block_length], offset - misalignment)
+            chunk_length = min(len(buffer), block_length - misalignment)
+            count = max(0, min(count - misalignment, chunk_length))
+            buffer[:count] = bounce_buffer[misalignment : misalignment + count]
+            return (count, chunk_length)
+
+    def _direct_pwrite_chunk(self, buffer, offset):
+        alignment = self._direct_alignment
+        misalignment = offset % alignment
+        direct_length = len(buffer) - len(buffer) % alignment
+        if not misalignment and direct_length:
+            if self._is_aligned_buffer(buffer):
+                return (unix.pwrite(self._fileno, buffer[:direct_length], offset), direct_length)
+            with AlignedBufferPool.borrowed(defs.DIRECT_IO_BUFFER_SIZE) as bounce_buffer:
+                chunk_length = min(direct_length, len(bounce_buffer))
+                bounce_buffer[:chunk_length] = buffer[:chunk_length]
+                return (unix.pwrite(self._fileno, bounce_buffer[:chunk_length], offset), chunk_length)
+
+        # partially written block : we read-modify-write it as a whole
+        chunk_length = min(len(buffer), alignment - misalignment)
+        block_offset = offset - misalignment
+        with AlignedBufferPool.borrowed(defs.DIRECT_IO_BUFFER_SIZE) as bounce_buffer:
+            block = bounce_buffer[:alignment]
+            if block_offset < unix.fstat(self._fileno).st_size:
+                existing = unix.preadinto(self._fileno, block, block_offset)
+            else:
+                existing = 0  # nothing to read back, eg. for write-only streams appending data
+            block[existing:] = bytes(alignment - existing)  # beyond end of file
+            block[misalignment : misalignment + chunk_length] = buffer[:chunk_length]
+            written = unix.pwrite(self._fileno, block, block_offset)
+            content_length = max(existing, misalignment + chunk_length)
+            if written == alignment and content_length < alignment:
+                unix.ftruncate(self._fileno, block_offset + content_length)  # the block had extended the file
+            return (max(0, min(written - misalignment, chunk_length)), chunk_length)
+
     @_unix_error_converter
     def _inner_read(self, n):
         try:
+            if self._direct_alignment:
+                with AlignedBufferPool.borrowed(defs.DIRECT_IO_BUFFER_SIZE) as buffer:
+                    count = self._direct_transfer(buffer[: min(n, len(buffer))], self._direct_readinto_chunk)
+                    return buffer[:count].tobytes()
             return unix.read(self._fileno, n)
         except OSError as e:
             # print ("<<< inner read", e.__class__)
@@ -254,17 +591,26 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
                 return b""  # conform to stdlib behaviour
             raise
 
-    """
     @_unix_error_converter
     def _inner_readinto(self, buffer):
-        return unix.readinto(self._fileno, buffer, len(buffer))
-    """
+        try:
+            if self._direct_alignment:
+                return self._direct_transfer(buffer, self._direct_readinto_chunk)
+            return unix.readinto(self._fileno, buffer)
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN:
+                return None
+            if e.__class__.__name__ == "BrokenPipeError":  # only in Python3
+                return 0  # conform to stdlib behaviour
+            raise
 
     @_unix_error_converter
-    def _inner_write(self, bytes):
-        # 'append' is already handled at file opening
+    def _inner_write(self, buffer):
+        # 'append' is already handled at file opening, and any buffer-protocol object is accepted by write()
         try:
-            return unix.write(self._fileno, bytes)
+            if self._direct_alignment:
+                return self._direct_transfer(buffer, self._direct_write_chunk)
+            return unix.write(self._fileno, buffer)
         except OSError as e:
             # print(">>>>>>>>>_inner_write", e.__class__)
             if e.args[0] == errno.EAGAIN:
@@ -272,12 +618,106 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
             raise
 
     @_unix_error_converter
-    def _inner_file_lock(self, length, abs_offset, blocking, shared):
+    def _inner_read_at(self, offset, n):
+        if self._direct_alignment:
+            with AlignedBufferPool.borrowed(defs.DIRECT_IO_BUFFER_SIZE) as buffer:
+                count = self._direct_transfer(buffer[: min(n, len(buffer))], self._direct_preadinto_chunk, offset)
+                return buffer[:count].tobytes()
+        return unix.pread(self._fileno, n, offset)
 
-        # TODO - switch to "Open file description locks (non-POSIX)" on recent Linux one day,
-        # to have per-file-descriptor (but inheritable alas) locks
+    @_unix_error_converter
+    def _inner_readinto_at(self, offset, buffer):
+        if self._direct_alignment:
+            return self._direct_transfer(buffer, self._direct_preadinto_chunk, offset)
+        return unix.preadinto(self._fileno, buffer, offset)
+
+    @_unix_error_converter
+    def _inner_write_at(self, offset, buffer):
+        if self._direct_alignment:
+            return self._direct_transfer(memoryview(buffer).cast("B"), self._direct_pwrite_chunk, offset)
+        return unix.pwrite(self._fileno, buffer, offset)
+
+    @_unix_error_converter
+    def _inner_readv(self, buffers):
+        if self._direct_alignment:
+            return super(RSFileIO, self)._inner_readv(buffers)  # buffers are filled one by one
+        try:
+            return unix.readv(self._fileno, buffers[: unix.IOV_MAX])  # partial reads are allowed anyway
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN:
+                return None
+            if e.__class__.__name__ == "BrokenPipeError":  # only in Python3
+                return 0  # conform to stdlib behaviour
+            raise
 
-        fd = self._fileno
+    @_unix_error_converter
+    def _inner_writev(self, buffers):
+        if self._direct_alignment:
+            return super(RSFileIO, self)._inner_writev(buffers)  # a single write of the joined buffers
+        try:
+            return unix.writev(self._fileno, buffers[: unix.IOV_MAX])  # partial writes are allowed anyway
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN:
+                return None
+            raise
+
+    @_unix_error_converter
+    def _inner_readv_at(self, offset, buffers):
+        if self._direct_alignment:
+            total = 0
+            for buffer in buffers:  # filled one by one
+                count = self._inner_readinto_at(offset + total, buffer)
+                total += count
+                if count < len(buffer):
+                    break  # EOF
+            return total
+        if not hasattr(unix, "preadv"):
+            return super(RSFileIO, self)._inner_readv_at(offset, buffers)
+        return unix.preadv(self._fileno, buffers[: unix.IOV_MAX], offset)
+
+    @_unix_error_converter
+    def _inner_writev_at(self, offset, buffers):
+        if self._direct_alignment:
+            return self._inner_write_at(offset, b"".join(buffers))
+        if not hasattr(unix, "pwritev"):
+            return super(RSFileIO, self)._inner_writev_at(offset, buffers)
+        return unix.pwritev(self._fileno, buffers[: unix.IOV_MAX], offset)
+
+    @_unix_error_converter
+    def _inner_advise(self, pattern, offset, length):
+        if hasattr(unix, "posix_fadvise"):
+            # a length of 0 means "up to the end of file"
+            unix.posix_fadvise(self._fileno, offset, length or 0, unix.FADVISE_PATTERNS[pattern])
+
+    @_unix_error_converter
+    def _inner_map_region(self, aligned_offset, map_length, access, populate):
+        kwargs = dict(offset=aligned_offset)
+        if MMAP_HAS_TRACKFD:
+            kwargs["trackfd"] = False
+
+        if populate and hasattr(mmap, "MAP_POPULATE"):  # linux only, prefaults the whole mapping
+            flags = mmap.MAP_PRIVATE if access == mmap.ACCESS_COPY else mmap.MAP_SHARED
+            prot = mmap.PROT_READ if access == mmap.ACCESS_READ else (mmap.PROT_READ | mmap.PROT_WRITE)
+            return mmap.mmap(self._fileno, map_length, flags=flags | mmap.MAP_POPULATE, prot=prot, **kwargs)
+
+        mapping = mmap.mmap(self._fileno, map_length, access=access, **kwargs)
+        if populate and hasattr(mapping, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            mapping.madvise(mmap.MADV_WILLNEED)
+        return mapping
+
+    @_unix_error_converter
+    def _inner_unmap_region(self, mapping):
+        if MMAP_HAS_TRACKFD or self._locking_backend != "posix":
+            mapping.close()
+            return
+
+        # The mapping owns a duplicate of our file descriptor, so closing it would trigger
+        # the fcntl() Unlock-All-On-Single-Close semantic, like for our own descriptor
+        with IntraProcessLockRegistry.mutex_for(self._lock_registry_inode):
+            IntraProcessLockRegistry.add_unique_id_data(self._lock_registry_inode, mapping)
+            self._purge_pending_related_file_descriptors()
+
+    def _lock_descriptor(self, fd, length, abs_offset, blocking, shared):
 
         if shared:
             operation = unix.LOCK_SH
@@ -286,18 +726,163 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
 
         if not blocking:
             operation |= unix.LOCK_NB
+        if self._locking_backend == "flock":
+            if length is not None or abs_offset != 0:
+                raise defs.BadValueTypeError("The 'flock' locking backend only supports whole-file locks")
+            unix.flock(fd, operation)
+            return
+
         if length is None:
             length = 0  # that's the "infinity" value for fcntl
 
-        unix.lockf(fd, operation, length, abs_offset, os.SEEK_SET)
+        if self._locking_backend == "ofd":
+            unix.ofd_lockf(fd, operation, length, abs_offset, os.SEEK_SET)
+        else:
+            unix.lockf(fd, operation, length, abs_offset, os.SEEK_SET)
 
-    @_unix_error_converter
-    def _inner_file_unlock(self, length, abs_offset):
+    def _unlock_descriptor(self, fd, length, abs_offset):
+
+        if self._locking_backend == "flock":
+            unix.flock(fd, unix.LOCK_UN)
+            return
 
         if length is None:
             length = 0  # that's the "infinity" value for fcntl
 
+        if self._locking_backend == "ofd":
+            unix.ofd_lockf(fd, unix.LOCK_UN, length, abs_offset, os.SEEK_SET)
+        else:
+            unix.lockf(fd, unix.LOCK_UN, length, abs_offset, os.SEEK_SET)
+
+    @_unix_error_converter
+    def _inner_file_lock(self, length, abs_offset, blocking, shared):
+        self._lock_descriptor(self._fileno, length, abs_offset, blocking, shared)
+
+    @_unix_error_converter
+    def _inner_file_relock(self, length, abs_offset, blocking, shared):
+        # fcntl() converts the lock in place, atomically ; flock() might release it before converting it though
+        self._lock_descriptor(self._fileno, length, abs_offset, blocking, shared)
+
+    @_unix_error_converter
+    def _inner_query_lock(self, length, abs_offset, shared):
+
+        if self._locking_backend == "flock" or not hasattr(unix, "getlk"):
+            # flock() locks are invisible to F_GETLK
+            return super(RSFileIO, self)._inner_query_lock(length, abs_offset, shared)
+
+        # F_GETLK ignores the locks of the current process, F_OFD_GETLK those of our own open file description
+        command = unix.F_OFD_GETLK if self._locking_backend == "ofd" else unix.F_GETLK
+        lock_type = unix.F_RDLCK if shared else unix.F_WRLCK
+        (l_type, l_start, l_len, l_pid) = unix.getlk(
+            self._fileno, command, lock_type, length or 0, abs_offset, os.SEEK_SET
+        )
+        if l_type == unix.F_UNLCK:
+            return None
+        return defs.LockHolder(
+            l_type == unix.F_RDLCK, l_start, (l_start + l_len) if l_len else None, l_pid if l_pid > 0 else None
+        )
+
+    @_unix_error_converter
+    def _inner_file_unlock(self, length, abs_offset):
+
+        if self._locking_backend != "posix":
+            self._unlock_descriptor(self._fileno, length, abs_offset)
+            return  # no pending descriptors to care about
+
         try:
-            unix.lockf(self._fileno, unix.LOCK_UN, length, abs_offset, os.SEEK_SET)
+            self._unlock_descriptor(self._fileno, length, abs_offset)
         finally:
             self._purge_pending_related_file_descriptors()
+
+    @_unix_error_converter
+    def _inner_file_lock_in_thread(self, length, abs_offset, shared, timeout):
+
+        if not timeout:
+            return None  # no time left to wait in a helper thread
+
+        if self._locking_backend != "ofd" or not os.path.isdir("/proc/self/fd"):
+            # posix and flock locks are owned by the process or the open file description, so a helper waiting
+            # on our behalf would convert (or release) the locks that our other threads take meanwhile
+            return None
+
+        # The helper thread waits with a file description of its own, so the lock it gets is private
+        # and can't interfere with ours ; closing that description gives it back
+        try:
+            fd = unix.open(
+                "/proc/self/fd/%d" % self._fileno,
+                (unix.O_RDONLY if shared else unix.O_RDWR) | getattr(unix, "O_CLOEXEC", 0),
+            )
+        except EnvironmentError:
+            return None  # eg. permissions changed since the opening of the stream
+        finished = threading.Event()
+        state = dict(abandoned=False, error=None)
+        state_mutex = threading.Lock()
+
+        def wait_for_lock():
+            error = None
+            try:
+                self._lock_descriptor(fd, length, abs_offset, True, shared)  # F_OFD_SETLKW
+            except Exception as e:
+                error = e
+            with state_mutex:
+                state["error"] = error
+                abandoned = state["abandoned"]
+                finished.set()
+            if abandoned:  # nobody wants this lock anymore
+                unix.close(fd)
+
+        thread = threading.Thread(target=wait_for_lock, name="rsfile lock waiter")
+        thread.daemon = True
+        thread.start()
+        finished.wait(timeout)
+
+        with state_mutex:
+            if not finished.is_set():
+                state["abandoned"] = True  # we can't interrupt a blocked fcntl(), so the helper gets detached
+                return False
+
+        unix.close(fd)  # releases the helper's lock, so that our own descriptor may take it
+        if state["error"] is not None:
+            raise state["error"]
+        try:
+            self._lock_descriptor(self._fileno, length, abs_offset, False, shared)
+        except EnvironmentError:
+            return None  # somebody else was quicker, we'll retry
+        return True
+
+    @_unix_error_converter
+    def _inner_open_release_watcher(self):
+        if not hasattr(unix, "inotify_init1"):
+            return None
+
+        # Lock holders often release their locks by closing the file, so we watch for closings
+        inotify_fd = unix.inotify_init1(unix.IN_CLOEXEC | unix.IN_NONBLOCK)
+        try:
+            unix.inotify_add_watch(
+                inotify_fd, "/proc/self/fd/%d" % self._fileno, unix.IN_CLOSE_WRITE | unix.IN_CLOSE_NOWRITE
+            )
+        except BaseException:
+            unix.close(inotify_fd)
+            raise
+        poller = select.poll()  # unlike select(), not limited to descriptors below FD_SETSIZE
+        poller.register(inotify_fd, select.POLLIN)
+        return (inotify_fd, poller)
+
+    @_unix_error_converter
+    def _inner_wait_for_file_release(self, watcher, timeout):
+        if watcher is None:
+            return super(RSFileIO, self)._inner_wait_for_file_release(watcher, timeout)
+
+        (inotify_fd, poller) = watcher
+        if poller.poll(timeout * 1000):
+            try:
+                while unix.read(inotify_fd, 4096):  # pending events would wake up the next waits at once
+                    pass
+            except OSError as e:
+                if e.args[0] != errno.EAGAIN:
+                    raise
+
+    @_unix_error_converter
+    def _inner_close_release_watcher(self, watcher):
+        if watcher is not None:
+            unix.close(watcher[0])
@@ -88,6 +88,7 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
         must_not_create,
         synchronized,
         inheritable,
+        direct,
         fileno,
         handle,
         permissions,
@@ -95,6 +96,8 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
 
         assert not (fileno and handle), fileno and handle
 
+        self._coalesce_locked_ranges = False  # UnlockFileEx() only releases exactly what was locked
+
         # # # real opening of the file stream # # #
         if handle is not None:
             assert fileno is None
@@ -152,6 +155,9 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
                 # Warning - it seems that for some people, metadata is actually NOT written to disk along with data,
                 # when using FILE_FLAG_WRITE_THROUGH
 
+            # "direct" mode is ignored, since with FILE_FLAG_NO_BUFFERING, even the final
+            # partial block of the file couldn't be written without alignment
+
             # we can't use FILE_APPEND_DATA flag, because it prevents use from truncating the file later one,
             # so we'll emulate it on each write
 
@@ -324,8 +330,18 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
             modification_time=utilities.win32_filetime_to_python_timestamp(
                 handle_info.ftLastWriteTime.dwLowDateTime, handle_info.ftLastWriteTime.dwHighDateTime
             ),
+            access_time_ns=utilities.win32_filetime_to_nanoseconds(
+                handle_info.ftLastAccessTime.dwLowDateTime, handle_info.ftLastAccessTime.dwHighDateTime
+            ),
+            modification_time_ns=utilities.win32_filetime_to_nanoseconds(
+                handle_info.ftLastWriteTime.dwLowDateTime, handle_info.ftLastWriteTime.dwHighDateTime
+            ),
         )
 
+    @_win32_error_converter
+    def _inner_stat(self):
+        return os.fstat(self._inner_fileno())  # the C runtime builds it from GetFileInformationByHandle()
+
     @_win32_error_converter
     def _inner_size(self):
         size = win32.GetFileSize(self._handle)
@@ -409,6 +425,8 @@ class RSFileIO(rsfileio_abstract.RSFileIOAbstract):
                 bytes_written = 0
             errCode = None
         else:
+            if isinstance(buffer, memoryview):
+                buffer = buffer.tobytes()  # win32 backends only accept bytes-like sequences
             (errCode, bytes_written) = win32.WriteFile(self._handle, buffer)
 
         # Nothing special for to do with errCode, for files, it seems
@@ -41,12 +41,37 @@ class RSIOBase(object):
           will always appear as zeros (but file truncation can then be quite slow on
           filesystems which don't support sparse files, such as FAT). If it is False,
           the content of the added bytes is undefined, as the quickest extension method
-          is used.
+          is used ; on unix, disk space then gets really reserved for these bytes (via posix_fallocate()),
+          when the filesystem supports it, so that later writes to them can't fail with ENOSPC.
 
         Returns the new file size.
         """
         self._unsupported("truncate")
 
+    def preallocate(self, offset, length):
+        """Reserves disk space for the ``length`` bytes starting at the absolute position ``offset``,
+        extending the file if this range goes beyond its end (the new bytes then appear as zeros).
+
+        Preallocation limits fragmentation, and ensures that later writes to this range won't fail for lack of
+        disk space. It relies on posix_fallocate() ; on other platforms, or on filesystems not supporting
+        it, only the file extension is performed.
+
+        Returns the new file size.
+        """
+        self._unsupported("preallocate")
+
+    def punch_hole(self, offset, length):
+        """Deallocates the disk space used by the ``length`` bytes starting at the absolute
+        position ``offset``, which will then read as zeros. The size of the file is never modified,
+        so the part of this range located after the end of file is ignored.
+
+        This relies on fallocate(FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE) on linux; elsewhere, the
+        range is just overwritten with zeros (which is impossible for streams in append mode).
+
+        Returns None.
+        """
+        self._unsupported("punch_hole")
+
     def flush(self):
         """
         Flushes read and/or write buffers, if applicable.
@@ -121,7 +146,9 @@ class RSIOBase(object):
 
         These attributes are integers or floats.
         Their precision may vary depending on the platform, but they're always expressed in seconds.
-        Currently supported attributes, for disk files: ``access_time`` and ``modification_time``.
+        Currently supported attributes, for disk files: ``access_time`` and ``modification_time``,
+        as well as ``access_time_ns`` and ``modification_time_ns`` (integer nanoseconds, or None if unavailable),
+        which are the ones compared by FileTimes equality when available.
 
         .. note:: more specific times are supported by different platforms, they might be included
                   in next releases through OS-specific FileTimes attributes.
@@ -130,6 +157,17 @@ class RSIOBase(object):
         """
         self._unsupported("times")
 
+    def stat(self, refresh=False):
+        """Returns a snapshot of the file status, as an :class:`os.stat_result` (with nanosecond times).
+
+        Intermediate buffers are flushed first. If the *stat_caching* attribute of the raw stream is True
+        (see the *stat_caching* option of :func:`rsfile.set_rsfile_options`), the last snapshot is
+        returned again, and also used by :meth:`size` and :meth:`times`, until a write, truncation or lock
+        acquisition made through this stream, or a call with *refresh* set to True.
+        Changes made through memory mappings, other streams or other processes don't invalidate that cache.
+        """
+        self._unsupported("stat")
+
     def unique_id(self):
         """Returns a tuple of (device, inode) integers, identifying unambiguously the stream.
 
@@ -162,6 +200,142 @@ class RSIOBase(object):
         """
         self._unsupported("handle")
 
+    def read_at(self, offset, n):
+        """Reads up to ``n`` bytes, starting at the absolute position ``offset``,
+        and returns them as a bytes object (which is empty if ``offset`` is at or beyond end of file).
+
+        The file pointer is neither used nor moved, so several threads can issue positional
+        reads on the same raw stream, without needing to serialize seek/read pairs. That's why
+        :class:`RSThreadSafeWrapper` doesn't take its mutex for positional operations on raw streams.
+
+        On raw streams, a single system call is issued (pread() on unix), so less than ``n`` bytes
+        may be returned. On buffered streams, pending writes are flushed first, and reading goes on until
+        ``n`` bytes are gotten or end of file is reached.
+
+        Backends without native positional I/O emulate it with seek() calls, in a non-atomic way.
+
+        Raises IOError if the stream is not seekable (eg. for pipes), or not readable.
+        """
+        self._unsupported("read_at")
+
+    def readinto_at(self, offset, buffer):
+        """Same as :meth:`read_at`, except that data is directly read into the writable
+        bytes-like object ``buffer``, and that the number of bytes read is returned.
+        """
+        self._unsupported("readinto_at")
+
+    def write_at(self, offset, buffer):
+        """Writes the bytes-like object ``buffer`` at the absolute position ``offset``, without
+        using or moving the file pointer (pwrite() on unix), and returns the number of bytes written.
+
+        Like for :meth:`read_at`, raw streams issue a single system call, whereas buffered streams
+        write the whole data. On buffered streams, pending writes are flushed first, and the read-ahead
+        buffer is emptied, since it might contain stale data afterwards.
+
+        This method raises IOError on append-mode streams, since some platforms would then
+        silently write at the end of file instead.
+        """
+        self._unsupported("write_at")
+
+    def readv(self, buffers):
+        """Scatter read: fills the writable bytes-like objects of the ``buffers`` sequence
+        one after the other, from the current file position, and returns the total number of bytes read.
+
+        Raw streams issue a single system call (readv() on unix), so buffers may be only partly filled,
+        and None is returned if a non-blocking stream has no data available.
+        Buffered streams go on reading until all buffers are full, or end of file is reached.
+        """
+        self._unsupported("readv")
+
+    def writev(self, buffers):
+        """Gather write: writes the bytes-like objects of the ``buffers`` sequence one after
+        the other, at the current file position, and returns the total number of bytes written.
+
+        This spares both the concatenation of these buffers, and the issuing of one system call per buffer.
+
+        Raw streams issue a single system call (writev() on unix), so less bytes than provided may be written,
+        and None is returned if a non-blocking stream isn't ready.
+        Buffered streams just buffer the data if it fits in their write buffer, else they submit pending data and
+        the new buffers together, as a single vectored write, and return the total length of ``buffers``.
+        """
+        self._unsupported("writev")
+
+    def readv_at(self, offset, buffers):
+        """Same as :meth:`readv`, except that reading starts at the absolute position ``offset``,
+        without using or moving the file pointer, like in :meth:`read_at`.
+        """
+        self._unsupported("readv_at")
+
+    def writev_at(self, offset, buffers):
+        """Same as :meth:`writev`, except that writing starts at the absolute position ``offset``,
+        without using or moving the file pointer, like in :meth:`write_at`.
+        """
+        self._unsupported("writev_at")
+
+    def copy_to(self, other_stream, offset=0, length=None, dst_offset=None, locking=True):
+        """
+        Copies ``length`` bytes (by default, all bytes up to the end of file) of this stream, starting at
+        the absolute position ``offset``, to the rsfile stream ``other_stream``, starting at the absolute
+        position ``dst_offset`` (by default, the same as ``offset``). File pointers are not used nor moved,
+        and pending buffers of both streams are flushed beforehand.
+
+        Data is copied by the kernel when possible, by order of preference: via reflink (extents get shared
+        by both files, on filesystems like btrfs or xfs), copy_file_range(), and sendfile(); else it's copied
+        by chunks, through a single big buffer. Holes of sparse files are detected (via SEEK_DATA/SEEK_HOLE)
+        and reproduced in the target instead of being copied.
+
+        ``other_stream`` must be writable, and not in append mode. If ``locking`` is True, the copied range
+        of this stream is locked in shared mode, and the target range in exclusive mode, during the whole copy
+        (both locks are acquired like with :func:`rsfile.lock_many`, waiting as long as needed) ; streams
+        already holding locks on these ranges must pass ``locking=False``.
+
+        Returns the number of bytes copied.
+        """
+        self._unsupported("copy_to")
+
+    def advise(self, pattern, offset=0, length=None):
+        """
+        Tells the OS how the region of ``length`` bytes (None or 0 meaning "up to the end of file"),
+        starting at the absolute position ``offset``, is going to be accessed, so that it may adapt
+        its caching and read-ahead strategies.
+
+        ``pattern`` must be one of "normal", "sequential", "random", "willneed" (data will be accessed soon,
+        so it may be prefetched), "dontneed" (data may be evicted from the OS cache) or "noreuse"
+        (data will be accessed only once).
+
+        These are only hints, relying on posix_fadvise() ; they are silently ignored on platforms lacking
+        this system call. The "Q" and "D" :ref:`advanced open modes <file_opening_modes>` emit some of these
+        hints automatically.
+        """
+        self._unsupported("advise")
+
+    def map_region(
+        self, offset, length, shared=None, access=None, timeout=None, locking=True, populate=False, advice=None
+    ):
+        """
+        Memory-maps ``length`` bytes of the file, starting at the absolute position ``offset``,
+        after having locked this region with :meth:`lock_file` (unless ``locking`` is False).
+
+        The returned :class:`MappedRegion` exposes the exact region as the memoryview ``view``,
+        and is a context manager returning this view; closing it releases the view, the mapping
+        and the lock, in that order.
+        Alignment on the allocation granularity of the OS is handled internally, so ``offset``
+        can be any positive integer. The region must already exist in the file (see :meth:`truncate`).
+
+        - *shared* and *timeout* have the same meaning as in :meth:`lock_file`.
+
+        - *access* (None or mmap.ACCESS_READ/ACCESS_WRITE/ACCESS_COPY): by default, the mapping is
+          read-only for shared locks, and writable for exclusive locks. Writable mappings require an exclusive lock.
+
+        - *populate* (boolean): if True, pages are prefaulted (MAP_POPULATE on linux, else an advice
+          to the kernel), to avoid page faults when later accessing them.
+
+        - *advice* (None or mmap.MADV_XXX constant): usage pattern hint passed to madvise(), when available.
+
+        Note that, on unix, closing a mapping never releases the other fcntl locks of the process.
+        """
+        self._unsupported("map_region")
+
     def lock_file(self, timeout=None, length=None, offset=None, whence=os.SEEK_SET, shared=None):
         """
         Locks the whole regular file or a portion of it, depending on the arguments provided.
@@ -184,8 +358,9 @@ class RSIOBase(object):
           else, it must be a number indicating how many seconds
           the operation will wait before raising a timeout IOError
           (thus, timeout=0 means a non-blocking locking attempt).
-          Low level APIs do not support lock timeout, so it's currently emulated via repeated
-          non-blocking calls (spin-lock).
+          Low level APIs do not support lock timeout, so it's emulated via repeated
+          non-blocking calls (spin-lock by default), or via the other wait strategies of the
+          *lock_wait_strategy* option (exponential backoff, helper thread, inotify wakeups).
           See :ref:`rsfile-options` for customization.
 
         - *length* (None or positive integer): Specifies how many bytes must be locked.
@@ -232,11 +407,10 @@ class RSIOBase(object):
         """
         Unlocks a portion of regular file previously locked through the same native handle.
 
-        The specifications of the locked area (absolute offset and length) must
-        be the same as those used when calling lock_file(),
-        else errors will occur; its is thus not possible to release only
-        a part of a locked area, or to unlock with only one call
-        two consecutive ranges.
+        All the bytes locked by this handle in the target area are released, with as few system calls as possible,
+        and a RuntimeError is raised if there was none. With fcntl() locks, this area may cover several consecutive
+        ranges, or only a part of a locked range (which then gets split). With flock() locks, and on windows, only
+        whole locked ranges can be released.
 
         This function will usually be implicitly called thanks to a context manager
         returned by :meth:`lock_file`. But as stated above, don't use it if you plan
@@ -245,6 +419,43 @@ class RSIOBase(object):
         """
         self._unsupported("unlock_file")
 
+    def query_lock(self, length=None, offset=None, whence=os.SEEK_SET, shared=None):
+        """
+        Checks, without acquiring anything, whether :meth:`lock_file` could currently lock that area
+        (arguments have the same meaning as for this method).
+
+        Returns None if the area is free, else a :class:`LockHolder` describing a conflicting lock:
+        its *shared* mode, *start* and *end* offsets (end being None for locks extending to infinity),
+        and the *pid* of its owner process if known. Locks held through other streams of the current
+        process are reported too, with their *handle*.
+
+        On unix, this relies on F_GETLK (or F_OFD_GETLK, with open file description locks) ; elsewhere,
+        or with flock() locks, kernel locks can't be inspected without being taken (which would disturb
+        other processes, windows locks being mandatory), so only the locks of the current process are reported.
+        The answer may of course be outdated as soon as it's returned.
+
+        The *holder* attribute of the :class:`LockingException` raised on lock timeouts is filled the same way,
+        except that a holder with unknown details is reported if the kernel refused the lock to an unknown party.
+        """
+        self._unsupported("query_lock")
+
+    def relock(self, shared, length=None, offset=None, whence=os.SEEK_SET, timeout=None):
+        """
+        Converts a lock previously taken through this stream with :meth:`lock_file` (with the exact same
+        range) to a shared lock if ``shared`` is True, else to an exclusive lock.
+
+        Downgrading to a shared lock never blocks. Upgrading to an exclusive lock waits, like :meth:`lock_file`
+        and with the same *timeout* semantic, until other streams and processes release their overlapping
+        locks ; in-process upgrades have priority over other waiters. If this fails, the shared lock is kept.
+        Two streams of the current process upgrading overlapping ranges raise a LockingException (EDEADLK)
+        instead of waiting for each other forever.
+
+        With fcntl() locks (see the *unix_locking_backend* option), the conversion is atomic: the range is never
+        left unlocked. With flock() locks, and on windows, the old lock has to be released before the new one is
+        taken, so other processes might sneak in.
+        """
+        self._unsupported("relock")
+
     @property
     def mode(self):
         """
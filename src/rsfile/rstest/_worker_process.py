@@ -187,8 +187,8 @@ def chunk_writer_reader(
     import rsfile.rsfile_registries as RG
 
     logger(
-        "Process %s (%s) <<<<exiting>>>> - lock is %s"
-        % (multiprocessing.current_process().name, threading.currentThread().name, RG.IntraProcessLockRegistry.mutex)
+        "Process %s (%s) <<<<exiting>>>> - lock registry is %s"
+        % (multiprocessing.current_process().name, threading.currentThread().name, RG.IntraProcessLockRegistry)
     )
     sys.exit(0)
 
@@ -5,7 +5,12 @@ Run iobench against rsfile drop-in replacements.
 """
 
 
+import os
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 
 import rsfile
 from rsfile.rstest.stdlib import iobench
@@ -15,6 +20,23 @@ RUN_STDLIB_CIO = True
 RUN_STDLIB_PYIO = True
 RUN_RSFILE = True  # exact OS backend depends on what's installed, see rsfileio_xxx.py and rsbackend
 
+# Select here the rsfile-specific benchmarks #
+RUN_LARGE_BUFFER_WRITES = True  # raw writes of big memoryviews, versus the former tobytes() copy
+RUN_LOCK_REGISTRY_SCALING = True  # intra-process lock registry operations, with more and more ranges held
+RUN_LOCK_REGISTRY_THREADING = True  # intra-process lock registry operations, from threads working on distinct files
+RUN_SMALL_FILE_OPENING = True  # open+close latency of many small files, versus the stdlib
+
+LARGE_BUFFER_SIZE = 64 * 1024 * 1024
+LARGE_BUFFER_ITERATIONS = 10
+
+LOCK_REGISTRY_HELD_RANGES = (10, 100, 1000, 10000, 100000)
+LOCK_REGISTRY_ITERATIONS = 1000
+LOCK_REGISTRY_THREAD_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+LOCK_REGISTRY_OPERATIONS_PER_THREAD = 2000
+
+SMALL_FILE_COUNT = 1000
+SMALL_FILE_OPENING_ROUNDS = 10
+
 
 def launch_benchmark():
     # HACK to ignore iobench.pyc file automatically, so that when iobench tries to access his "__file__", it works.
@@ -59,8 +81,164 @@ def launch_benchmark():
         print("\n-----------\n")
 
 
+def _write_fully(raw, buffer):
+    view = memoryview(buffer)
+    while view:
+        view = view[raw.write(view) :]
+
+
+def launch_large_buffer_benchmark():
+    print(">>> benchmarking rsfile raw writes of %d MiB memoryviews <<<" % (LARGE_BUFFER_SIZE // (1024 * 1024)))
+
+    payload = memoryview(bytearray(os.urandom(1024)) * (LARGE_BUFFER_SIZE // 1024))
+
+    scenarios = [
+        ("write memoryview as is", lambda: payload),
+        ("write memoryview.tobytes() copy", lambda: payload.tobytes()),  # what rsfile did before
+    ]
+
+    (fd, path) = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        with rsfile.rsopen(path, "WEB", buffering=0, locking=False, thread_safe=False) as raw:
+            for (title, get_buffer) in scenarios:
+                durations = []
+                for _ in range(LARGE_BUFFER_ITERATIONS):
+                    raw.seek(0)
+                    start = time.perf_counter()
+                    _write_fully(raw, get_buffer())
+                    durations.append(time.perf_counter() - start)
+
+                tracemalloc.start()
+                raw.seek(0)
+                _write_fully(raw, get_buffer())
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print(
+                    "%-40s %8.0f MiB/s   peak extra memory: %6.1f MiB"
+                    % (title, LARGE_BUFFER_SIZE / min(durations) / (1024 * 1024), peak_memory / (1024 * 1024))
+                )
+    finally:
+        os.remove(path)
+
+    print("\n-----------\n")
+
+
+def launch_lock_registry_benchmark():
+    print(">>> benchmarking intra-process lock registry, with N record-level locks held on the same file <<<")
+
+    from rsfile.rsfile_registries import IntraProcessLockRegistryClass
+
+    unique_id = ("benchmark_device", "benchmark_inode")
+    record_size = 100
+
+    for held_ranges in LOCK_REGISTRY_HELD_RANGES:
+        registry = IntraProcessLockRegistryClass()
+        for i in range(held_ranges):  # every other record is locked, by different handles
+            registry.register_file_lock(unique_id, i % 16, record_size, 2 * i * record_size, False, False, None)
+
+        start = time.perf_counter()
+        for i in range(LOCK_REGISTRY_ITERATIONS):
+            offset = (2 * (i % held_ranges) + 1) * record_size  # a free record
+            assert registry.register_file_lock(unique_id, "bench", record_size, offset, False, False, None)
+            assert not registry.register_file_lock(unique_id, "bench", record_size, offset - 1, False, False, None)
+            registry.unregister_file_lock(unique_id, "bench", record_size, offset)
+        duration = time.perf_counter() - start
+
+        removal_start = time.perf_counter()
+        for handle in range(16):
+            registry.remove_file_locks(unique_id, handle)
+        removal_duration = time.perf_counter() - removal_start
+
+        print(
+            "%7d held ranges: %8.2f us per lock+conflict+unlock   %8.2f us per removed range"
+            % (
+                held_ranges,
+                duration / LOCK_REGISTRY_ITERATIONS * 1e6,
+                removal_duration / held_ranges * 1e6,
+            )
+        )
+
+    print("\n-----------\n")
+
+
+def launch_lock_registry_threading_benchmark():
+    print(">>> benchmarking intra-process lock registry, with N threads locking distinct files <<<")
+
+    from rsfile.rsfile_registries import IntraProcessLockRegistryClass, LOCK_REGISTRY_STRIPES
+
+    for stripes in (1, LOCK_REGISTRY_STRIPES):  # a single mutex, like before the striping of the registry
+        for thread_count in LOCK_REGISTRY_THREAD_COUNTS:
+            registry = IntraProcessLockRegistryClass(stripes=stripes)
+            barrier = threading.Barrier(thread_count + 1)
+
+            def lock_and_unlock(index):
+                unique_id = ("benchmark_device", index)
+                barrier.wait()
+                for i in range(LOCK_REGISTRY_OPERATIONS_PER_THREAD):
+                    registry.register_file_lock(unique_id, index, 100, 0, False, False, None)
+                    registry.unregister_file_lock(unique_id, index, 100, 0)
+                    registry.try_deleting_unique_id_entry(unique_id)
+
+            threads = [threading.Thread(target=lock_and_unlock, args=(index,)) for index in range(thread_count)]
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            duration = time.perf_counter() - start
+
+            print(
+                "%2d mutex stripe(s), %2d threads: %10.0f lock+unlock per second"
+                % (stripes, thread_count, thread_count * LOCK_REGISTRY_OPERATIONS_PER_THREAD / duration)
+            )
+
+    print("\n-----------\n")
+
+
+def launch_small_file_opening_benchmark():
+    print(">>> benchmarking open+read+close of %d small files <<<" % SMALL_FILE_COUNT)
+
+    import io
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, "file%d" % index) for index in range(SMALL_FILE_COUNT)]
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+
+        openers = [
+            ("stdlib io.open", lambda path: io.open(path, "rb")),
+            ("rsfile.rsopen", lambda path: rsfile.rsopen(path, "RB", locking=False)),
+            (
+                "rsfile.rsopen raw",
+                lambda path: rsfile.rsopen(path, "RB", buffering=0, locking=False, thread_safe=False),
+            ),
+        ]
+        for (name, opener) in openers:
+            start = time.perf_counter()
+            for i in range(SMALL_FILE_OPENING_ROUNDS):
+                for path in paths:
+                    with opener(path) as f:
+                        f.read()
+            duration = time.perf_counter() - start
+            print("%-20s: %10.0f files per second" % (name, SMALL_FILE_COUNT * SMALL_FILE_OPENING_ROUNDS / duration))
+
+    print("\n-----------\n")
+
+
 if __name__ == "__main__":
     launch_benchmark()
+    if RUN_LARGE_BUFFER_WRITES:
+        launch_large_buffer_benchmark()
+    if RUN_LOCK_REGISTRY_SCALING:
+        launch_lock_registry_benchmark()
+    if RUN_LOCK_REGISTRY_THREADING:
+        launch_lock_registry_threading_benchmark()
+    if RUN_SMALL_FILE_OPENING:
+        launch_small_file_opening_benchmark()
 
     
 """ # BACKUP OF LATEST BENCHMARK ITERATION #
@@ -35,6 +35,7 @@ class TestBackendUtilities(unittest.TestCase):
 
         self.assertEqual(python_timestamp_to_win32_filetime(0), pyint_to_double_dwords(116444736000000000))
         self.assertEqual(win32_filetime_to_python_timestamp(0, 0), -11644473600)
+        self.assertEqual(win32_filetime_to_nanoseconds(*pyint_to_double_dwords(116444736000000001)), 100)
 
     def testNumberConversions(self):
 
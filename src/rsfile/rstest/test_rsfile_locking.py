@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
+import errno
 import multiprocessing
 import os
 import queue
@@ -172,6 +173,302 @@ class TestRSFileLocking(unittest.TestCase):
         finally:
             rsfile.set_rsfile_options(**old_options)
 
+    def test_locked_range_index(self):
+
+        from rsfile.rsfile_registries import LockedRangeIndex
+
+        def brute_force_overlapping(records, start, end):
+            return [r for r in records if (end is None or r[2] < end) and (r[3] is None or r[3] > start)]
+
+        index = LockedRangeIndex()
+        records = []
+        for i in range(500):
+            start = random.randint(0, 1000)
+            end = None if random.randint(0, 50) == 0 else start + random.randint(1, random.choice((5, 300)))
+            record = (random.randint(0, 20), random.choice((True, False)), start, end)
+            if record[0] in [r[0] for r in brute_force_overlapping(records, start, end)]:
+                continue  # a same handle never locks twice the same bytes
+            index.add(record)
+            records.append(record)
+
+            if random.randint(0, 3) == 0:
+                record = records.pop(random.randrange(len(records)))
+                self.assertEqual(index.remove(record[0], record[2], record[3]), record)
+                self.assertEqual(index.remove(record[0], record[2], record[3]), None)
+
+            start = random.randint(0, 1100)
+            end = random.choice((None, start + random.randint(1, 100)))
+            expected = brute_force_overlapping(records, start, end)
+            self.assertEqual(sorted(index.overlapping(start, end)), sorted(expected))
+
+        self.assertEqual(sorted(index), sorted(records))
+        self.assertEqual(len(index), len(records))
+
+        removed = index.remove_handle(3)
+        self.assertEqual(sorted(removed), sorted(r for r in records if r[0] == 3))
+        records = [r for r in records if r[0] != 3]
+        self.assertEqual(sorted(index), sorted(records))
+
+        (handle, shared, start, end) = records[0]
+        self.assertTrue(index.replace_handle(handle, "other", start, end))
+        self.assertFalse(index.replace_handle(handle, "other", start, end))
+        self.assertIn(("other", shared, start, end), list(index))
+
+    def test_lock_registry_wait_queue(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistryClass
+
+        old_options = rsfile.get_rsfile_options()
+        unique_id = ("dummy_device", "dummy_inode")
+
+        def start_waiter(registry, results, handle, length, offset, shared):
+            def wait():
+                res = registry.register_file_lock(unique_id, handle, length, offset, True, shared, 10)
+                results.append((handle, res))
+
+            thread = threading.Thread(target=wait)
+            thread.start()
+            self._wait_until(  # enqueued, or served at once
+                lambda: any(waiter.handle == handle for waiter in registry._lock_registry[unique_id][0])
+                or handle in dict(results)
+            )
+            return thread
+
+        try:
+            for writer_preference in (False, True):
+
+                rsfile.set_rsfile_options(lock_writer_preference=writer_preference)
+                registry = IntraProcessLockRegistryClass()
+                results = []
+
+                self.assertTrue(registry.register_file_lock(unique_id, "holder", 100, 0, False, True, None))
+
+                threads = [
+                    start_waiter(registry, results, "writer1", 100, 0, False),
+                    start_waiter(registry, results, "reader", 100, 0, True),
+                    start_waiter(registry, results, "writer2", 100, 0, False),
+                    start_waiter(registry, results, "elsewhere", 100, 500, False),  # not blocked at all
+                ]
+                self.assertEqual(results, [("elsewhere", True)])
+
+                # new shared locks don't overtake the writers waiting for this area
+                self.assertFalse(registry.register_file_lock(unique_id, "newcomer", 10, 50, False, True, None))
+                self.assertTrue(registry.register_file_lock(unique_id, "newcomer", 10, 200, False, True, None))
+
+                # only waiters whose range is available get woken up
+                # (releasers grant the locks of waiters before returning, so the queue tells it at once)
+                registry.unregister_file_lock(unique_id, "newcomer", 10, 200)
+                self.assertEqual(len(registry._lock_registry[unique_id][0]), 3)
+                self.assertEqual(len(results), 1)
+
+                registry.unregister_file_lock(unique_id, "holder", 100, 0)
+                self.assertEqual(len(registry._lock_registry[unique_id][0]), 2)
+                self._wait_until(lambda: len(results) == 2)
+                self.assertEqual(results[1:], [("writer1", True)])
+
+                registry.unregister_file_lock(unique_id, "writer1", 100, 0)
+                self.assertEqual(len(registry._lock_registry[unique_id][0]), 1)
+                self._wait_until(lambda: len(results) == 3)
+                self.assertEqual(results[2:], [("writer2", True)] if writer_preference else [("reader", True)])
+                registry.unregister_file_lock(unique_id, results[2][0], 100, 0)
+
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(results), 4)
+                self.assertTrue(all(res for (handle, res) in results))
+
+            # timed out waiters leave the queue, without holding back others
+            registry = IntraProcessLockRegistryClass()
+            self.assertTrue(registry.register_file_lock(unique_id, "holder", 100, 0, False, True, None))
+            self.assertFalse(registry.register_file_lock(unique_id, "writer", 100, 0, True, False, 0.2))
+            self.assertTrue(registry.register_file_lock(unique_id, "reader", 100, 0, False, True, None))
+
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    def test_lock_statistics(self):
+
+        import warnings
+
+        old_options = rsfile.get_rsfile_options()
+        try:
+            rsfile.set_rsfile_options(lock_statistics=True)
+            rsfile.reset_lock_statistics()
+
+            with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as g:
+                    f.lock_file(length=10, offset=0)
+                    self.assertRaises(rsfile.LockingException, g.lock_file, length=10, offset=5, timeout=0.1)
+                    f.unlock_file(length=10, offset=0)
+                    g.lock_file(length=10, offset=5)
+                # g's lock was released by close()
+
+            statistics = rsfile.get_lock_statistics()
+            self.assertEqual(len(statistics), 1)
+            record = list(statistics.values())[0]
+            self.assertEqual(record["acquisitions"], 2)
+            self.assertEqual(record["timeouts"], 1)
+            self.assertGreater(record["attempts"], 3)  # the timed out call retried
+            self.assertGreater(record["registry_conflicts"], 0)
+            self.assertEqual(record["kernel_conflicts"], 0)
+            self.assertEqual(record["slow_locks"], 0)
+            self.assertEqual(sum(count for (bound, count) in record["wait_times"]), 3)
+            self.assertEqual(sum(count for (bound, count) in record["hold_times"]), 2)
+            self.assertEqual(record["wait_times"][-1][0], float("inf"))
+            self.assertEqual(record["long_held_locks"], [])
+
+            rsfile.reset_lock_statistics()
+            self.assertEqual(rsfile.get_lock_statistics(), {})
+
+            # slow locks are reported with the place where they were acquired
+            rsfile.set_rsfile_options(lock_statistics=False, slow_lock_threshold=0.1)
+            with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always")
+                    f.lock_file(length=10, offset=0)
+                    f.unlock_file(length=10, offset=0)  # fast enough
+                    f.lock_file(length=10, offset=0)
+                    self._wait_until(lambda: f.unique_id() in rsfile.get_lock_statistics())
+                    f.unlock_file(length=10, offset=0)
+            self.assertEqual(len(caught), 1)
+            self.assertTrue(issubclass(caught[0].category, rsfile.SlowLockWarning))
+            self.assertIn("test_lock_statistics", str(caught[0].message))
+            self.assertEqual(rsfile.get_lock_statistics(), {})  # counters stay disabled
+
+            # locks which are never released are reported too
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                    f.lock_file(length=10, offset=20)
+                    self.assertEqual(rsfile.get_lock_statistics(), {})
+                    self._wait_until(lambda: f.unique_id() in rsfile.get_lock_statistics())
+                    statistics = rsfile.get_lock_statistics()
+                    (long_held_lock,) = statistics[f.unique_id()]["long_held_locks"]
+                    self.assertEqual((long_held_lock["start"], long_held_lock["end"]), (20, 30))
+                    self.assertGreater(long_held_lock["held_time"], 0.1)
+                    self.assertIn("test_lock_statistics", long_held_lock["stack"])
+                    self.assertEqual(statistics[f.unique_id()]["acquisitions"], 0)  # counters stay disabled
+            self.assertEqual(rsfile.get_lock_statistics(), {})
+
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    def test_lock_state_dump(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistryClass
+
+        # waiters and lock owners, on a private registry
+        registry = IntraProcessLockRegistryClass()
+        unique_id = ("dummy_device", "dummy_inode")
+        self.assertTrue(registry.register_file_lock(unique_id, "holder", 100, 0, False, False, None))
+        thread = threading.Thread(
+            target=registry.register_file_lock, args=(unique_id, "waiter", 10, 50, True, True, 10), name="mywaiter"
+        )
+        thread.start()
+        self._wait_until(lambda: len(registry._lock_registry[unique_id][0]) == 1)
+
+        (record,) = registry.dump_state()
+        self.assertEqual(record["unique_id"], unique_id)
+        self.assertEqual(record["waiters"], 1)
+        self.assertEqual(record["pending_fds"], [])
+        self.assertEqual(
+            record["locks"],
+            [
+                dict(
+                    handle="holder",
+                    shared=False,
+                    start=0,
+                    end=100,
+                    thread_name=threading.current_thread().name,
+                    thread_id=threading.current_thread().ident,
+                )
+            ],
+        )
+
+        registry.unregister_file_lock(unique_id, "holder", 100, 0)
+        thread.join()
+        (record,) = registry.dump_state()
+        self.assertEqual(record["waiters"], 0)
+        self.assertEqual([(lock["handle"], lock["thread_name"]) for lock in record["locks"]], [("waiter", "mywaiter")])
+        registry.remove_file_locks(unique_id, "waiter")
+        self.assertTrue(registry.try_deleting_unique_id_entry(unique_id))
+        self.assertEqual(registry.dump_state(), [])
+
+        # real streams, with fds waiting for purge when process-wide posix locks are used
+        old_options = rsfile.get_rsfile_options()
+        try:
+            if os.name != "nt":
+                rsfile.set_rsfile_options(unix_locking_backend="posix")
+            with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                f.lock_file(length=10, offset=20, shared=False)
+                g = rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False)
+                g_fileno = g.fileno()
+                g.close()
+
+                (record,) = [r for r in rsfile.dump_lock_state() if r["unique_id"] == f._lock_registry_inode]
+                self.assertEqual(
+                    [(lock["start"], lock["end"], lock["shared"]) for lock in record["locks"]], [(20, 30, False)]
+                )
+                if os.name != "nt":
+                    self.assertEqual(record["locks"][0]["handle"], f.fileno())
+                    self.assertEqual(record["pending_fds"], [g_fileno])
+
+                output = io.StringIO()
+                rsfile.print_lock_state(output)
+                self.assertIn("bytes 20-30 exclusive", output.getvalue())
+
+            self.assertFalse([r for r in rsfile.dump_lock_state() if r["unique_id"] == f._lock_registry_inode])
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    @unittest.skipIf(os.name == "nt", "test only works on a POSIX-like system")
+    def test_pending_descriptor_pool(self):
+
+        import warnings
+
+        pool = rsfile.PendingDescriptorPool
+        old_options = rsfile.get_rsfile_options()
+        try:
+            rsfile.set_rsfile_options(unix_locking_backend="posix", max_pending_descriptors=None)
+
+            with rsfile.rsopen(self.dummyFileName, "RWEB", buffering=0, locking=False) as f:
+                f.write(b"abcdef")
+                with f.lock_file(length=3, offset=0):
+
+                    g = rsfile.rsopen(self.dummyFileName, "RB", buffering=0, locking=False, thread_safe=False)
+                    g_fileno = g.fileno()
+                    g.read(2)
+                    g.close()
+                    self.assertEqual(pool.get_descriptors(f.unique_id()), [g_fileno])
+                    statistics = pool.get_statistics()
+
+                    # the same file and flags reuse the pending descriptor, rewound
+                    g = rsfile.rsopen(self.dummyFileName, "RB", buffering=0, locking=False, thread_safe=False)
+                    self.assertEqual(g.fileno(), g_fileno)
+                    self.assertEqual(g.unique_id(), f.unique_id())
+                    self.assertEqual(g.read(), b"abcdef")
+                    self.assertEqual(pool.get_descriptors(f.unique_id()), [])
+                    self.assertEqual(pool.get_statistics()["reused"], statistics["reused"] + 1)
+
+                    # other flags, or an exclusive creation, need a new descriptor
+                    g.close()
+                    with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as h:
+                        self.assertNotEqual(h.fileno(), g_fileno)
+                    self.assertEqual(len(pool.get_descriptors(f.unique_id())), 2)
+
+                    # beyond the soft limit, only descriptors of unlocked files could be closed
+                    rsfile.set_rsfile_options(max_pending_descriptors=1)
+                    with warnings.catch_warnings(record=True) as caught:
+                        warnings.simplefilter("always")
+                        rsfile.rsopen(self.dummyFileName, "RB", buffering=0, locking=False).close()
+                    self.assertEqual([w.category for w in caught], [defs.PendingDescriptorsWarning])
+                    self.assertEqual(len(pool.get_descriptors(f.unique_id())), 2)  # previous one was reused
+
+                self.assertEqual(pool.get_descriptors(f.unique_id()), [])  # purged by unlocking
+                self.assertEqual(pool.get_statistics()["current"], 0)
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
     def test_intra_process_locking(self):
         """
         We check the behaviour of locks when opening several times the same file from within a process.
@@ -281,6 +578,671 @@ class TestRSFileLocking(unittest.TestCase):
                 "Error, we lost all locks when closing a file descriptor - exitcode %s" % process.exitcode,
             )
 
+    def test_region_unmapping_keeps_locks(self):
+
+        with rsfile.rsopen(self.dummyFileName, "RWBE", buffering=0, locking=False) as f:
+            f.write(b"x" * 3 * defs.DEFAULT_BUFFER_SIZE)
+
+            with f.lock_file(timeout=0, length=10, offset=0):
+                region = f.map_region(defs.DEFAULT_BUFFER_SIZE, 10)
+                region.close()  # the mapping might hold a duplicate of our file descriptor
+
+                target = _worker_process.lock_tester
+                lockingKwargs = {"timeout": 0, "length": 10, "offset": 0}
+                kwargs = {
+                    "resultQueue": None,
+                    "targetFileName": self.dummyFileName,
+                    "multiprocessing_lock": None,
+                    "lockingKwargs": lockingKwargs,
+                    "pause": 0,
+                    "multiprocess": True,
+                    "res_by_exit_code": True,
+                }
+
+                process = multiprocessing.Process(name="%s %s" % (target.__name__, "MMAP"), target=target, kwargs=kwargs)
+                process.daemon = True
+                process.start()
+                process.join()
+                self.assertEqual(
+                    process.exitcode,
+                    2,
+                    "Error, we lost all locks when unmapping a file region - exitcode %s" % process.exitcode,
+                )
+
+    @unittest.skipIf(os.name == "nt", "test only works on a POSIX-like system")
+    def test_unix_locking_backends(self):
+
+        from rsfile.rsbackend import unix_stdlib
+
+        old_options = rsfile.get_rsfile_options()
+        backends = ["posix", "flock"]
+        if hasattr(unix_stdlib, "ofd_lockf"):
+            backends.append("ofd")
+
+        try:
+            for backend in backends:
+                self._check_unix_locking_backend(backend)
+
+            rsfile.set_rsfile_options(unix_locking_backend="auto")
+            with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                self.assertEqual(f._locking_backend, "ofd" if "ofd" in backends else "posix")
+
+            rsfile.set_rsfile_options(unix_locking_backend="dummy")
+            self.assertRaises(defs.BadValueTypeError, rsfile.rsopen, self.dummyFileName, "RWB", locking=False)
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    def _check_unix_locking_backend(self, backend):
+
+        from rsfile.rsfile_registries import PendingDescriptorPool
+
+        rsfile.set_rsfile_options(unix_locking_backend=backend)
+
+        with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+            self.assertEqual(f._locking_backend, backend)
+
+            if backend == "flock":
+                self.assertRaises(defs.BadValueTypeError, f.lock_file, timeout=0, length=10, offset=0)
+
+                # flock() can only release or convert the whole lock, so partial operations are rejected
+                f.lock_file(timeout=0)
+                self.assertRaises(RuntimeError, f.unlock_file, length=10, offset=0)
+                self.assertRaises(RuntimeError, f.relock, True, length=10, offset=0)
+                (record,) = [r for r in rsfile.dump_lock_state() if r["unique_id"] == f._lock_registry_inode]
+                self.assertEqual([(lock["start"], lock["end"]) for lock in record["locks"]], [(0, None)])
+                self.assertFalse(self._can_lock_from_other_process(length=None, offset=0))
+                f.relock(True)
+                f.unlock_file()
+
+            with f.lock_file(timeout=0):
+
+                with rsfile.rsopen(self.dummyFileName, "RB", locking=False) as g:
+                    self.assertRaises(rsfile.LockingException, g.lock_file, timeout=0)
+
+                # with posix locks, closing g would have released the locks of f, so it's left pending
+                pending = PendingDescriptorPool.get_descriptors(f.unique_id())
+                self.assertEqual(bool(pending), backend == "posix")
+
+                # forked children inherit the backend option, and their own open file description
+                target = _worker_process.lock_tester
+                kwargs = {
+                    "resultQueue": None,
+                    "targetFileName": self.dummyFileName,
+                    "multiprocessing_lock": None,
+                    "lockingKwargs": {"timeout": 0},
+                    "pause": 0,
+                    "multiprocess": True,
+                    "res_by_exit_code": True,
+                }
+                process = multiprocessing.Process(
+                    name="%s %s" % (target.__name__, backend), target=target, kwargs=kwargs
+                )
+                process.daemon = True
+                process.start()
+                process.join()
+                self.assertEqual(process.exitcode, 2, "Lock lost with %s backend" % backend)
+
+    @unittest.skipIf(not hasattr(os, "register_at_fork"), "test requires fork hooks")
+    def test_lock_registry_reset_on_fork(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistry
+
+        with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+            f.lock_file(timeout=0, length=10, offset=0)
+
+            # another thread holds the registry mutex of that file while we fork
+            mutex = IntraProcessLockRegistry.mutex_for(f.unique_id())
+            self.assertTrue(len(set(IntraProcessLockRegistry.mutex_for(("device", i)) for i in range(100))) > 1)
+            held = threading.Event()
+            released = threading.Event()
+
+            def hold_mutex():
+                with mutex:
+                    held.set()
+                    released.wait()
+
+            thread = threading.Thread(target=hold_mutex)
+            thread.start()
+            held.wait()
+
+            try:
+                target = _worker_process.lock_tester
+                kwargs = {
+                    "resultQueue": None,
+                    "targetFileName": self.dummyFileName,
+                    "multiprocessing_lock": None,
+                    "lockingKwargs": {"timeout": 0, "length": 10, "offset": 0},
+                    "pause": 0,
+                    "multiprocess": True,
+                    "res_by_exit_code": True,
+                }
+                process = multiprocessing.Process(
+                    name="%s %s" % (target.__name__, "FORK"), target=target, kwargs=kwargs
+                )
+                process.daemon = True
+                process.start()
+                process.join(10)
+                # the child has a fresh registry, so it reaches the kernel lock held by its parent
+                self.assertEqual(process.exitcode, 2, "Child process got stuck or failed - %s" % process.exitcode)
+            finally:
+                released.set()
+                thread.join()
+
+    def _start_lock_holder(self, pause):
+        target = _worker_process.lock_tester
+        kwargs = {
+            "resultQueue": None,
+            "targetFileName": self.dummyFileName,
+            "multiprocessing_lock": None,
+            "lockingKwargs": {"timeout": 0},
+            "pause": pause,
+            "multiprocess": True,
+        }
+        process = multiprocessing.Process(name="%s %s" % (target.__name__, "HOLDER"), target=target, kwargs=kwargs)
+        process.daemon = True
+        process.start()
+        time.sleep(0.5)  # let the child process take the lock
+        return process
+
+    def test_query_lock(self):
+
+        old_options = rsfile.get_rsfile_options()
+        backends = ("posix", "ofd", "flock") if os.name != "nt" else (None,)
+
+        try:
+            for backend in backends:
+                if backend == "ofd" and not hasattr(rsfile.rsfileio_unix.unix, "ofd_lockf"):
+                    continue
+                if backend:
+                    rsfile.set_rsfile_options(unix_locking_backend=backend)
+
+                with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                    self.assertEqual(f.query_lock(), None)
+                    self.assertRaises(defs.BadValueTypeError, f.query_lock, length=-1)
+
+                    # locks of the current process
+                    with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as g:
+                        if backend == "flock":
+                            g.lock_file(shared=True)
+                        else:
+                            g.lock_file(length=10, offset=20, shared=True)
+                        holder = f.query_lock(length=100, offset=0)
+                        self.assertEqual((holder.shared, holder.pid), (True, os.getpid()))
+                        self.assertEqual(holder.handle, g._lock_registry_descriptor)
+                        self.assertEqual((holder.start, holder.end), (0, None) if backend == "flock" else (20, 30))
+                        self.assertEqual(f.query_lock(length=100, offset=0, shared=True), None)
+                        if backend != "flock":
+                            self.assertEqual(f.query_lock(length=10, offset=30), None)
+
+                        exc = None
+                        try:
+                            f.lock_file(length=100, offset=0, timeout=0)
+                        except rsfile.LockingException as e:
+                            exc = e
+                        self.assertTrue(exc)
+                        self.assertEqual(exc.holder.handle, g._lock_registry_descriptor)
+                        self.assertIn("LockHolder", str(exc))
+
+                    # locks of another process
+                    process = self._start_lock_holder(pause=2)
+                    try:
+                        holder = f.query_lock(shared=True)
+                        if backend in ("flock", None):
+                            # these kernel locks can't be inspected without being taken, so they're not probed
+                            self.assertEqual(holder, None)
+                        else:
+                            self.assertTrue(holder)
+                            self.assertEqual(holder.handle, None)
+                        if backend == "posix":
+                            self.assertEqual((holder.shared, holder.pid), (False, process.pid))
+                            self.assertEqual(holder.start, 0)
+
+                        exc = None
+                        try:
+                            f.lock_file(timeout=0.2)
+                        except rsfile.LockingException as e:
+                            exc = e
+                        self.assertTrue(exc)
+                        self.assertTrue(exc.holder)  # with unknown details, if locks can't be inspected
+                        self.assertEqual(exc.holder.handle, None)
+                    finally:
+                        process.join()
+                    self.assertEqual(f.query_lock(), None)
+
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    def _wait_until(self, condition, timeout=10):
+        # polls instead of sleeping a fixed time, so that slow machines don't break synchronisation
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertLess(time.time(), deadline, "condition not reached in %ss" % timeout)
+            time.sleep(0.01)
+
+    def _can_lock_from_other_process(self, **lockingKwargs):
+        kwargs = {
+            "resultQueue": None,
+            "targetFileName": self.dummyFileName,
+            "multiprocessing_lock": None,
+            "lockingKwargs": dict(timeout=0, **lockingKwargs),
+            "multiprocess": True,
+            "res_by_exit_code": True,
+        }
+        process = multiprocessing.Process(target=_worker_process.lock_tester, kwargs=kwargs)
+        process.start()
+        process.join()
+        return process.exitcode == 1
+
+    def test_relock(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistry
+
+        old_options = rsfile.get_rsfile_options()
+        backends = ("posix", "ofd") if os.name != "nt" else (None,)
+
+        try:
+            for backend in backends:
+                if backend == "ofd" and not hasattr(rsfile.rsfileio_unix.unix, "ofd_lockf"):
+                    continue
+                if backend:
+                    rsfile.set_rsfile_options(unix_locking_backend=backend)
+
+                with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                    with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as g:
+
+                        self.assertRaises(RuntimeError, f.relock, False, length=10, offset=0)  # not locked
+                        self.assertRaises(defs.BadValueTypeError, f.relock, None, length=10, offset=0)
+
+                        f.lock_file(length=10, offset=0, shared=True)
+                        f.relock(True, length=10, offset=0)  # no-op
+                        g.lock_file(length=10, offset=5, shared=True)
+
+                        try:
+                            f.relock(False, length=10, offset=0, timeout=0)
+                        except rsfile.LockingException as e:
+                            self.assertEqual(e.holder.handle, g._lock_registry_descriptor)
+                        else:
+                            raise AssertionError("relock() should have failed")
+                        g.lock_file(length=1, offset=1, shared=True, timeout=0)  # we're still a reader
+                        g.unlock_file(length=1, offset=1)
+
+                        # upgrade waits for other readers
+                        threading.Timer(0.5, g.unlock_file, kwargs=dict(length=10, offset=5)).start()
+                        start = time.time()
+                        f.relock(False, length=10, offset=0, timeout=5)
+                        self.assertTrue(0.3 < time.time() - start < 3)
+                        self.assertRaises(
+                            rsfile.LockingException, g.lock_file, length=1, offset=9, shared=True, timeout=0
+                        )
+                        self.assertFalse(self._can_lock_from_other_process(length=10, offset=0, shared=True))
+
+                        f.relock(True, length=10, offset=0)
+                        with g.lock_file(length=1, offset=9, shared=True, timeout=0):
+                            pass
+                        self.assertTrue(self._can_lock_from_other_process(length=10, offset=0, shared=True))
+
+                        # two upgraders of overlapping ranges would wait for each other
+                        g.lock_file(length=10, offset=5, shared=True)
+                        thread = threading.Thread(target=f.relock, args=(False,), kwargs=dict(length=10, offset=0))
+                        thread.start()
+                        self._wait_until(lambda: IntraProcessLockRegistry._lock_registry[f._lock_registry_inode][0])
+                        try:
+                            g.relock(False, length=10, offset=5)
+                        except rsfile.LockingException as e:
+                            self.assertEqual(e.errno, errno.EDEADLK)
+                        else:
+                            raise AssertionError("relock() should have detected a deadlock")
+                        g.unlock_file(length=10, offset=5)
+                        thread.join()
+                        self.assertFalse(self._can_lock_from_other_process(length=10, offset=0, shared=True))
+
+                        f.unlock_file(length=10, offset=0)
+
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
+    def test_partial_unlocking_and_coalescing(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistryClass
+
+        unique_id = ("dummy_device", "dummy_inode")
+
+        def get_ranges(registry):
+            return [(lock["start"], lock["end"], lock["shared"]) for lock in registry.dump_state()[0]["locks"]]
+
+        registry = IntraProcessLockRegistryClass(coalesce_ranges=True)
+        for offset in (0, 10, 20):
+            self.assertTrue(registry.register_file_lock(unique_id, "h", 10, offset, False, False, None))
+        self.assertTrue(registry.register_file_lock(unique_id, "h", 10, 30, False, True, None))
+        self.assertTrue(registry.register_file_lock(unique_id, "other", 10, 40, False, False, None))
+        self.assertEqual(get_ranges(registry), [(0, 30, False), (30, 40, True), (40, 50, False)])
+        self.assertRaises(RuntimeError, registry.register_file_lock, unique_id, "h", 10, 25, False, False, None)
+
+        self.assertEqual(registry.release_file_range(unique_id, "h", 10, 5), [(5, 15)])
+        self.assertEqual(get_ranges(registry), [(0, 5, False), (15, 30, False), (30, 40, True), (40, 50, False)])
+        self.assertRaises(RuntimeError, registry.release_file_range, unique_id, "h", 10, 5)  # nothing left there
+
+        # "release everything before offset 35", in a single kernel call
+        self.assertEqual(registry.release_file_range(unique_id, "h", 35, 0), [(0, 5), (15, 35)])
+        self.assertEqual(get_ranges(registry), [(35, 40, True), (40, 50, False)])
+
+        self.assertTrue(registry.convert_file_lock(unique_id, "h", 3, 36, False, False, None))  # sub-range
+        self.assertEqual(get_ranges(registry), [(35, 36, True), (36, 39, False), (39, 40, True), (40, 50, False)])
+        self.assertFalse(registry.unregister_file_lock(unique_id, "h", None, 0))
+        self.assertTrue(registry.unregister_file_lock(unique_id, "other", 10, 40))
+
+        # without coalescing, only whole ranges can be released
+        registry = IntraProcessLockRegistryClass(coalesce_ranges=False)
+        for offset in (0, 10):
+            self.assertTrue(registry.register_file_lock(unique_id, "h", 10, offset, False, False, None))
+        self.assertEqual(get_ranges(registry), [(0, 10, False), (10, 20, False)])
+        self.assertRaises(RuntimeError, registry.release_file_range, unique_id, "h", 10, 5)
+        self.assertEqual(registry.release_file_range(unique_id, "h", None, 0), [(0, 10), (10, 20)])
+
+        # streams may also disable coalescing per call, eg. for flock() locks
+        registry = IntraProcessLockRegistryClass(coalesce_ranges=True)
+        for offset in (0, 10):
+            self.assertTrue(registry.register_file_lock(unique_id, "h", 10, offset, False, True, None, coalesce=False))
+        self.assertEqual(get_ranges(registry), [(0, 10, True), (10, 20, True)])
+        self.assertRaises(RuntimeError, registry.release_file_range, unique_id, "h", 5, 0, coalesce=False)
+        self.assertRaises(RuntimeError, registry.convert_file_lock, unique_id, "h", 5, 0, False, False, None, False)
+        self.assertRaises(RuntimeError, registry.convert_file_lock, unique_id, "h", 20, 0, False, False, None, False)
+        self.assertTrue(registry.convert_file_lock(unique_id, "h", 10, 0, False, False, None, coalesce=False))
+        self.assertEqual(get_ranges(registry), [(0, 10, False), (10, 20, True)])
+        self.assertTrue(registry.unregister_file_lock(unique_id, "h", None, 0, coalesce=False))
+
+        if os.name == "nt":
+            return
+
+        # real streams, whose kernel locks get released with as few syscalls as possible
+        with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False, thread_safe=False) as f:
+            for offset in range(0, 1000, 10):
+                f.lock_file(length=10, offset=offset)
+            (record,) = [r for r in rsfile.dump_lock_state() if r["unique_id"] == f._lock_registry_inode]
+            self.assertEqual(len(record["locks"]), 1)
+
+            unlock_calls = []
+            original_unlock = f._inner_file_unlock
+            f._inner_file_unlock = lambda *args: (unlock_calls.append(args), original_unlock(*args))
+            f.unlock_file(length=500, offset=0)
+            self.assertEqual(unlock_calls, [(500, 0)])
+
+            self.assertTrue(self._can_lock_from_other_process(length=500, offset=0))
+            self.assertFalse(self._can_lock_from_other_process(length=1, offset=999))
+
+            with f.lock_file(length=10, offset=0):  # released bytes can be locked again
+                pass
+            f.unlock_file()
+            self.assertEqual(unlock_calls[-1], (500, 500))  # only what this handle owns
+            self.assertTrue(self._can_lock_from_other_process(length=1, offset=999))
+
+    def test_lock_many(self):
+
+        other_file_name = self.dummyFileName + ".other"
+        try:
+            with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f, rsfile.rsopen(
+                other_file_name, "RWB", buffering=0, locking=False
+            ) as g:
+
+                self.assertRaises(defs.BadValueTypeError, rsfile.lock_many, [(f, 0, 10, False)], timeout=-1)
+
+                with rsfile.lock_many([(g, 0, 10, False), (f, 20, 5, True), (f, 0, 10, False)], timeout=0):
+                    state = dict((record["unique_id"], record["locks"]) for record in rsfile.dump_lock_state())
+                    self.assertEqual(
+                        sorted((lock["start"], lock["shared"]) for lock in state[f._lock_registry_inode]),
+                        [(0, False), (20, True)],
+                    )
+                    self.assertEqual([lock["start"] for lock in state[g._lock_registry_inode]], [0])
+                    self.assertFalse(self._can_lock_from_other_process(length=10, offset=0, shared=True))
+                self.assertTrue(self._can_lock_from_other_process(length=30, offset=0, shared=False))
+
+                # all-or-nothing acquisition
+                with rsfile.rsopen(other_file_name, "RWB", buffering=0, locking=False) as h:
+                    with h.lock_file(length=1, offset=5, shared=False):
+                        start = time.time()
+                        self.assertRaises(
+                            rsfile.LockingException, rsfile.lock_many, [(f, 0, 10, False), (g, 0, 10, True)], 0.5
+                        )
+                        self.assertTrue(0.3 < time.time() - start < 3)
+                        f.lock_file(length=10, offset=0, timeout=0)  # was released by the rollback
+                        f.unlock_file(length=10, offset=0)
+                        self.assertRaises(RuntimeError, rsfile.lock_many, [(f, 0, 10, False), (f, 5, 10, False)])
+                        self.assertTrue(self._can_lock_from_other_process(length=30, offset=0, shared=False))
+
+            # threads requesting the same ranges in opposite orders don't deadlock
+            def lock_repeatedly(reverse):
+                with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f, rsfile.rsopen(
+                    other_file_name, "RWB", buffering=0, locking=False
+                ) as g:
+                    requests = [(f, 0, 100, False), (g, 0, 100, False)]
+                    if reverse:
+                        requests.reverse()
+                    for i in range(200):
+                        with rsfile.lock_many(requests):
+                            pass
+
+            threads = [threading.Thread(target=lock_repeatedly, args=(reverse,)) for reverse in (False, True)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(60)
+                self.assertFalse(thread.is_alive())
+        finally:
+            os.remove(other_file_name)
+
+    def test_deadlock_detection(self):
+
+        from rsfile.rsfile_registries import IntraProcessLockRegistry
+
+        other_file_name = self.dummyFileName + ".other"
+        old_options = rsfile.get_rsfile_options()
+        try:
+            rsfile.set_rsfile_options(lock_deadlock_detection=True)
+
+            # blocking waits, then spinning ones, with an explicit timeout and with the enforced timeout
+            variants = [({}, {}), ({}, dict(timeout=5)), (dict(enforced_locking_timeout_value=5), {})]
+
+            # a thread blocking itself via two streams
+            for (options, lock_kwargs) in variants:
+                rsfile.set_rsfile_options(**options)
+                with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                    with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as g:
+                        with f.lock_file(length=10, offset=0):
+                            start = time.time()
+                            try:
+                                g.lock_file(length=5, offset=5, **lock_kwargs)
+                            except rsfile.LockingException as e:
+                                self.assertEqual(e.errno, errno.EDEADLK)
+                                (edge,) = e.cycle
+                                self.assertEqual(edge["thread_name"], threading.current_thread().name)
+                                self.assertEqual(edge["blocker_thread_name"], threading.current_thread().name)
+                                self.assertEqual(edge["handle"], g._lock_registry_descriptor)
+                                self.assertEqual(edge["blocker_handle"], f._lock_registry_descriptor)
+                                self.assertEqual((edge["start"], edge["end"]), (5, 10))
+                            else:
+                                raise AssertionError("lock_file() should have detected a deadlock")
+                            self.assertTrue(time.time() - start < 2)  # no waiting for the timeout
+                            (record,) = [
+                                r for r in rsfile.dump_lock_state() if r["unique_id"] == f._lock_registry_inode
+                            ]
+                            self.assertEqual(record["waiters"], 0)
+                            self.assertFalse(IntraProcessLockRegistry._wait_for_graph)
+                rsfile.set_rsfile_options(enforced_locking_timeout_value=old_options["enforced_locking_timeout_value"])
+
+            # two threads locking two files in opposite orders
+            def lock_both(name, first_file, second_file, own_event, other_event, lock_kwargs):
+                with rsfile.rsopen(first_file, "RWB", buffering=0, locking=False) as f1, rsfile.rsopen(
+                    second_file, "RWB", buffering=0, locking=False
+                ) as f2:
+                    with f1.lock_file(length=10, offset=0):
+                        own_event.set()
+                        other_event.wait(10)
+                        if name == "second":  # let the first thread wait for us
+                            self._wait_until(
+                                lambda: any(thread.name == "first" for thread in IntraProcessLockRegistry._wait_for_graph)
+                            )
+                        try:
+                            with f2.lock_file(length=10, offset=0, **lock_kwargs):
+                                results[name] = "locked"
+                        except rsfile.LockingException as e:
+                            results[name] = e
+
+            for (options, lock_kwargs) in variants:
+                rsfile.set_rsfile_options(**options)
+                first_locked = threading.Event()
+                second_locked = threading.Event()
+                results = {}
+                threads = [
+                    threading.Thread(
+                        target=lock_both,
+                        args=("first", self.dummyFileName, other_file_name, first_locked, second_locked, lock_kwargs),
+                        name="first",
+                    ),
+                    threading.Thread(
+                        target=lock_both,
+                        args=("second", other_file_name, self.dummyFileName, second_locked, first_locked, lock_kwargs),
+                        name="second",
+                    ),
+                ]
+                start = time.time()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join(30)
+                    self.assertFalse(thread.is_alive())
+                self.assertTrue(time.time() - start < 4)  # not even the spinning thread waited for its timeout
+                rsfile.set_rsfile_options(enforced_locking_timeout_value=old_options["enforced_locking_timeout_value"])
+
+                self.assertEqual(results["first"], "locked")  # once the second thread gave up
+                error = results["second"]
+                self.assertEqual(error.errno, errno.EDEADLK)
+                self.assertEqual(
+                    [(edge["thread_name"], edge["blocker_thread_name"]) for edge in error.cycle],
+                    [("second", "first"), ("first", "second")],
+                )
+                self.assertIn("Deadlock between threads detected", str(error))
+                self.assertFalse(IntraProcessLockRegistry._wait_for_graph)
+
+            # waits without cycles are unaffected, but locks are expected to be released by their owner thread
+            with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as f:
+                with rsfile.rsopen(self.dummyFileName, "RWB", buffering=0, locking=False) as g:
+                    f.lock_file(length=10, offset=0)
+                    timer = threading.Timer(0.3, f.unlock_file, kwargs=dict(length=10, offset=0))
+                    timer.start()
+                    self.assertRaises(rsfile.LockingException, g.lock_file, length=10, offset=0)
+                    timer.join()
+                    g.lock_file(length=10, offset=0, timeout=0)
+                    g.unlock_file(length=10, offset=0)
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+            if os.path.exists(other_file_name):
+                os.remove(other_file_name)
+
+    def test_lock_wait_strategies(self):
+
+        old_options = rsfile.get_rsfile_options()
+
+        try:
+            # with such a spinlock delay, only event-driven waits can be quick
+            rsfile.set_rsfile_options(default_spinlock_delay=3)
+
+            for strategy in ("backoff", "thread", "inotify"):
+
+                rsfile.set_rsfile_options(lock_wait_strategy=strategy)
+
+                with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                    self.assertEqual(f.lock_wait_strategy, strategy)
+
+                    # contention with another thread of the process
+                    with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as g:
+                        g.lock_file(timeout=0)
+                        threading.Timer(0.5, g.close).start()
+                        start = time.time()
+                        with f.lock_file(timeout=10):
+                            pass
+                        self.assertTrue(time.time() - start < 2, strategy)
+
+                    # contention with another process
+                    process = self._start_lock_holder(pause=1)
+                    start = time.time()
+                    with f.lock_file(timeout=10):
+                        pass
+                    self.assertTrue(time.time() - start < 2.5, strategy)
+                    process.join()
+
+                    f.raw.lock_wait_strategy = "dummy"
+                    self.assertRaises(defs.BadValueTypeError, f.lock_file, timeout=0)
+
+            # timeouts are still honoured
+            rsfile.set_rsfile_options(lock_wait_strategy="thread")
+
+            def get_helper_threads():
+                return [thread for thread in threading.enumerate() if thread.name == "rsfile lock waiter"]
+
+            with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                process = self._start_lock_holder(pause=2)
+
+                # no helper thread is spawned when there is no time left to wait
+                helper_count = len(get_helper_threads())
+                self.assertRaises(rsfile.LockingException, f.lock_file, timeout=0)
+                self.assertEqual(len(get_helper_threads()), helper_count)
+
+                start = time.time()
+                self.assertRaises(rsfile.LockingException, f.lock_file, timeout=0.5, shared=True)
+                self.assertTrue(0.4 < time.time() - start < 1.5)
+
+                # the detached background waiter doesn't keep the area reserved in the registry
+                records = [r for r in rsfile.dump_lock_state() if r["unique_id"] == f.unique_id()]
+                self.assertFalse([r for r in records if r["locks"]])
+                with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as g:
+                    with self.assertRaises(rsfile.LockingException) as context:
+                        g.lock_file(timeout=0)
+                    self.assertNotIn("already locked", str(context.exception))
+
+                # it gives back the lock once it gets it, without converting the lock taken meanwhile by our stream
+                with f.lock_file(timeout=10):
+                    for thread in get_helper_threads():
+                        thread.join(5)
+                    self.assertFalse(self._can_lock_from_other_process(length=None, offset=0, shared=True))
+                process.join()
+
+            self.assertFalse(get_helper_threads())
+            self.assertTrue(self._can_lock_from_other_process(length=None, offset=0))
+
+            # helpers would share the lock ownership of posix and flock streams, so these back off instead
+            if os.name != "nt":
+                for backend in ("posix", "flock"):
+                    rsfile.set_rsfile_options(unix_locking_backend=backend)
+                    with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                        process = self._start_lock_holder(pause=1)
+                        self.assertRaises(rsfile.LockingException, f.lock_file, timeout=0.3)
+                        self.assertFalse(get_helper_threads())
+                        with f.lock_file(timeout=10):
+                            pass
+                        process.join()
+                rsfile.set_rsfile_options(unix_locking_backend=old_options["unix_locking_backend"])
+
+            # the "inotify" strategy watches the file with a single instance, for all the retries of a call
+            rsfile.set_rsfile_options(lock_wait_strategy="inotify", default_spinlock_delay=0.05)
+            with rsfile.rsopen(self.dummyFileName, "RWB", locking=False) as f:
+                watchers = []
+                original_open_release_watcher = f.raw._inner_open_release_watcher
+
+                def recording_open_release_watcher():
+                    watchers.append(original_open_release_watcher())
+                    return watchers[-1]
+
+                f.raw._inner_open_release_watcher = recording_open_release_watcher
+                process = self._start_lock_holder(pause=1)
+                self.assertRaises(rsfile.LockingException, f.lock_file, timeout=0.5)
+                self.assertEqual(len(watchers), 1)
+                if watchers[0] is not None:
+                    self.assertRaises(OSError, os.fstat, watchers[0][0])  # closed along with the call
+                process.join()
+
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
     def _test_whole_file_mixed_locking(self, Executor, lock):
         """Mixed writer-readers and readers try to work on the whole file."""
 
@@ -341,23 +341,27 @@ class TestStreamsRetrocompatibility(unittest.TestCase):
 
     def testMiscStreamBehavioursRetrocompatibility(self):
 
-        filename = "TESTFILE"
-
-        for opener in (rsfile.rsopen, io.open):
+        (fd, filename) = tempfile.mkstemp()  # no scratch file left in the working directory
+        os.close(fd)
 
-            # BEWARE: wrapped stream must NOT be truncated despite the "w" mode
+        try:
+            for opener in (rsfile.rsopen, io.open):
 
-            # print("Trying with", opener)
-            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
-            self.assertEqual(os.fstat(fd).st_size, 0)
-            os.write(fd, b"abcd")
-            self.assertEqual(os.fstat(fd).st_size, 4)
+                # BEWARE: wrapped stream must NOT be truncated despite the "w" mode
 
-            with opener(fd, "w", closefd=True) as f:
-                if hasattr(f, "size"):
-                    self.assertEqual(f.size(), 4)
+                # print("Trying with", opener)
+                fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+                self.assertEqual(os.fstat(fd).st_size, 0)
+                os.write(fd, b"abcd")
                 self.assertEqual(os.fstat(fd).st_size, 4)
 
+                with opener(fd, "w", closefd=True) as f:
+                    if hasattr(f, "size"):
+                        self.assertEqual(f.size(), 4)
+                    self.assertEqual(os.fstat(fd).st_size, 4)
+        finally:
+            os.unlink(filename)
+
 
 def display_open_modes_correlations_table():
     file_modes_correlation = FILE_MODES_CORRELATION
@@ -18,6 +18,9 @@ import functools
 import inspect
 
 import array
+import ctypes
+import errno
+import mmap
 import tempfile
 import time
 import itertools
@@ -548,6 +551,683 @@ class TestRSFileStreams(unittest.TestCase):
             assert len(target) == 20, target
             self.assertRaises(TypeError, f.readinto, target)  # READONLY buffer
 
+    def testRawReadinto(self):
+
+        data = bytes(bytearray(range(256))) * 64
+
+        with io.open(TESTFN, "wb", buffering=0) as f:
+            f.write(data)
+
+        with io.open(TESTFN, "rb", buffering=0) as f:
+            target = bytearray(100)
+            self.assertEqual(f.readinto(memoryview(target)[10:60]), 50)
+            self.assertEqual(target[10:60], data[0:50])
+            self.assertEqual(target[:10], b"\0" * 10)
+            self.assertEqual(target[60:], b"\0" * 40)
+            self.assertEqual(f.tell(), 50)
+
+            target = array.array("i", [0] * 10)  # multi-byte items are filled as raw bytes
+            self.assertEqual(f.readinto(target), 10 * target.itemsize)
+            self.assertEqual(target.tobytes(), data[50 : 50 + 10 * target.itemsize])
+
+            self.assertEqual(f.readinto(bytearray()), 0)
+            self.assertRaises(TypeError, f.readinto, memoryview(b"abc"))
+            self.assertRaises(TypeError, f.readinto, b"abc")
+
+            f.seek(-5, os.SEEK_END)
+            target = bytearray(10)
+            self.assertEqual(f.readinto(target), 5)
+            self.assertEqual(f.readinto(target), 0)  # EOF
+
+        with io.open(TESTFN, "rb", buffering=100) as f:
+            self.assertEqual(f.read(3), data[:3])
+            target = bytearray(len(data))  # much bigger than buffer, so it's mostly read directly into target
+            self.assertEqual(f.readinto(target), len(data) - 3)
+            self.assertEqual(target[: len(data) - 3], data[3:])
+
+    def testRawWriteBuffers(self):
+
+        numbers = array.array("i", range(10))
+        source = bytearray(b"0123456789")
+
+        with io.open(TESTFN, "wb", buffering=0) as f:
+            self.assertEqual(f.write(numbers), 10 * numbers.itemsize)  # a number of bytes, not of items
+            self.assertEqual(f.write(memoryview(source)[2:5]), 3)
+            self.assertEqual(f.write(memoryview(source)[::2]), 5)  # non-contiguous
+            self.assertEqual(f.write(memoryview(numbers).cast("B")[:4]), 4)
+            self.assertRaises(TypeError, f.write, "abc")
+            self.assertRaises(TypeError, f.write, 123)
+
+        with io.open(TESTFN, "rb", buffering=0) as f:
+            self.assertEqual(f.read(), numbers.tobytes() + b"234" + b"02468" + numbers.tobytes()[:4])
+
+    def testPositionalIO(self):
+
+        data = b"".join(b"%04d" % i for i in range(1000))
+
+        with rsfile.rsopen(TESTFN, "RWEB", buffering=0, thread_safe=False) as f:
+            self.assertEqual(f.write_at(0, data), len(data))
+            self.assertEqual(f.tell(), 0)  # file pointer is unmoved
+            self.assertEqual(f.read_at(4, 8), b"00010002")
+            self.assertEqual(f.read_at(len(data) - 2, 8), b"99")
+            self.assertEqual(f.read_at(len(data) + 10, 8), b"")
+            target = bytearray(6)
+            self.assertEqual(f.readinto_at(8, target), 6)
+            self.assertEqual(target, b"000200")
+            self.assertEqual(f.tell(), 0)
+
+            self.assertRaises(TypeError, f.read_at, -1, 10)
+            self.assertRaises(TypeError, f.read_at, 0, -10)
+            self.assertRaises(TypeError, f.readinto_at, 0, b"abc")
+            self.assertRaises(TypeError, f.write_at, 0, "abc")
+
+        with rsfile.rsopen(TESTFN, "RWB", buffering=100, thread_safe=False) as f:
+            self.assertEqual(f.read(4), b"0000")  # read-ahead buffer gets filled
+            self.assertEqual(f.write_at(4, b"ABCD"), 4)
+            self.assertEqual(f.read(4), b"ABCD")  # stale read-ahead buffer was dropped
+            f.write(b"EFGH")  # stays in write buffer
+            self.assertEqual(f.read_at(8, 4), b"EFGH")  # pending writes were flushed
+            self.assertEqual(f.read_at(0, len(data)), b"0000ABCDEFGH" + data[12:])
+            target = bytearray(len(data) + 10)
+            self.assertEqual(f.readinto_at(4, target), len(data) - 4)
+            self.assertEqual(target[:8], b"ABCDEFGH")
+            self.assertEqual(f.tell(), 12)
+
+        with rsfile.rsopen(TESTFN, "RB", buffering=0) as f:
+            self.assertRaises(IOError, f.write_at, 0, b"abc")
+        with rsfile.rsopen(TESTFN, "AB", buffering=0) as f:
+            self.assertRaises(IOError, f.write_at, 0, b"abc")
+        with rsfile.rsopen(TESTFN, "RT") as f:
+            self.assertRaises(TypeError, f.read_at, 0, 10)
+
+        with rsfile.rsopen(TESTFN, "RB", buffering=0, locking=False) as f:
+            self.assertTrue(isinstance(f, rsfile.RSThreadSafeWrapper))
+            if "read_at" in f.wrapped_stream._NATIVE_POSITIONAL_METHODS:
+                self.assertEqual(f.read_at, f.wrapped_stream.read_at)  # no mutex involved
+
+            results = {}
+
+            def read_block(index):
+                results[index] = f.read_at(index * 400, 400)
+
+            threads = [threading.Thread(target=read_block, args=(i,)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(b"".join(results[i] for i in range(10)), b"0000ABCDEFGH" + data[12:])
+
+        # emulated positional I/O moves the file pointer, so it remains protected by the mutex
+        with rsfile.rsopen(TESTFN, "RB", buffering=0, locking=False, thread_safe=False) as raw:
+            raw._NATIVE_POSITIONAL_METHODS = ()
+            f = rsfile.RSThreadSafeWrapper(raw)
+            self.assertNotEqual(f.read_at, raw.read_at)
+            self.assertEqual(f.read_at(4, 4), b"ABCD")
+
+        class ShortWriteIO(rsfile.RSFileIO):
+            def write_at(self, offset, buffer):
+                return min(len(buffer), 3) if offset < 6 else 0  # no progress after a few bytes
+
+            def writev_at(self, offset, buffers):
+                return 3 if offset < 6 else None
+
+        with ShortWriteIO(TESTFN, read=True, write=True) as raw:
+            with rsfile.RSBufferedRandom(raw) as f:
+                self.assertEqual(f.write_at(0, b"abcdefghij"), 6)  # partial count, instead of an endless loop
+                self.assertEqual(f.writev_at(0, [b"abcd", b"efghij"]), 6)
+
+    def testVectoredIO(self):
+
+        with rsfile.rsopen(TESTFN, "RWEB", buffering=0, thread_safe=False) as f:
+            self.assertEqual(f.writev([b"head", bytearray(b"payload"), memoryview(b"-tail-")[1:5]]), 15)
+            self.assertEqual(f.tell(), 15)
+            self.assertEqual(f.writev([]), 0)
+            self.assertEqual(f.writev_at(4, [b"PAY", array.array("b", b"LOAD")]), 7)
+            self.assertEqual(f.tell(), 15)
+
+            f.seek(0)
+            targets = [bytearray(4), bytearray(7), bytearray(10)]
+            self.assertEqual(f.readv(targets), 15)
+            self.assertEqual(targets, [b"head", b"PAYLOAD", b"tail" + b"\0" * 6])
+
+            targets = [bytearray(2), bytearray(3)]
+            self.assertEqual(f.readv_at(3, targets), 5)
+            self.assertEqual(targets, [b"dP", b"AYL"])
+            self.assertEqual(f.tell(), 15)
+
+            self.assertRaises(TypeError, f.readv, [bytearray(2), b"readonly"])
+            self.assertRaises(TypeError, f.writev, [b"abc", "unicode"])
+
+        with rsfile.rsopen(TESTFN, "RWB", buffering=100, thread_safe=False) as f:
+            raw_calls = []
+            original_writev = f.raw.writev
+
+            def counting_writev(buffers):
+                raw_calls.append(len(buffers))
+                return original_writev(buffers)
+
+            f.raw.writev = counting_writev
+
+            f.seek(0, os.SEEK_END)
+            self.assertEqual(f.writev([b"<", b"small", b">"]), 7)
+            self.assertEqual(raw_calls, [])  # just buffered
+            self.assertEqual(f.writev([b"<", b"x" * 200, b">"]), 202)
+            self.assertEqual(raw_calls, [4])  # pending data and new record, in a single vector
+            self.assertEqual(f.tell(), 15 + 7 + 202)
+
+            self.assertEqual(f.read_at(15, 1000), b"<small><" + b"x" * 200 + b">")
+            self.assertEqual(f.writev_at(1000, [b"a" * 150, b"b" * 150]), 300)
+            self.assertEqual(f.size(), 1300)
+
+            f.seek(0)
+            self.assertEqual(f.read(2), b"he")  # read-ahead buffer is filled
+            f.writev([b"AD"])
+            f.flush()
+            targets = [bytearray(4), bytearray(200)]
+            self.assertEqual(f.readv_at(0, targets), 204)
+            self.assertEqual(targets[0], b"heAD")
+
+            f.seek(1000)
+            targets = [bytearray(100), bytearray(100), bytearray(200)]
+            self.assertEqual(f.readv(targets), 300)
+            self.assertEqual(targets[1], b"a" * 50 + b"b" * 50)
+
+        # a raw stream making no progress doesn't make vectored writes loop forever, nor lose data
+        with rsfile.rsopen(TESTFN, "RWEB", buffering=100, thread_safe=False) as f:
+            original_writev = f.raw.writev
+            raw_calls = []
+
+            def stalling_writev(buffers):
+                raw_calls.append(len(buffers))
+                if len(raw_calls) > 1:
+                    return 0
+                return original_writev([memoryview(buffers[0])[:5]])
+
+            f.raw.writev = stalling_writev
+            self.assertEqual(f.writev([b"0123456789", b"y" * 200]), 210)
+            self.assertEqual(raw_calls, [2, 2])
+            f.raw.writev = original_writev
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), b"0123456789" + b"y" * 200)
+
+        with rsfile.rsopen(TESTFN, "RT") as f:
+            self.assertRaises(TypeError, f.writev, [b"abc"])
+
+    def testSizeAwareReadall(self):
+
+        data = os.urandom(1024 * 1024)
+        rsfile.write_to_file(TESTFN, data)
+
+        with rsfile.rsopen(TESTFN, "RB", buffering=0, thread_safe=False) as f:
+            read_sizes = []
+            original_inner_read = f._inner_read
+
+            def counting_inner_read(n):
+                read_sizes.append(n)
+                return original_inner_read(n)
+
+            f._inner_read = counting_inner_read
+
+            self.assertEqual(f.read(), data)
+            self.assertEqual(read_sizes, [len(data) + 1, defs.DEFAULT_BUFFER_SIZE])  # whole content, then EOF
+
+            f.seek(1000)
+            del read_sizes[:]
+            self.assertEqual(f.readall(), data[1000:])
+            self.assertEqual(read_sizes[0], len(data) - 1000 + 1)
+
+            # short reads don't make us fall back to small chunks
+            def short_inner_read(n):
+                read_sizes.append(n)
+                return original_inner_read(min(n, 300000))
+
+            f._inner_read = short_inner_read
+            f.seek(0)
+            del read_sizes[:]
+            self.assertEqual(f.readall(), data)
+            self.assertEqual(
+                read_sizes, [len(data) + 1 - i * 300000 for i in range(4)] + [defs.DEFAULT_BUFFER_SIZE]
+            )
+
+            # neither does file growth, for which chunks grow geometrically
+            f._inner_size = lambda: 1000
+            f.seek(0)
+            del read_sizes[:]
+            self.assertEqual(f.readall(), data)
+            self.assertEqual(read_sizes[:4], [defs.DEFAULT_BUFFER_SIZE * factor for factor in (1, 1, 2, 4)])
+            f._inner_read = counting_inner_read
+
+            # file growth or shrinking during readall() doesn't break anything
+            for fake_size in (10, len(data) * 2):
+                f._inner_size = lambda: fake_size
+                f.seek(0)
+                self.assertEqual(f.readall(), data)
+
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), data)
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True, buffering=100), data)
+
+    def testMapRegion(self):
+
+        data = os.urandom(3 * mmap.ALLOCATIONGRANULARITY)
+        rsfile.write_to_file(TESTFN, data)
+
+        with rsfile.rsopen(TESTFN, "RWB", locking=False, thread_safe=False) as f:
+
+            self.assertRaises(defs.BadValueTypeError, f.map_region, 0, 0)
+            self.assertRaises(defs.BadValueTypeError, f.map_region, -1, 10)
+            self.assertRaises(defs.BadValueTypeError, f.map_region, 0, 10, shared=True, access=mmap.ACCESS_WRITE)
+
+            offset = mmap.ALLOCATIONGRANULARITY + 17  # unaligned on purpose
+            region = f.map_region(offset, 100)
+            self.assertEqual(region.offset, offset)
+            self.assertEqual(region.length, 100)
+
+            with region as view:
+                self.assertEqual(len(view), 100)
+                self.assertEqual(view.tobytes(), data[offset : offset + 100])
+                view[:5] = b"hello"
+                region.flush()
+
+                with rsfile.rsopen(TESTFN, "RWB", locking=False) as g:
+                    self.assertRaises(rsfile.LockingException, g.lock_file, timeout=0, length=1, offset=offset + 50)
+                    g.lock_file(timeout=0, length=10, offset=0)  # outside of the mapped region
+
+            self.assertTrue(region.closed)
+            region.close()  # idempotent
+            self.assertRaises(ValueError, region.flush)
+
+            # while some exports of the view exist, the region stays mapped and locked
+            region = f.map_region(offset, 100)
+            export = (ctypes.c_char * 1).from_buffer(region.view)  # writable mapping
+            self.assertRaises(BufferError, region.close)
+            self.assertFalse(region.closed)
+            with rsfile.rsopen(TESTFN, "RWB", locking=False) as g:
+                self.assertRaises(rsfile.LockingException, g.lock_file, timeout=0, length=1, offset=offset + 50)
+            del export
+            region.close()  # retrying works
+            self.assertTrue(region.closed)
+
+            self.assertEqual(f.read_at(offset, 5), b"hello")
+            with f.lock_file(timeout=0, length=100, offset=offset):  # the region was unlocked
+                pass
+
+            with f.map_region(0, 10, shared=True, populate=True) as view:  # read-only mapping
+                self.assertTrue(view.readonly)
+                self.assertEqual(view.tobytes(), data[:10])
+
+            with f.map_region(offset, 5, access=mmap.ACCESS_COPY, locking=False) as view:
+                view[:] = b"world"  # private copy, not written to the file
+            self.assertEqual(f.read_at(offset, 5), b"hello")
+
+        with rsfile.rsopen(TESTFN, "RB", locking=False) as f:
+            with f.map_region(0, 10) as view:  # read-only streams get shared locks and read-only mappings
+                self.assertTrue(view.readonly)
+            self.assertRaises(IOError, f.map_region, 0, 10, shared=False, access=mmap.ACCESS_WRITE, locking=False)
+
+        with rsfile.rsopen(TESTFN, "RT", locking=False) as f:  # text streams forward the call
+            with f.map_region(0, 10) as view:
+                self.assertEqual(view.tobytes(), data[:10])
+
+    def testAccessPatternHints(self):
+
+        rsfile.write_to_file(TESTFN, b"abcdef" * 1000)
+
+        with rsfile.rsopen(TESTFN, "RWB", locking=False) as f:
+            for pattern in defs.FILE_ACCESS_PATTERNS:
+                f.advise(pattern)
+                f.advise(pattern, offset=10, length=100)
+            self.assertRaises(defs.BadValueTypeError, f.advise, "whatever")
+            self.assertRaises(defs.BadValueTypeError, f.advise, "random", offset=-1)
+            self.assertRaises(defs.BadValueTypeError, f.advise, "random", length=-1)
+
+        with rsfile.rsopen(TESTFN, "RT", locking=False) as f:
+            f.advise("willneed")
+        self.assertRaises(ValueError, f.advise, "willneed")  # closed stream
+
+        other_args = dict(fileno=None, handle=None, closefd=None)
+        (raw_kwargs, extended_kwargs) = rsfile.parse_advanced_args("dummy", "RBQD", **other_args)
+        self.assertTrue(extended_kwargs["sequential"])
+        self.assertTrue(extended_kwargs["drop_cache"])
+        (raw_kwargs, extended_kwargs) = rsfile.parse_standard_args("dummy", "rb", **other_args)
+        self.assertFalse(extended_kwargs["sequential"])
+        self.assertFalse(extended_kwargs["drop_cache"])
+
+        advices = []
+        original_inner_advise = rsfile.RSFileIO._inner_advise
+
+        def recording_inner_advise(self, pattern, offset, length):
+            advices.append((pattern, offset, length))
+            return original_inner_advise(self, pattern, offset, length)
+
+        rsfile.RSFileIO._inner_advise = recording_inner_advise
+        try:
+            with rsfile.rsopen(TESTFN, "RBQD") as f:
+                self.assertEqual(advices, [("sequential", 0, None)])
+                self.assertEqual(f.read(), b"abcdef" * 1000)
+            self.assertEqual(advices, [("sequential", 0, None), ("dontneed", 0, None)])
+
+            del advices[:]
+            with rsfile.rsopen(TESTFN, "RB"):
+                pass
+            self.assertEqual(advices, [])
+        finally:
+            rsfile.RSFileIO._inner_advise = original_inner_advise
+
+    def testPreallocationAndHolePunching(self):
+
+        block = 64 * 1024
+
+        with rsfile.rsopen(TESTFN, "RWBE", buffering=0, locking=False) as f:
+
+            self.assertEqual(f.truncate(10 * block, zero_fill=False), 10 * block)
+            self.assertEqual(f.read_at(5 * block, block), b"\0" * block)  # posix_fallocate() zero-fills anyway
+
+            self.assertEqual(f.preallocate(8 * block, 4 * block), 12 * block)
+            self.assertEqual(f.preallocate(0, block), 12 * block)  # no shrinking
+            self.assertEqual(f.preallocate(0, 0), 12 * block)
+            self.assertEqual(f.tell(), 0)
+            self.assertRaises(defs.BadValueTypeError, f.preallocate, -1, 10)
+
+            data = os.urandom(4 * block)
+            f.write_at(0, data)
+
+            f.punch_hole(block, 2 * block)
+            self.assertEqual(f.size(), 12 * block)
+            self.assertEqual(f.read_at(0, 4 * block), data[:block] + b"\0" * 2 * block + data[3 * block :])
+
+            f.punch_hole(11 * block, 10 * block)  # never changes file size
+            self.assertEqual(f.size(), 12 * block)
+            f.punch_hole(20 * block, block)  # beyond end of file
+            self.assertRaises(defs.BadValueTypeError, f.punch_hole, 0, -1)
+
+            # generic fallback, overwriting with zeros and preserving the file pointer
+            f.seek(17)
+            rsfile.rsfileio_abstract.RSFileIOAbstract._inner_punch_hole(f, 3 * block + 10, block + 5)
+            self.assertEqual(f.tell(), 17)
+            self.assertEqual(f.read_at(3 * block, block + 20), data[3 * block : 3 * block + 10] + b"\0" * (block + 10))
+
+        with rsfile.rsopen(TESTFN, "RBN", locking=False) as f:
+            self.assertRaises(IOError, f.preallocate, 0, 10)  # not writable
+            self.assertRaises(IOError, f.punch_hole, 0, 10)
+
+        with rsfile.rsopen(TESTFN, "RAB", locking=False) as f:
+            f.write(b"abc")
+            f.punch_hole(0, block)  # buffers get flushed first
+            self.assertEqual(f.read_at(0, 10), b"\0" * 10)
+            self.assertEqual(f.size(), 12 * block + 3)
+
+    def testFileCopy(self):
+
+        block = 64 * 1024
+        first_data, second_data = os.urandom(block), os.urandom(block)
+        expected = first_data + b"\0" * 4 * block + second_data + b"\0" * 2 * block
+        target_name = TESTFN + ".temp"
+
+        with rsfile.rsopen(TESTFN, "RWBE", buffering=0, locking=False) as f:  # sparse file, if possible
+            f.write_at(0, first_data)
+            f.write_at(5 * block, second_data)
+            f.truncate(8 * block)
+
+            if defs.RSFILE_IMPLEMENTATION == "unix" and hasattr(os, "SEEK_DATA"):
+                segments = f._inner_list_segments(0, 8 * block)
+                self.assertEqual(sum(segment[1] for segment in segments), 8 * block)
+                self.assertTrue(segments[0][2])
+                self.assertFalse(segments[-1][2])  # trailing hole
+                self.assertEqual(f.tell(), 0)
+
+        self.assertEqual(rsfile.copy_file(TESTFN, target_name), 8 * block)
+        self.assertEqual(rsfile.read_from_file(target_name, binary=True), expected)
+
+        rsfile.write_to_file(target_name, b"x" * 10 * block)  # stale content must be overwritten
+        self.assertEqual(rsfile.copy_file(TESTFN, target_name, must_not_create=True, sync=True), 8 * block)
+        self.assertEqual(rsfile.read_from_file(target_name, binary=True), expected)
+        self.assertRaises(IOError, rsfile.copy_file, TESTFN, target_name, must_create=True)
+
+        for locking in (True, False):  # copying a file onto itself must neither hang nor truncate it
+            self.assertRaises(defs.BadValueTypeError, rsfile.copy_file, TESTFN, TESTFN, locking=locking, timeout=1)
+            self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), expected)
+
+        def _failing_copy_method(*args, **kwargs):
+            raise OSError(errno.EXDEV, "Cross-device link")
+
+        # each copy strategy is tried in turn
+        from rsfile.rsbackend import unix_stdlib as unix
+
+        for disabled_methods in (["ioctl"], ["ioctl", "copy_file_range"], ["ioctl", "copy_file_range", "sendfile"]):
+            backups = dict((name, getattr(unix, name)) for name in disabled_methods if hasattr(unix, name))
+            try:
+                for name in backups:
+                    setattr(unix, name, _failing_copy_method)
+
+                with rsfile.rsopen(TESTFN, "RB", locking=False) as source:
+                    with rsfile.rsopen(target_name, "RWB", locking=False) as target:
+
+                        target.write(b"y" * 10)  # pending data gets flushed before the copy
+                        source.read(5)
+                        self.assertEqual(source.copy_to(target, offset=block - 10, length=20, dst_offset=3), 20)
+                        self.assertEqual(source.tell(), 5)
+                        self.assertEqual(target.tell(), 10)
+                        expected_head = b"yyy" + first_data[-10:] + b"\0" * 10 + first_data[23:30]
+                        self.assertEqual(target.read_at(0, 30), expected_head)
+
+                        self.assertEqual(source.copy_to(target, offset=5 * block, length=100 * block), 3 * block)
+                        self.assertEqual(target.read_at(5 * block, 3 * block), expected[5 * block :])
+
+                        self.assertEqual(source.copy_to(target, offset=100 * block), 0)  # beyond end of file
+            finally:
+                for (name, value) in backups.items():
+                    setattr(unix, name, value)
+
+        # copied ranges are locked during the copy, and the mutex of the target's thread-safe wrapper is held
+        with rsfile.rsopen(TESTFN, "RB", locking=False) as source:
+            with rsfile.rsopen(target_name, "RWB", locking=False) as target:
+                unique_ids = (source.unique_id(), target.unique_id())
+                observations = []
+                original_inner_copy_to = source.raw._inner_copy_to
+
+                def get_held_locks():
+                    return [
+                        (record["unique_id"] == source.unique_id(), lock["shared"], lock["start"], lock["end"])
+                        for record in rsfile.dump_lock_state()
+                        if record["unique_id"] in unique_ids
+                        for lock in record["locks"]
+                    ]
+
+                def try_target_mutex():
+                    if target.mutex.acquire(False):
+                        target.mutex.release()
+                        observations.append("target mutex free")
+
+                def observing_copy_to(*args):
+                    observations.extend(get_held_locks())
+                    thread = threading.Thread(target=try_target_mutex)
+                    thread.start()
+                    thread.join()
+                    return original_inner_copy_to(*args)
+
+                source.raw._inner_copy_to = observing_copy_to
+                self.assertEqual(source.copy_to(target, offset=block, length=20, dst_offset=3), 20)
+                self.assertEqual(sorted(observations), [(False, False, 3, 23), (True, True, block, block + 20)])
+                self.assertEqual(get_held_locks(), [])
+
+                del observations[:]
+                self.assertEqual(source.copy_to(target, offset=block, length=20, dst_offset=3, locking=False), 20)
+                self.assertEqual(observations, [])
+
+                with target.lock_file(length=10, offset=0):  # our own locks would conflict
+                    self.assertRaises(RuntimeError, source.copy_to, target, offset=0, length=10)
+                    source.copy_to(target, offset=0, length=10, locking=False)
+
+        with rsfile.rsopen(TESTFN, "RWB", locking=False) as f:
+            self.assertRaises(defs.BadValueTypeError, f.copy_to, f, offset=0, length=10, dst_offset=5)  # overlap
+            f.copy_to(f, offset=0, length=10, dst_offset=10 * block)
+            self.assertEqual(f.read_at(10 * block, 20), first_data[:10])
+            self.assertRaises(defs.BadValueTypeError, f.copy_to, object())
+            self.assertRaises(defs.BadValueTypeError, f.copy_to, f, offset=-1)
+
+            with rsfile.rsopen(target_name, "AB", locking=False) as target:
+                self.assertRaises(IOError, f.copy_to, target)
+            with rsfile.rsopen(target_name, "RBN", locking=False) as target:
+                self.assertRaises(IOError, f.copy_to, target)  # not writable
+            with rsfile.rsopen(target_name, "RWT", locking=False) as target:
+                f.copy_to(target, length=10)  # text streams are accepted as target
+                self.assertRaises(defs.BadValueTypeError, target.copy_to, f)
+
+    def testDirectIO(self):
+
+        other_args = dict(fileno=None, handle=None, closefd=None)
+        (raw_kwargs, extended_kwargs) = rsfile.parse_advanced_args("dummy", "RBO", **other_args)
+        self.assertTrue(raw_kwargs["direct"])
+        (raw_kwargs, extended_kwargs) = rsfile.parse_standard_args("dummy", "rb", **other_args)
+        self.assertFalse(raw_kwargs["direct"])
+
+        buffer = rsfile.AlignedBufferPool.acquire(10000)
+        self.assertEqual(len(buffer) % mmap.PAGESIZE, 0)
+        rsfile.AlignedBufferPool.release(buffer)
+        self.assertIs(rsfile.AlignedBufferPool.acquire(10000), buffer)  # reused
+        rsfile.AlignedBufferPool.release(buffer)
+
+        try:
+            rsfile.rsopen(TESTFN, "WBO", locking=False).close()
+        except EnvironmentError:
+            self.skipTest("Filesystem doesn't support O_DIRECT")
+
+        data = os.urandom(3 * defs.DIRECT_IO_BUFFER_SIZE + 123)
+
+        with rsfile.rsopen(TESTFN, "WBEO", locking=False) as f:
+            alignment = f.raw._direct_alignment
+            if not alignment:
+                self.skipTest("No O_DIRECT on this platform")
+            self.assertEqual(f.buffer_size % alignment, 0)
+
+            written_lengths = []
+            original_write = f.raw.write
+
+            def recording_write(buffer):
+                written_lengths.append(len(buffer))
+                return original_write(buffer)
+
+            f.raw.write = recording_write
+            for i in range(0, len(data), 7777):
+                f.write(data[i : i + 7777])
+            self.assertTrue(all(length % alignment == 0 for length in written_lengths), written_lengths)
+            self.assertLess(len(written_lengths), 10)
+        self.assertEqual(sum(written_lengths), len(data))  # the tail was written on close
+
+        with rsfile.rsopen(TESTFN, "RBO", locking=False) as f:
+            self.assertEqual(f.read(), data)
+
+        # raw writes which fail midway, or make no progress, never lead to data being written twice or lost
+        with rsfile.rsopen(TESTFN, "WBEO", locking=False) as f:
+            original_write = f.raw.write
+            calls = []
+
+            def failing_write(buffer):
+                calls.append(len(buffer))
+                if len(calls) > 1:
+                    raise IOError(errno.ENOSPC, "No space left on device")
+                return original_write(buffer[:alignment])  # short write
+
+            f.raw.write = failing_write
+            self.assertRaises(IOError, f.write, data[: f.buffer_size])
+            self.assertEqual(calls, [f.buffer_size, f.buffer_size - alignment])
+
+            f.raw.write = lambda buffer: 0
+            self.assertEqual(f.write(data[f.buffer_size : 2 * f.buffer_size]), f.buffer_size)  # no endless loop
+            f.raw.write = lambda buffer: None
+            self.assertRaises(BlockingIOError, f.write, data[2 * f.buffer_size :])
+            f.raw.write = original_write
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), data)
+
+        # unaligned parts go through bounce buffers, the status flags of the open file description are never changed
+        from rsfile.rsbackend import unix_stdlib
+
+        original_fcntl = unix_stdlib.fcntl
+        fcntl_commands = []
+
+        def recording_fcntl(fd, command, *args):
+            fcntl_commands.append(command)
+            return original_fcntl(fd, command, *args)
+
+        unix_stdlib.fcntl = recording_fcntl
+        try:
+            with rsfile.rsopen(TESTFN, "RWBO", buffering=0, locking=False) as f:
+                self.assertLessEqual(f._direct_alignment, mmap.PAGESIZE)  # bounce buffers always hold whole blocks
+                del fcntl_commands[:]
+                f.seek(100)
+                self.assertEqual(f.read(10000), data[100:10100])
+                self.assertEqual(f.tell(), 10100)
+                self.assertEqual(f.readall(), data[10100:])
+
+                f.seek(alignment - 10)
+                self.assertEqual(f.write(b"x" * 3 * alignment), 3 * alignment)
+                self.assertEqual(f.tell(), 4 * alignment - 10)
+                self.assertEqual(fcntl_commands, [])
+        finally:
+            unix_stdlib.fcntl = original_fcntl
+
+        with rsfile.rsopen(TESTFN, "RWBO", buffering=0, locking=False) as f:
+
+            aligned_buffer = rsfile.AlignedBufferPool.acquire(alignment)
+            try:
+                f.seek(0)
+                self.assertEqual(f.readinto(aligned_buffer), alignment)  # no bounce buffer needed
+                self.assertEqual(aligned_buffer[-10:].tobytes(), b"x" * 10)
+            finally:
+                rsfile.AlignedBufferPool.release(aligned_buffer)
+
+        with rsfile.rsopen(TESTFN, "RWBO", locking=False) as f:
+            expected = data[: alignment - 10] + b"x" * 3 * alignment + data[4 * alignment - 10 :]
+            self.assertEqual(f.read(), expected)
+            f.seek(5)
+            f.write(b"abc")
+            f.writev([b"de", b"f"])
+            f.seek(0)
+            self.assertEqual(f.read(11), expected[:5] + b"abcdef")
+
+        # positional and vectored transfers use bounce buffers for unaligned areas, not the OS cache
+        with rsfile.rsopen(TESTFN, "RWBO", buffering=0, locking=False, thread_safe=False) as f:
+            expected = bytearray(expected[:5] + b"abcdef" + expected[11:])
+            self.assertEqual(f.read_at(alignment - 3, 2 * alignment), expected[alignment - 3 : 3 * alignment - 3])
+            target = bytearray(100)
+            self.assertEqual(f.readinto_at(7, target), 100)
+            self.assertEqual(target, expected[7:107])
+            targets = [bytearray(10), bytearray(alignment)]
+            self.assertEqual(f.readv_at(alignment + 1, targets), alignment + 10)
+            self.assertEqual(b"".join(targets), expected[alignment + 1 : 2 * alignment + 11])
+            f.seek(3)
+            targets = [bytearray(5), bytearray(7)]
+            self.assertEqual(f.readv(targets), 12)
+            self.assertEqual(b"".join(targets), expected[3:15])
+
+            self.assertEqual(f.write_at(alignment - 2, b"12345"), 5)  # straddles a block boundary
+            expected[alignment - 2 : alignment + 3] = b"12345"
+            self.assertEqual(f.writev_at(2 * alignment, [b"ab", b"c" * alignment]), alignment + 2)
+            expected[2 * alignment : 3 * alignment + 2] = b"ab" + b"c" * alignment
+            f.seek(1)
+            self.assertEqual(f.writev([b"U", b"V"]), 2)
+            expected[1:3] = b"UV"
+
+            size = len(expected)
+            self.assertEqual(f.write_at(size + 10, b"tail"), 4)  # partial blocks mustn't extend the file further
+            expected += bytes(10) + b"tail"
+            self.assertEqual(f.size(), len(expected))
+            self.assertEqual(f.read_at(size - 50, 100), expected[size - 50 :])
+
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), expected)
+
+        # write-only streams rewrite the partial block left by a flush
+        with rsfile.rsopen(TESTFN, "WBEO", locking=False) as f:
+            f.write(data[:100])
+            f.flush()
+            f.write(data[100 : 3 * alignment])
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), data[: 3 * alignment])
+
+        # appends can't rewrite unaligned tails in place, so they go through the OS cache
+        with rsfile.rsopen(TESTFN, "ABO", locking=False) as f:
+            self.assertFalse(f.raw._direct_alignment)
+            f.write(b"end")
+        self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), data[: 3 * alignment] + b"end")
+
     def testNewAccessors(self):
 
         with io.open(TESTFN, "wb", buffering=0) as f:
@@ -613,6 +1293,63 @@ class TestRSFileStreams(unittest.TestCase):
         print (int(os.fstat(f.fileno()).st_mtime))
         """
 
+    def testStatCaching(self):
+
+        old_options = rsfile.get_rsfile_options()
+        try:
+            with rsfile.rsopen(TESTFN, "RWEB", buffering=0, thread_safe=False) as f:
+                self.assertFalse(f.stat_caching)  # disabled by default
+                f.write(b"abc")
+                stats = f.stat()
+                self.assertEqual(stats.st_size, 3)
+                self.assertEqual(stats.st_mtime_ns, os.stat(TESTFN).st_mtime_ns)
+                times = f.times()
+                self.assertEqual(times.modification_time_ns, stats.st_mtime_ns)
+                self.assertEqual(times, f.times())
+                if times.modification_time_ns is not None:
+                    changed_times = copy.copy(times)
+                    changed_times.modification_time_ns += 1  # beyond the precision of float timestamps
+                    self.assertNotEqual(times, changed_times)
+
+                rsfile.append_to_file(TESTFN, b"defg", locking=False)  # from another stream
+                self.assertEqual(f.size(), 7)
+                self.assertIsNot(f.stat(), f.stat())
+
+            rsfile.set_rsfile_options(stat_caching=True)
+            with rsfile.rsopen(TESTFN, "RWB", buffering=0, thread_safe=False, locking=False) as f:
+                self.assertTrue(f.stat_caching)
+                stats = f.stat()
+                self.assertIs(f.stat(), stats)
+                self.assertEqual(f.size(), 7)
+
+                # changes from elsewhere are only seen after an explicit refresh
+                rsfile.append_to_file(TESTFN, b"hi", locking=False)
+                self.assertEqual(f.size(), 7)
+                self.assertEqual(f.times().modification_time_ns, stats.st_mtime_ns)
+                self.assertEqual(f.stat(refresh=True).st_size, 9)
+                self.assertEqual(f.size(), 9)
+
+                # own writes, truncations and lock acquisitions invalidate the cache
+                f.seek(0, os.SEEK_END)
+                f.write(b"j")
+                self.assertEqual(f.size(), 10)
+                f.truncate(5)
+                self.assertEqual(f.size(), 5)
+                f.write_at(10, b"k")
+                self.assertEqual(f.size(), 11)
+                rsfile.append_to_file(TESTFN, b"l", locking=False)
+                self.assertEqual(f.size(), 11)
+                with f.lock_file():
+                    self.assertEqual(f.size(), 12)
+
+            # buffered streams flush their data first
+            with rsfile.rsopen(TESTFN, "RWB", locking=False) as f:
+                f.seek(0, os.SEEK_END)
+                f.write(b"m")
+                self.assertEqual(f.stat().st_size, 13)
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
     def testCloseFdAndOrigins(self):
 
         f = io.open(TESTFN, "wb", buffering=0)  # low-level default python open()
@@ -846,6 +1583,63 @@ class TestRSFileStreams(unittest.TestCase):
         else:
             assert inspect.ismethod(opener)  # Is a BOUND method
 
+    @unittest.skipIf(os.name == "nt", "test only works on a POSIX-like system")
+    def testOpenSyscallCount(self):
+
+        from rsfile.rsbackend import unix_stdlib
+
+        calls = []
+        patched = [(unix_stdlib, name) for name in ("open", "fstat", "stat", "lseek", "fcntl", "close")]
+        patched += [(os, name) for name in ("fstat", "lseek", "isatty", "set_inheritable")]
+        originals = [(module, name, getattr(module, name)) for (module, name) in patched]
+
+        def counting(name, function):
+            def wrapper(*args, **kwargs):
+                calls.append(name)
+                return function(*args, **kwargs)
+
+            return wrapper
+
+        def get_calls(mode, **kwargs):
+            del calls[:]
+            for (module, name, function) in originals:
+                setattr(module, name, counting(name, function))
+            try:
+                f = rsfile.rsopen(TESTFN, mode, locking=False, **kwargs)
+            finally:
+                for (module, name, function) in originals:
+                    setattr(module, name, function)
+            f.close()
+            return sorted(calls)
+
+        old_options = rsfile.get_rsfile_options()
+        try:
+            for backend in ("posix", "ofd"):
+                if backend == "ofd" and not hasattr(unix_stdlib, "ofd_lockf"):
+                    continue
+                rsfile.set_rsfile_options(unix_locking_backend=backend)
+
+                # a single stat snapshot serves all opening checks, and O_CLOEXEC spares set_inheritable()
+                self.assertEqual(get_calls("RWB"), ["fstat", "open"])
+                self.assertEqual(get_calls("RWB", buffering=0), ["fstat", "open"])
+                self.assertEqual(get_calls("AB"), ["fstat", "open"])  # no seek for empty files in append mode
+                self.assertEqual(get_calls("WEB"), ["fstat", "fstat", "open"])  # truncation checks the current size
+                self.assertEqual(get_calls("RIB", buffering=0, thread_safe=False), ["fstat", "open", "set_inheritable"])
+
+                rsfile.write_to_file(TESTFN, b"abc")
+                with rsfile.rsopen(TESTFN, "AB") as f:
+                    self.assertEqual(f.tell(), 3)
+                    f.write(b"def")
+                self.assertEqual(rsfile.read_from_file(TESTFN, binary=True), b"abcdef")
+
+                with rsfile.rsopen(TESTFN, "RB", buffering=0) as f:
+                    self.assertFalse(f.isatty())
+                    self.assertFalse(os.get_inheritable(f.fileno()))
+                    self.assertEqual(f.unique_id(), (os.stat(TESTFN).st_dev, os.stat(TESTFN).st_ino))
+                _cleanup()
+        finally:
+            rsfile.set_rsfile_options(**old_options)
+
     def testFileInheritance(self):
         # # """Checks that handles are well inherited iff this creation option is set to True"""
         kargs = dict(path=TESTFN, read=False, write=True, append=True, inheritable=True)